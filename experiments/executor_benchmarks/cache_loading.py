@@ -0,0 +1,76 @@
+import logging
+import pathlib
+import tempfile
+import time
+
+import attrs
+import hydra
+import pandas as pd
+from hydra.core.config_store import ConfigStore
+
+from llms4de.data import get_experiments_path, dump_str
+from llms4de.model import _cache, _ollama
+from llms4de.model._cache import open_cache, canonical_hash
+
+logger = logging.getLogger(__name__)
+
+
+@attrs.define
+class Config:
+    num_requests: int = 50_000
+    backends: list[str] = ["sqlite", "directory"]
+    hit_ratios: list[float] = [1.0, 0.5, 0.0]
+
+
+ConfigStore.instance().store(name="config", node=Config)
+
+
+@hydra.main(version_base=None, config_name="config")
+def main(cfg: Config) -> None:
+    requests = [
+        {
+            "model": "llama3.1:8b-instruct-fp16",
+            "messages": [{"role": "user", "content": f"Name all prime numbers below {idx}!"}],
+            "stream": False,
+            "options": {"temperature": 0, "seed": 321164097}
+        } for idx in range(cfg.num_requests)
+    ]
+    response = {"message": {"role": "assistant", "content": "This is the response."}, "done": True}
+
+    results = []
+    for backend in cfg.backends:
+        for hit_ratio in cfg.hit_ratios:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                _cache.CACHE_BACKEND = backend
+                _ollama.OLLAMA_CACHE_PATH = pathlib.Path(tmp_dir) / "ollama_cache"
+                num_cached = int(cfg.num_requests * hit_ratio)
+                open_cache(_ollama.OLLAMA_CACHE_PATH).store_many(
+                    [(canonical_hash(request), request, response) for request in requests[:num_cached]]
+                )
+                _cache._caches.clear()  # the first call of a process must load the index
+
+                hashes = [_ollama._Request(request).hash() for request in requests]
+                before = time.perf_counter()
+                cached_pairs = open_cache(_ollama.OLLAMA_CACHE_PATH).load_many(hashes)
+                seconds = time.perf_counter() - before
+                assert len(cached_pairs) == num_cached
+                logger.info(f"{backend} with hit ratio {hit_ratio}: {cfg.num_requests / seconds:.0f} pairs/sec")
+                results.append({
+                    "backend": backend,
+                    "hit ratio": hit_ratio,
+                    "load_many pairs/sec": round(cfg.num_requests / seconds)
+                })
+
+                # the API helper's benchmark hook reports the throughput of the whole "load responses" phase
+                if hit_ratio == 1.0:
+                    _ollama._do_benchmark = True
+                    _ollama.ollama_execute(requests, silent=True)
+                    _ollama._do_benchmark = False
+
+    results = pd.DataFrame(results)
+    logger.info(f"results for {cfg.num_requests} requests:\n{results}")
+    dump_str(str(results), get_experiments_path() / "executor_benchmarks" / "cache_loading.txt")
+
+
+if __name__ == "__main__":
+    main()
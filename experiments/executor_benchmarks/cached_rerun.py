@@ -0,0 +1,96 @@
+import logging
+import os
+import pathlib
+import tempfile
+import time
+
+import attrs
+import hydra
+import pandas as pd
+from hydra.core.config_store import ConfigStore
+
+from llms4de.data import get_experiments_path, dump_str
+from llms4de.model import _openai
+from llms4de.model._cache import open_cache, canonical_hash
+
+logger = logging.getLogger(__name__)
+
+
+@attrs.define
+class Config:
+    num_requests: int = 50_000
+    model: str = "gpt-4o-mini-2024-07-18"
+    num_words: int = 500  # words per prompt
+    tokenizer_threads: int = 8  # threads for tiktoken's `encode_batch` in the batched phase
+
+
+ConfigStore.instance().store(name="config", node=Config)
+
+
+@hydra.main(version_base=None, config_name="config")
+def main(cfg: Config) -> None:
+    requests = [
+        {
+            "model": cfg.model,
+            "max_tokens": 10,
+            "temperature": 0,
+            "messages": [
+                {"role": "system", "content": "You are a helpful assistant."},
+                {"role": "user", "content": " ".join(f"word{idx + jdx}" for jdx in range(cfg.num_words))}
+            ],
+            "seed": 321164097
+        } for idx in range(cfg.num_requests)
+    ]
+    response = {"choices": [{"message": {"role": "assistant", "content": "This is the response."}}], "model": cfg.model}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        _openai.CACHE_PATH = pathlib.Path(tmp_dir) / "openai_cache"
+        open_cache(_openai.CACHE_PATH).store_many([(canonical_hash(request), request, response) for request in requests])
+
+        results = []
+
+        # previously, every request was tokenized one by one before the cache lookup
+        encoding = _openai._get_encoding_cached(cfg.model)
+        before = time.perf_counter()
+        for request in requests:
+            sum(len(encoding.encode(message["content"])) + 5 for message in request["messages"])
+        results.append({"phase": "tokenize all requests one by one", "seconds": time.perf_counter() - before})
+
+        # now, only cache misses are tokenized, in chunks, one text at a time or with `encode_batch`
+        for phase, num_threads in [
+            ("tokenize all requests in chunks", 1),
+            (f"tokenize all requests with `encode_batch` ({cfg.tokenizer_threads} threads)", cfg.tokenizer_threads)
+        ]:
+            _openai.TOKENIZER_THREADS = num_threads
+            before = time.perf_counter()
+            for idx in range(0, len(requests), _openai.TOKENIZER_CHUNK_SIZE):
+                _openai._count_input_tokens(
+                    [_openai._Request(request) for request in requests[idx:idx + _openai.TOKENIZER_CHUNK_SIZE]]
+                )
+            results.append({"phase": phase, "seconds": time.perf_counter() - before})
+        _openai.TOKENIZER_THREADS = 1
+
+        # end to end: previously, `openai_execute` tokenized every request one by one before it looked up the cache
+        before = time.perf_counter()
+        for request in requests:
+            sum(len(encoding.encode(message["content"])) + 5 for message in request["messages"])
+        _openai.openai_execute(requests, force=0.0, silent=True)
+        results.append({
+            "phase": "cached rerun of `openai_execute`, baseline (tokenize first)",
+            "seconds": time.perf_counter() - before
+        })
+
+        before = time.perf_counter()
+        _openai.openai_execute(requests, force=0.0, silent=True)
+        results.append({"phase": "cached rerun of `openai_execute`", "seconds": time.perf_counter() - before})
+
+    results = pd.DataFrame(results)
+    results["requests/sec"] = (cfg.num_requests / results["seconds"]).round()
+    results = f"{cfg.num_requests} cached requests of {cfg.num_words} words for `{cfg.model}` on {os.cpu_count()} " \
+              f"CPUs:\n{results.to_string()}"
+    logger.info(f"results for {results}")
+    dump_str(results, get_experiments_path() / "executor_benchmarks" / "cached_rerun.txt")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import logging
+import time
+
+import attrs
+import hydra
+import pandas as pd
+import requests
+from hydra.core.config_store import ConfigStore
+
+from llms4de.data import get_experiments_path, dump_str
+from llms4de.model._executor import map_concurrently
+from llms4de.model._http import http_post, close_connections
+from llms4de.model._mock_server import MockServer
+
+logger = logging.getLogger(__name__)
+
+
+@attrs.define
+class Config:
+    num_requests: int = 2_000
+    concurrency: list[int] = [1, 20, 200]
+    latency: float = 0.0
+
+
+ConfigStore.instance().store(name="config", node=Config)
+
+
+@hydra.main(version_base=None, config_name="config")
+def main(cfg: Config) -> None:
+    request = {
+        "model": "llama3.1:8b-instruct-fp16",
+        "messages": [{"role": "user", "content": "Name all prime numbers below 10!"}],
+        "stream": False
+    }
+
+    results = []
+    for concurrency in cfg.concurrency:
+        for client, post in [("requests.post", requests.post), ("pooled session", http_post)]:
+            close_connections()
+            with MockServer(latency=cfg.latency) as server:
+                url = f"{server.url}/api/chat"
+                before = time.perf_counter()
+                map_concurrently(lambda _: post(url, json=request), range(cfg.num_requests), max_running=concurrency)
+                seconds = time.perf_counter() - before
+                logger.info(f"{client} with concurrency {concurrency}: {cfg.num_requests / seconds:.0f} requests/sec")
+                results.append({
+                    "client": client,
+                    "concurrency": concurrency,
+                    "requests/sec": round(cfg.num_requests / seconds),
+                    "connections": server.num_connections
+                })
+
+    results = pd.DataFrame(results)
+    logger.info(f"results:\n{results}")
+    dump_str(str(results), get_experiments_path() / "executor_benchmarks" / "connection_pooling.txt")
+
+
+if __name__ == "__main__":
+    main()
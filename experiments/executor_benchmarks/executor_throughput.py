@@ -0,0 +1,126 @@
+import logging
+import math
+import os
+import pathlib
+import tempfile
+import time
+
+import attrs
+import hydra
+import pandas as pd
+from hydra.core.config_store import ConfigStore
+
+from llms4de.data import get_experiments_path, dump_str
+from llms4de.model import _anthropic, _openai, _ollama
+from llms4de.model._executor import _percentile
+from llms4de.model._http import close_connections
+from llms4de.model._mock_server import MockServerProcess
+from llms4de.model.generic import execute_requests
+
+logger = logging.getLogger(__name__)
+
+# "CPU ms/request" covers the whole process, which is mostly spent in the HTTP client, since anthropic_execute sends
+# two requests (token counting and message) per request, while "scheduler CPU ms/request" covers only the event loop
+# of `execute_pairs`. The mock server runs in another process on the same CPUs.
+SCENARIOS = {  # arguments of the mock server
+    "fast": {},
+    "slow": {"latency": 0.1, "latency_sigma": 0.5, "slow_rate": 0.01, "slow_latency": 5.0},
+    "rate_limited": {"latency": 0.05, "rpm": 6_000, "tpm": 2_000_000},
+    "errors": {"latency": 0.05, "rate_limit_rate": 0.01, "server_error_rate": 0.01}
+}
+
+
+@attrs.define
+class Config:
+    num_requests: list[int] = [1_000, 10_000, 100_000, 1_000_000]
+    scenarios: list[str] = ["fast", "slow", "rate_limited", "errors"]
+    api_name: str = "anthropic"  # "openai" requires the tiktoken encodings
+    model: str = "claude-3-5-haiku-20241022"
+
+
+ConfigStore.instance().store(name="config", node=Config)
+
+
+def _run(cfg: Config, scenario: str, num_requests: int, tmp_dir: pathlib.Path) -> dict:
+    requests = [
+        {
+            "model": cfg.model,
+            "max_tokens": 10,
+            "temperature": 0,
+            "messages": [{"role": "user", "content": f"Name the prime number number {idx}!"}]
+        } for idx in range(num_requests)
+    ]
+
+    # record the latency and completion time of each pair
+    api_helper = {"openai": _openai, "anthropic": _anthropic, "ollama": _ollama}[cfg.api_name]
+    execute_pairs = api_helper.execute_pairs
+    done_at = []
+    scheduler_cpu_seconds = []  # the scheduler runs in the calling thread, the HTTP requests in its thread pool
+
+    def recording_execute_pairs(pairs: list, *, on_done=None, **kwargs) -> None:
+        def record(pair) -> None:
+            done_at.append((time.perf_counter(), pair.latency))
+            if on_done is not None:
+                on_done(pair)
+
+        before_thread_cpu = time.thread_time()
+        try:
+            execute_pairs(pairs, on_done=record, **kwargs)
+        finally:
+            scheduler_cpu_seconds.append(time.thread_time() - before_thread_cpu)
+
+    close_connections()
+    with MockServerProcess(**SCENARIOS[scenario]) as server:
+        for module in (_openai, _anthropic):
+            module.BASE_URL = f"{server.url}/v1"
+            module.CACHE_PATH = tmp_dir / f"{scenario}-{num_requests}" / "cache"
+            module.RATE_LIMITS_PATH = tmp_dir / f"{scenario}-{num_requests}" / "rate_limits"
+            module._local_context = {}
+        _ollama.OLLAMA_URL = server.url
+        _ollama.OLLAMA_CACHE_PATH = tmp_dir / f"{scenario}-{num_requests}" / "cache"
+        _ollama._local_context = {}
+        api_helper.execute_pairs = recording_execute_pairs
+        try:
+            before, before_cpu = time.perf_counter(), time.process_time()
+            execute_requests(requests, cfg.api_name, force=1_000_000.0)
+            seconds, cpu_seconds = time.perf_counter() - before, time.process_time() - before_cpu
+        finally:
+            api_helper.execute_pairs = execute_pairs
+
+    latencies = [latency for _, latency in done_at if latency is not None]
+    last_started_at = max(at - latency for at, latency in done_at if latency is not None)
+    return {
+        "scenario": scenario,
+        "requests": num_requests,
+        "requests/sec": num_requests / seconds,
+        "CPU ms/request": cpu_seconds * 1_000 / num_requests,
+        "scheduler CPU ms/request": sum(scheduler_cpu_seconds) * 1_000 / num_requests,
+        "p50 latency": _percentile(latencies, 0.5),
+        "p99 latency": _percentile(latencies, 0.99),
+        "drain seconds": max(at for at, _ in done_at) - last_started_at,
+        "seconds": seconds,
+        "429 errors": server.counters["num_rate_limit_errors"]
+    }
+
+
+@hydra.main(version_base=None, config_name="config")
+def main(cfg: Config) -> None:
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    os.environ.setdefault("ANTHROPIC_API_KEY", "mock")
+    logging.getLogger("llms4de").setLevel(logging.WARNING)  # the API helpers log every run
+    _anthropic.COUNT_TOKENS_RPM = math.inf  # the mock server does not limit token counting
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_requests in cfg.num_requests:
+            for scenario in cfg.scenarios:
+                results.append(_run(cfg, scenario, num_requests, pathlib.Path(tmp_dir)))
+                logger.info(results[-1])
+
+    results = pd.DataFrame(results).round(3)
+    logger.info(f"results for `{cfg.api_name}`:\n{results.to_string()}")
+    dump_str(results.to_string(), get_experiments_path() / "executor_benchmarks" / "executor_throughput.txt")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+import time
+
+import attrs
+import hydra
+import pandas as pd
+from hydra.core.config_store import ConfigStore
+
+from llms4de.data import get_experiments_path, dump_str
+from llms4de.model import _anthropic
+from llms4de.model._executor import execute_pairs, _percentile
+from llms4de.model._http import close_connections
+from llms4de.model._mock_server import MockServer
+
+logger = logging.getLogger(__name__)
+
+
+@attrs.define
+class Config:
+    num_requests: int = 2_000
+    max_running: int = 20
+    latency: float = 0.05  # latency of most requests
+    slow_rate: float = 0.01  # fraction of requests that hit a slow replica
+    slow_latency: float = 2.0  # latency of the slow requests
+    hedge_percentiles: list[float | None] = [None, 0.9, 0.95, 0.99]
+    model: str = "claude-3-5-haiku-20241022"
+
+
+ConfigStore.instance().store(name="config", node=Config)
+
+
+@hydra.main(version_base=None, config_name="config")
+def main(cfg: Config) -> None:
+    os.environ.setdefault("ANTHROPIC_API_KEY", "mock")
+    results = []
+    for hedge_percentile in cfg.hedge_percentiles:
+        close_connections()
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                MockServer(latency=cfg.latency, slow_rate=cfg.slow_rate, slow_latency=cfg.slow_latency) as server:
+            _anthropic.BASE_URL = f"{server.url}/v1"
+            _anthropic.CACHE_PATH = pathlib.Path(tmp_dir) / "anthropic_cache"
+            pairs = [
+                _anthropic._Pair(_anthropic._Request({
+                    "model": cfg.model,
+                    "max_tokens": 10,
+                    "temperature": 0,
+                    "messages": [{"role": "user", "content": f"Name the prime number number {idx}!"}]
+                })) for idx in range(cfg.num_requests)
+            ]
+
+            before = time.perf_counter()
+            with _anthropic._ProgressBar(total=len(pairs), disable=True) as progress_bar:
+                execute_pairs(
+                    pairs,
+                    context={"num_running": 0},
+                    semaphore=threading.Semaphore(),
+                    progress_bar=progress_bar,
+                    response_cls=_anthropic._Response,
+                    max_running=cfg.max_running,
+                    hedge_percentile=hedge_percentile
+                )
+            seconds = time.perf_counter() - before
+
+            latencies = [pair.latency for pair in pairs]
+            results.append({
+                "hedge_percentile": "off" if hedge_percentile is None else hedge_percentile,
+                "p50 latency": _percentile(latencies, 0.5),
+                "p99 latency": _percentile(latencies, 0.99),
+                "max latency": max(latencies),
+                "wall seconds": seconds,
+                "server requests": server.num_requests
+            })
+            logger.info(results[-1])
+
+    results = pd.DataFrame(results).round(3)
+    logger.info(f"results for {cfg.num_requests} requests, {cfg.slow_rate:.0%} of them take {cfg.slow_latency} seconds "
+                f"instead of {cfg.latency} seconds:\n{results.to_string()}")
+    dump_str(results.to_string(), get_experiments_path() / "executor_benchmarks" / "hedged_requests.txt")
+
+
+if __name__ == "__main__":
+    main()
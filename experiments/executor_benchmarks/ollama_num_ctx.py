@@ -0,0 +1,76 @@
+import logging
+import pathlib
+import tempfile
+import time
+
+import attrs
+import hydra
+import pandas as pd
+from hydra.core.config_store import ConfigStore
+
+from llms4de.data import get_experiments_path, dump_str
+from llms4de.model import _ollama, generic
+from llms4de.model._http import http_get, http_post
+from llms4de.model.generic import execute_requests
+
+logger = logging.getLogger(__name__)
+
+
+# requires a running Ollama server at `_ollama.OLLAMA_URL` that hosts the model (a manual step in run.sh)
+
+@attrs.define
+class Config:
+    num_requests: int = 200
+    model: str = "llama3.1:8b-instruct-fp16"
+    num_words: int = 300  # words per prompt, similar to the entity matching prompts
+    max_tokens: int = 10
+
+
+ConfigStore.instance().store(name="config", node=Config)
+
+
+@hydra.main(version_base=None, config_name="config")
+def main(cfg: Config) -> None:
+    requests = [
+        {
+            "model": cfg.model,
+            "max_tokens": cfg.max_tokens,
+            "temperature": 0,
+            "messages": [
+                {"role": "user", "content": f"Do these match? {idx} " + " ".join(["word"] * cfg.num_words)}
+            ],
+            "seed": 321164097
+        } for idx in range(cfg.num_requests)
+    ]
+
+    results = []
+    settings = [("fixed num_ctx=128000", None), ("adaptive num_ctx", generic.OLLAMA_ADAPTIVE_NUM_CTX_BUCKETS)]
+    for name, buckets in settings:
+        generic.OLLAMA_NUM_CTX_BUCKETS = buckets
+        _ollama._local_context.clear()  # start with a fresh concurrency limit
+        http_post(f"{_ollama.OLLAMA_URL}/api/generate", json={"model": cfg.model, "keep_alive": 0})  # unload model
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            _ollama.OLLAMA_CACHE_PATH = pathlib.Path(tmp_dir) / "ollama_cache"
+            before = time.perf_counter()
+            execute_requests(requests, "ollama")
+            seconds = time.perf_counter() - before
+
+        running_models = http_get(f"{_ollama.OLLAMA_URL}/api/ps").json()["models"]
+        model = [running_model for running_model in running_models if running_model["name"] == cfg.model][0]
+        results.append({
+            "setting": name,
+            "seconds": seconds,
+            "requests/sec": cfg.num_requests / seconds,
+            "concurrency": _ollama.ollama_concurrency()["limit"],
+            "memory [GB]": model["size"] / 1e9,
+            "VRAM [GB]": model["size_vram"] / 1e9
+        })
+
+    results = pd.DataFrame(results).round(2)
+    logger.info(f"results for {cfg.num_requests} requests with {cfg.num_words} words:\n{results}")
+    dump_str(str(results), get_experiments_path() / "executor_benchmarks" / "ollama_num_ctx.txt")
+
+
+if __name__ == "__main__":
+    main()
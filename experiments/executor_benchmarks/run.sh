@@ -0,0 +1,13 @@
+#!/bin/bash
+
+set -e
+
+python experiments/executor_benchmarks/connection_pooling.py
+python experiments/executor_benchmarks/cached_rerun.py
+python experiments/executor_benchmarks/cache_loading.py
+python experiments/executor_benchmarks/shared_rate_limiter.py
+python experiments/executor_benchmarks/hedged_requests.py
+python experiments/executor_benchmarks/executor_throughput.py
+
+# manual: requires a running Ollama server that hosts the model (see ollama_num_ctx.py), writes ollama_num_ctx.txt
+# python experiments/executor_benchmarks/ollama_num_ctx.py
@@ -0,0 +1,96 @@
+import logging
+import multiprocessing
+import pathlib
+import tempfile
+import time
+import types
+
+import attrs
+import hydra
+import pandas as pd
+from hydra.core.config_store import ConfigStore
+
+from llms4de.data import get_experiments_path, dump_str
+from llms4de.model import _openai
+from llms4de.model._budget import SharedContext
+
+logger = logging.getLogger(__name__)
+
+
+@attrs.define
+class Config:
+    num_processes: list[int] = [8, 32]
+    seconds: float = 5.0  # duration of each setting
+    model: str = "gpt-4o-mini-2024-07-18"
+
+
+ConfigStore.instance().store(name="config", node=Config)
+
+
+def _make_decisions(context, semaphore, barrier, seconds: float, model: str, num_decisions) -> None:
+    """Make the scheduler decisions of `execute_pairs` until the time is up."""
+    request = types.SimpleNamespace(max_input_usage=lambda: 1_000, max_output_usage=lambda: 100)
+    count = 0
+    barrier.wait()
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        with semaphore:
+            if model not in context.keys():
+                context[model] = _openai._ModelBudgetState.new()
+            state = context[model].consider_time()
+            state.is_enough_for_request(request)
+            _ = context["num_running"] < 200
+            context[model] = state
+        count += 1
+    num_decisions.put(count)
+
+
+def _run(context, semaphore, num_processes: int, cfg: Config) -> float:
+    mp_context = multiprocessing.get_context("spawn")
+    barrier = mp_context.Barrier(num_processes)
+    num_decisions = mp_context.Queue()
+    with semaphore:
+        context["num_running"] = 0
+        state = _openai._ModelBudgetState.new()
+        state.rpm, state.tpm, state.r, state.t = 30_000, 150_000_000, 30_000, 150_000_000
+        context[cfg.model] = state
+
+    processes = [
+        mp_context.Process(
+            target=_make_decisions,
+            args=(context, semaphore, barrier, cfg.seconds, cfg.model, num_decisions)
+        ) for _ in range(num_processes)
+    ]
+    for process in processes:
+        process.start()
+    total = sum(num_decisions.get() for _ in processes)
+    for process in processes:
+        process.join()
+    return total / cfg.seconds
+
+
+@hydra.main(version_base=None, config_name="config")
+def main(cfg: Config) -> None:
+    results = []
+    for num_processes in cfg.num_processes:
+        # previously, the header recommended a manager dictionary and semaphore
+        with multiprocessing.get_context("spawn").Manager() as manager:
+            decisions_per_sec = _run(manager.dict(), manager.Semaphore(), num_processes, cfg)
+        results.append({"context": "multiprocessing.Manager", "processes": num_processes,
+                        "decisions/sec": decisions_per_sec})
+        logger.info(results[-1])
+
+        # now, the budgets live in a file that is guarded by a file lock
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            context = SharedContext(pathlib.Path(tmp_dir) / "openai.context")
+            decisions_per_sec = _run(context, context.lock, num_processes, cfg)
+        results.append({"context": "SharedContext", "processes": num_processes, "decisions/sec": decisions_per_sec})
+        logger.info(results[-1])
+
+    results = pd.DataFrame(results).round(0)
+    logger.info(f"results on {multiprocessing.cpu_count()} CPUs:\n{results}")
+    dump_str(str(results), get_experiments_path() / "executor_benchmarks" / "shared_rate_limiter.txt")
+
+
+if __name__ == "__main__":
+    main()
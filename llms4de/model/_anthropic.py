@@ -1,5 +1,5 @@
 ########################################################################################################################
-# Anthropic API helpers version: 2025-02-04
+# Anthropic API helpers version: 2026-10-18
 #
 # use the following methods:
 # anthropic_model(...)        ==> get model info
@@ -7,25 +7,60 @@
 #
 # You must store your Anthropic API key in an environment variable, for example using:
 # export ANTHROPIC_API_KEY="<your-key>"
+#
+# To call anthropic_execute(...) from multiple processes, you must use a global context that shares the budgets of the
+# API key between the processes on this machine:
+# context = SharedContext(shared_context_path("anthropic", os.environ["ANTHROPIC_API_KEY"]))
+# # every call now requires the context and its lock:
+# responses = anthropic_execute(requests, global_context=context, global_semaphore=context.lock)
+#
+# With `mode="batch"`, anthropic_execute(...) submits the uncached requests to the Message Batches API instead, which is
+# half the price but may take up to 24 hours (see _batch.py).
+#
+# Requests that share a prefix (e.g., the same instructions) are executed together, and a `cache_control` breakpoint is
+# inserted at the end of the shared prefix if it is long enough to be cached (see _prefix.py). The breakpoints are only
+# added to the HTTP requests, so they do not change the cache keys.
+#
+# Without a `governor`, anthropic_execute(...) asks for confirmation if the maximum cost exceeds `force`. With a
+# governor, it never asks, but enforces hard limits on the actual cost per run and per day instead (see _governor.py):
+# responses = anthropic_execute(requests, governor=CostGovernor(max_cost_per_run=5.0, max_cost_per_day=50.0))
 ########################################################################################################################
+import collections
+import copy
 import dataclasses
 import functools
-import hashlib
 import json
 import logging
 import os
 import threading
 import time
-from typing import Literal, Any
+from typing import Callable, Literal, Any, Iterator
 
 import requests
 import tqdm
 
 from llms4de.data import get_data_path
+from llms4de.model._batch import BATCH_COST_FACTOR, execute_batches, batch_api_call
+from llms4de.model._budget import OutputLengthEstimate, restore_budget_states, persist_budget_states
+from llms4de.model._cache import open_cache, canonical_hash, canonical_request
+from llms4de.model._executor import execute_pairs, map_concurrently, fold_duplicates, fan_out, fan_out_callback, \
+        release_method_caches
+from llms4de.model._governor import CostGovernor
+from llms4de.model._http import http_post, http_get
+from llms4de.model._prefix import group_by_shared_prefix, prefix_elements
+from llms4de.model._retry import ConcurrencyLimit
+from llms4de.model._telemetry import Telemetry
 
 logger = logging.getLogger(__name__)
 
 CACHE_PATH = get_data_path() / "anthropic_cache"
+RATE_LIMITS_PATH = get_data_path() / "anthropic_rate_limits"  # learned budget states per API key, see _budget.py
+BATCHES_PATH = get_data_path() / "anthropic_batches"  # ids of submitted batches, see _batch.py
+BASE_URL = "https://api.anthropic.com/v1"
+BATCH_MAX_REQUESTS = 100_000  # see https://docs.anthropic.com/en/docs/build-with-claude/batch-processing
+BATCH_MAX_BYTES = 256_000_000
+COUNT_TOKENS_RPM = 4_000  # rate limit of the token counting endpoint
+COUNT_TOKENS_MAX_RUNNING = 20  # max. num. of parallel count token requests
 
 # see https://docs.anthropic.com/en/docs/about-claude/models and https://www.anthropic.com/pricing#anthropic-api
 MODEL_PARAMETERS = {
@@ -35,7 +70,8 @@ MODEL_PARAMETERS = {
         "cost_per_1k_cache_creation_input_tokens": 0.00375,
         "cost_per_1k_cache_read_input_tokens": 0.0003,
         "max_context": 200_000,
-        "max_output_tokens": 8_192
+        "max_output_tokens": 8_192,
+        "min_cache_tokens": 1_024  # minimum length of a cacheable prefix
     },
     "claude-3-5-sonnet-20241022": {
         "cost_per_1k_input_tokens": 0.0030,
@@ -43,7 +79,8 @@ MODEL_PARAMETERS = {
         "cost_per_1k_cache_creation_input_tokens": 0.00375,
         "cost_per_1k_cache_read_input_tokens": 0.0003,
         "max_context": 200_000,
-        "max_output_tokens": 8_192
+        "max_output_tokens": 8_192,
+        "min_cache_tokens": 1_024  # minimum length of a cacheable prefix
     },
     "claude-3-5-haiku-20241022": {
         "cost_per_1k_input_tokens": 0.0008,
@@ -51,7 +88,8 @@ MODEL_PARAMETERS = {
         "cost_per_1k_cache_creation_input_tokens": 0.001,
         "cost_per_1k_cache_read_input_tokens": 0.00008,
         "max_context": 200_000,
-        "max_output_tokens": 8_192
+        "max_output_tokens": 8_192,
+        "min_cache_tokens": 2_048  # minimum length of a cacheable prefix
     }
 }
 
@@ -79,7 +117,14 @@ def anthropic_execute(
         requests: list[dict],
         *,
         force: float | None = None,
-        silent: bool = False
+        silent: bool = False,
+        callback: Callable[[int, dict], None] | None = None,
+        mode: Literal["online"] | Literal["batch"] = "online",
+        hedge_percentile: float | None = None,
+        global_context: dict | None = None,
+        global_semaphore: "multiprocessing.Semaphore | None" = None,
+        governor: CostGovernor | None = None,
+        stop: threading.Event | None = None
 ) -> list[dict]:
     """Execute a list of requests against the Anthropic API.
 
@@ -90,44 +135,76 @@ def anthropic_execute(
         requests: A list of API requests.
         force: An optional float specifying the cost below or equal to which no confirmation should be required.
         silent: Whether to display log messages and progress bars.
+        callback: Optional function that receives the index and response of each request as soon as it is available.
+        mode: Whether to execute the requests one by one ("online") or through the Message Batches API ("batch").
+        hedge_percentile: Optional latency percentile (e.g., 0.95) after which to send a duplicate of a request with
+            `temperature` 0, None to disable hedging.
+        global_context: Optional global context for use with multiprocessing.
+        global_semaphore: Optional global semaphore for use with multiprocessing.
+        governor: Optional cost governor that limits the actual cost instead of asking for confirmation.
+        stop: Optional event after which no more requests are started, e.g., once the responses are no longer needed.
 
     Returns:
         A list of API responses.
     """
     global _local_context, _local_semaphore
-    context = _local_context
-    semaphore = _local_semaphore
+
+    if (global_context is None) != (global_semaphore is None):
+        raise AssertionError("You must provide either both `global_context` and `global_semaphore` or neither!")
+
+    if global_context is not None:
+        context = global_context
+        semaphore = global_semaphore
+    else:
+        context = _local_context
+        semaphore = _local_semaphore
 
     with semaphore:
         if "num_running" not in context.keys():
             context["num_running"] = 0
-        if "num_counting" not in context.keys():
-            context["num_counting"] = 0
 
+    # create pairs, identical requests share one pair
     before = time.perf_counter()
-    pairs = [_Pair(_Request(request)) for request in requests]
+    pairs, positions = fold_duplicates(
+        [_Pair(_Request(request)) for request in requests],
+        key=lambda pair: pair.request.hash()
+    )
     if _do_benchmark:
         logger.info(f"created pairs in {time.perf_counter() - before} seconds")
+    if len(pairs) < len(positions) and not silent:
+        logger.info(f"folded {len(positions) - len(pairs)} duplicate requests into {len(pairs)} unique requests")
+    notify = fan_out_callback(callback, positions)
+    position_by_pair = {id(pair): position for position, pair in enumerate(pairs)}
+    input_tokens = collections.Counter()  # cached and uncached input tokens of the executed requests
 
-    with _ProgressBar(total=len(pairs), desc="", disable=silent) as progress_bar:
+    def on_done(pair: _Pair) -> None:
+        input_tokens["cached"] += pair.response.cached_input_usage()
+        input_tokens["uncached"] += pair.response.input_usage() - pair.response.cached_input_usage()
+        notify(position_by_pair[id(pair)], pair.response.response)
 
-        # create cache directory
-        CACHE_PATH.mkdir(parents=True, exist_ok=True)
+    with _ProgressBar(total=len(pairs), desc="", disable=silent) as progress_bar, Telemetry("anthropic") as telemetry:
 
         # load cached pairs
         before = time.perf_counter()
         pairs_to_execute = []
         progress_bar.set_description("load responses")
         progress_bar.reset(total=len(pairs))
-        for pair in pairs:
-            pair.response = pair.request.load_cached_response()
+        cached_pairs = open_cache(CACHE_PATH).load_many([pair.request.hash() for pair in pairs])
+        for position, pair in enumerate(pairs):
+            pair.response = pair.request.load_cached_response(cached_pairs)
             if pair.response is None:
                 pairs_to_execute.append(pair)
             else:
                 progress_bar.cached += 1
+                notify(position, pair.response.response)
             progress_bar.update()
+        telemetry.on_cache(len(pairs), progress_bar.cached)
         if _do_benchmark:
-            logger.info(f"loaded responses in {time.perf_counter() - before} seconds")
+            seconds = time.perf_counter() - before
+            logger.info(
+                f"loaded responses in {seconds} seconds ({len(pairs) / max(seconds, 1e-9):.0f} pairs/sec, "
+                f"{progress_bar.cached} cached)"
+            )
 
         # in case some pairs were not cached, execute them
         if len(pairs_to_execute) > 0:
@@ -140,46 +217,29 @@ def anthropic_execute(
             progress_bar.set_description("count tokens")
             progress_bar.reset(total=len(pairs))
             progress_bar.update(progress_bar.cached)
-            for pair in pairs_to_execute:
-                while True:
-                    with semaphore:
-                        if context["num_counting"] < 20:  # max. num. of parallel count token requests
-                            context["num_counting"] = context["num_counting"] + 1
-                            progress_bar.bottleneck = "P"
-                            progress_bar.running = context["num_counting"]
-                            progress_bar.update_postfix()
-
-                            def execute(p: _Pair, pb: _ProgressBar, c: dict, s: threading.Semaphore) -> None:
-                                http_response = p.request.count_tokens()
-                                if http_response.status_code != 200:
-                                    logger.error(f"count_tokens error: {http_response.content}")
-                                    http_response.raise_for_status()
-                                    exit()
-
-                                p.request.num_input_tokens = http_response.json()["input_tokens"]
-
-                                with s:
-                                    c["num_counting"] = c["num_counting"] - 1
-                                    pb.running = c["num_counting"]
-                                    pb.update()
-
-                            pair.thread = threading.Thread(
-                                target=execute,
-                                args=(pair, progress_bar, context, semaphore)
-                            )
-                            pair.thread.start()
-                            break
-
-                    progress_bar.bottleneck = "T"
-                    progress_bar.update_postfix()
-                    time.sleep(0.05)  # sleep to wait for thread limit budget
-
-            progress_bar.bottleneck = "Z"
+            progress_bar.bottleneck = "P"
+            progress_bar.running = min(COUNT_TOKENS_MAX_RUNNING, len(pairs_to_execute))
             progress_bar.update_postfix()
-            for pair in pairs_to_execute:
-                if pair.thread is not None:
-                    pair.thread.join()
-                    pair.thread = None
+
+            def count_tokens(p: _Pair) -> int:
+                http_response = p.request.count_tokens()
+                if http_response.status_code != 200:
+                    logger.error(f"count_tokens error: {http_response.content}")
+                    http_response.raise_for_status()
+                    exit()
+                return http_response.json()["input_tokens"]
+
+            def set_num_input_tokens(p: _Pair, num_input_tokens: int) -> None:
+                p.request.num_input_tokens = num_input_tokens
+                progress_bar.update()
+
+            map_concurrently(
+                count_tokens,
+                pairs_to_execute,
+                max_running=COUNT_TOKENS_MAX_RUNNING,
+                callback=set_num_input_tokens
+            )
+            progress_bar.running = 0
             if _do_benchmark:
                 logger.info(f"counted tokens in {time.perf_counter() - before} seconds")
 
@@ -192,162 +252,103 @@ def anthropic_execute(
             if _do_benchmark:
                 logger.info(f"checked requests in {time.perf_counter() - before} seconds")
 
-            # estimate maximum cost
+            # execute the shortest request first to quickly obtain HTTP headers, and requests with the same prefix
+            # together, and mark the shared prefixes for caching
+            before = time.perf_counter()
+            probe = min(pairs_to_execute, key=lambda p: p.request.max_input_usage())
+            grouped_pairs, num_shared_elements = group_by_shared_prefix(
+                [pair for pair in pairs_to_execute if pair is not probe],
+                elements=lambda p: prefix_elements(p.request.request),
+                size=lambda p: p.request.max_total_usage()
+            )
+            pairs_to_execute = [probe] + grouped_pairs
+            for pair, num_elements in zip(grouped_pairs, num_shared_elements):
+                pair.request.num_shared_elements = num_elements
+            if _do_benchmark:
+                logger.info(f"grouped requests in {time.perf_counter() - before} seconds")
+
+            # estimate maximum cost, including the cache writes of the shared prefixes
             before = time.perf_counter()
             total_max_cost = sum(pair.request.max_cost() for pair in pairs_to_execute)
+            if mode == "batch":
+                total_max_cost *= BATCH_COST_FACTOR
             if _do_benchmark:
                 logger.info(f"estimated maximum cost in {time.perf_counter() - before} seconds")
 
-            if force is None or total_max_cost > force:
+            if governor is not None:
+                if not silent:
+                    logger.info(f"spending up to around ${total_max_cost:.2f} within the limits of the governor")
+            elif force is None or total_max_cost > force:
                 logger.info(f"press enter to continue and spend up to around ${total_max_cost:.2f}")
                 input()
             elif not silent:
                 logger.info(f"spending up to around ${total_max_cost:.2f}")
 
-            # sort requests to execute longest requests first, put one short request first to quickly obtain HTTP header
-            before = time.perf_counter()
-            pairs_to_execute.sort(key=lambda p: p.request.max_total_usage(), reverse=True)
-            pairs_to_execute = pairs_to_execute[-1:] + pairs_to_execute[:-1]
-            if _do_benchmark:
-                logger.info(f"sorted requests in {time.perf_counter() - before} seconds")
-
-            # execute requests
-            before = time.perf_counter()
-            progress_bar.set_description("execute requests")
-            progress_bar.reset(total=len(pairs))
-            progress_bar.update(progress_bar.cached)
-            while True:  # break if all(pair.status == "done" for pair in pairs_to_execute)
-                logger.debug("repeatedly iterate through pairs until all are done")
-                for pair in pairs_to_execute:
-                    with semaphore:
-                        if pair.status != "open":
-                            continue
-                        pair.status = "waiting"
-
-                        if pair.request.model not in context.keys():
-                            context[pair.request.model] = _ModelBudgetState.new()
-
-                    while True:  # break if request is "done" in sequential execution or "running" in parallel execution
-                        with semaphore:
-                            context[pair.request.model] = context[pair.request.model].consider_time()
-
-                            if context[pair.request.model].is_enough_for_request(pair.request):
-                                match context[pair.request.model].mode:
-                                    case "sequential" if context["num_running"] == 0:
-                                        logger.debug(f"sequential execution for `{pair.request.model}`: execute")
-                                        progress_bar.bottleneck = "S"
-
-                                        pair.status = "running"
-                                        context["num_running"] = context["num_running"] + 1
-                                        progress_bar.running = context["num_running"]
-                                        progress_bar.update_postfix()
-
-                                        context[pair.request.model] = context[pair.request.model].decrease_by_request(
-                                            pair.request
-                                        )
-
-                                        http_response = pair.request.execute()
-                                        pair.response = _Response(http_response.json())
-
-                                        context[pair.request.model] = context[pair.request.model].set_from_headers(
-                                            http_response.headers
-                                        )
-
-                                        context["num_running"] = context["num_running"] - 1
-                                        progress_bar.running = context["num_running"]
-                                        progress_bar.cost += pair.response.total_cost()
-
-                                        match http_response.status_code:
-                                            case 200:
-                                                context[pair.request.model] = context[pair.request.model].to_parallel()
-                                                pair.status = "done"
-                                                progress_bar.update()
-                                                break
-                                            case 429:
-                                                pair.status = "open"
-                                                progress_bar.update_postfix()  # not done -> update only postfix
-                                            case _:
-                                                pair.status = "done"
-                                                progress_bar.failed += 1
-                                                progress_bar.update()
-                                                break
-                                    case "parallel" if context["num_running"] < 20:  # max. num. of parallel requests
-                                        logger.debug(f"parallel execution for `{pair.request.model}`: execute")
-                                        progress_bar.bottleneck = "P"
-
-                                        pair.status = "running"
-                                        context["num_running"] = context["num_running"] + 1
-                                        progress_bar.running = context["num_running"]
-                                        progress_bar.update_postfix()
-
-                                        context[pair.request.model] = context[pair.request.model].decrease_by_request(
-                                            pair.request
-                                        )
-
-                                        def execute(p: _Pair, pb: _ProgressBar, c: dict,
-                                                    s: threading.Semaphore) -> None:
-                                            http_response = p.request.execute()
-                                            p.response = _Response(http_response.json())
-
-                                            with s:
-                                                c[pair.request.model] = c[p.request.model].set_from_headers(
-                                                    http_response.headers
-                                                )
-
-                                                c["num_running"] = c["num_running"] - 1
-                                                pb.running = c["num_running"]
-                                                pb.cost += p.response.total_cost()
-
-                                                match http_response.status_code:
-                                                    case 200:
-                                                        c[p.request.model] = c[p.request.model].increase_by_response(
-                                                            p.request,
-                                                            p.response
-                                                        )
-                                                        p.status = "done"
-                                                        pb.update()
-                                                    case 429:
-                                                        logger.debug(
-                                                            f"parallel execution for `{p.request.model}`: "
-                                                            f"rate limit error -> switch to sequential execution"
-                                                        )
-                                                        p.status = "open"
-                                                        c[p.request.model] = c[p.request.model].to_sequential()
-                                                        pb.update_postfix()  # not done -> update only postfix
-                                                    case _:
-                                                        p.status = "done"
-                                                        pb.failed += 1
-                                                        pb.update()
-
-                                        pair.thread = threading.Thread(
-                                            target=execute,
-                                            args=(pair, progress_bar, context, semaphore)
-                                        )
-                                        pair.thread.start()
-                                        break
-                                    case _:
-                                        progress_bar.bottleneck = "T"
-                                        progress_bar.update_postfix()
-                            else:
-                                progress_bar.bottleneck = "L"
-                                progress_bar.update_postfix()
-
-                        time.sleep(0.05)  # sleep to wait for thread limit or rate limit budget
-
-                if all(pair.status == "done" for pair in pairs_to_execute):
-                    break
-                progress_bar.bottleneck = "Z"
-                progress_bar.update_postfix()
-                time.sleep(1)  # sleep to wait for stragglers and failures
-
-            for pair in pairs_to_execute:
-                if pair.thread is not None:
-                    pair.thread.join()
-
-            if _do_benchmark:
-                logger.info(f"executed requests in {time.perf_counter() - before} seconds")
-
-        return [pair.response.response for pair in pairs]
+            # execute requests through the Message Batches API, requests without a result are executed online afterward
+            if mode == "batch":
+                progress_bar.set_description("execute batches")
+                progress_bar.reset(total=len(pairs))
+                progress_bar.update(progress_bar.cached)
+                pairs_to_execute = execute_batches(
+                    pairs_to_execute,
+                    submit=_submit_batch,
+                    poll=_poll_batch,
+                    results=_batch_results,
+                    response_cls=_Response,
+                    cache_path=CACHE_PATH,
+                    registry_path=BATCHES_PATH,
+                    progress_bar=progress_bar,
+                    max_requests=BATCH_MAX_REQUESTS,
+                    max_bytes=BATCH_MAX_BYTES,
+                    on_done=on_done,
+                    governor=governor
+                )
+
+            if len(pairs_to_execute) > 0:
+                # start with the budget states that earlier runs have learned
+                models = {pair.request.model for pair in pairs_to_execute}
+                api_key = os.environ["ANTHROPIC_API_KEY"]
+                restore_budget_states(
+                    context, semaphore, models, path=RATE_LIMITS_PATH, api_key=api_key, state_cls=_ModelBudgetState
+                )
+
+                # execute requests
+                before = time.perf_counter()
+                progress_bar.set_description("execute requests")
+                progress_bar.reset(total=len(pairs))
+                progress_bar.update(len(pairs) - len(pairs_to_execute))
+                try:
+                    execute_pairs(
+                        pairs_to_execute,
+                        context=context,
+                        semaphore=semaphore,
+                        progress_bar=progress_bar,
+                        response_cls=_Response,
+                        max_running=20,  # max. num. of parallel requests
+                        new_budget_state=_ModelBudgetState.new,
+                        track_cost=True,
+                        poll_interval=None if global_context is None else 0.05,  # other processes cannot wake it up
+                        on_done=on_done,
+                        hedge_percentile=hedge_percentile,
+                        telemetry=telemetry,
+                        governor=governor,
+                        stop=stop
+                    )
+                finally:
+                    persist_budget_states(context, semaphore, models, path=RATE_LIMITS_PATH, api_key=api_key)
+
+                if _do_benchmark:
+                    logger.info(f"executed requests in {time.perf_counter() - before} seconds")
+
+            if not silent and input_tokens.total() > 0:
+                logger.info(
+                    f"input tokens: {input_tokens['cached']} cached "
+                    f"({input_tokens['cached'] / input_tokens.total():.0%}), {input_tokens['uncached']} uncached"
+                )
+
+        responses = fan_out([pair.response.response for pair in pairs], positions)
+        release_method_caches(_Request, _Response)  # the pairs are no longer needed
+        return responses
 
 
 ########################################################################################################################
@@ -368,13 +369,84 @@ def _get_model_params(model: str) -> dict:
         return MODEL_PARAMETERS[model]
 
 
+def _headers() -> dict:
+    return {
+        "content-type": "application/json",
+        "x-api-key": f"{os.environ['ANTHROPIC_API_KEY']}",
+        "anthropic-version": "2023-06-01"
+    }
+
+
+def _submit_batch(pairs: list["_Pair"]) -> str:
+    batch = batch_api_call(lambda: http_post(
+        url=f"{BASE_URL}/messages/batches",
+        json={"requests": [{"custom_id": pair.request.hash(), "params": pair.request.payload()} for pair in pairs]},
+        headers=_headers()
+    )).json()
+    return batch["id"]
+
+
+def _poll_batch(batch_id: str) -> tuple[bool, int]:
+    batch = batch_api_call(lambda: http_get(f"{BASE_URL}/messages/batches/{batch_id}", headers=_headers())).json()
+    request_counts = batch.get("request_counts") or {}
+    num_finished = sum(count for status, count in request_counts.items() if status != "processing")
+    return batch["processing_status"] == "ended", num_finished
+
+
+def _batch_results(batch_id: str) -> Iterator[tuple[str, int, dict]]:
+    batch = batch_api_call(lambda: http_get(f"{BASE_URL}/messages/batches/{batch_id}", headers=_headers())).json()
+    if batch.get("results_url") is None:
+        return
+    content = batch_api_call(lambda: http_get(batch["results_url"], headers=_headers()))
+    for line in content.text.splitlines():
+        if line.strip() == "":
+            continue
+        result = json.loads(line)
+        match result["result"]["type"]:
+            case "succeeded":
+                yield result["custom_id"], 200, result["result"]["message"]
+            case "errored":
+                error = result["result"]["error"]
+                # invalid requests fail again, other errors are transient, so execute these requests online
+                status_code = 400 if error.get("error", {}).get("type") == "invalid_request_error" else 500
+                yield result["custom_id"], status_code, error
+            case _:  # canceled or expired, so execute the request online
+                pass
+
+
+def _with_cache_breakpoint(request: dict, element_idx: int) -> dict:
+    request = copy.copy(request)  # do not modify the cached request
+    fields = [field for field in ("tools", "system") if field in request.keys()]  # see `prefix_elements`
+    position = element_idx - 1  # the first element is the model
+    if position < len(fields) and fields[position] == "tools":
+        request["tools"] = request["tools"][:-1] + [{**request["tools"][-1], "cache_control": {"type": "ephemeral"}}]
+    elif position < len(fields):
+        request["system"] = _with_cache_control(request["system"])
+    else:
+        messages = list(request["messages"])
+        message = messages[position - len(fields)]
+        messages[position - len(fields)] = {**message, "content": _with_cache_control(message["content"])}
+        request["messages"] = messages
+    return request
+
+
+def _with_cache_control(content: str | list[dict]) -> list[dict]:
+    if isinstance(content, str):
+        return [{"type": "text", "text": content, "cache_control": {"type": "ephemeral"}}]
+    return content[:-1] + [{**content[-1], "cache_control": {"type": "ephemeral"}}]
+
+
 class _Request:
     request: dict
     num_input_tokens: int | None
+    reserved_output_usage: int  # number of output tokens reserved in the budget while the request is running
+    num_shared_elements: int  # number of prefix elements shared with other requests, see _prefix.py
 
     def __init__(self, request: dict) -> None:
         self.request = request
         self.num_input_tokens = None
+        self.reserved_output_usage = 0
+        self.num_shared_elements = 0
 
     @functools.cached_property
     def model(self) -> str:
@@ -407,15 +479,37 @@ class _Request:
         return self.max_input_usage() + self.max_output_usage()
 
     @functools.cache
-    def max_cost(self) -> float:
+    def max_input_cost(self) -> float:  # only call this once `num_shared_elements` is set
         model_params = _get_model_params(self.model)
-        input_cost = self.max_input_usage() * (model_params["cost_per_1k_input_tokens"] / 1000)
-        output_cost = self.max_output_usage() * (model_params["cost_per_1k_output_tokens"] / 1000)
-        return input_cost + output_cost
+        # a shared prefix with a `cache_control` breakpoint may be written to the prompt cache, which costs more
+        cache_creation_usage = self.shared_prefix_tokens() if self.payload() is not self.request else 0
+        input_cost = (self.max_input_usage() - cache_creation_usage) * (model_params["cost_per_1k_input_tokens"] / 1000)
+        input_cost += cache_creation_usage * (model_params["cost_per_1k_cache_creation_input_tokens"] / 1000)
+        return input_cost
+
+    def max_cost(self, output_usage: int | None = None) -> float:  # with `output_usage` instead of the maximum
+        if output_usage is None:
+            output_usage = self.max_output_usage()
+        output_cost = output_usage * (_get_model_params(self.model)["cost_per_1k_output_tokens"] / 1000)
+        return self.max_input_cost() + output_cost
 
     @functools.cache
     def hash(self) -> str:
-        return hashlib.sha256(bytes(json.dumps(self.request), "utf-8")).hexdigest()
+        return canonical_hash(self.request)
+
+    @functools.cache
+    def shared_prefix_tokens(self) -> int:  # estimated from the share of the prefix in the request's JSON
+        elements = prefix_elements(self.request)
+        prefix_length = len(json.dumps(elements[:self.num_shared_elements]))
+        return self.num_input_tokens * prefix_length // max(1, len(json.dumps(elements)))
+
+    def payload(self) -> dict:  # the request with a `cache_control` breakpoint at the end of the shared prefix
+        if self.num_shared_elements <= 1:  # the first element is the model
+            return self.request
+        if self.num_input_tokens is None \
+                or self.shared_prefix_tokens() < _get_model_params(self.model)["min_cache_tokens"]:
+            return self.request
+        return _with_cache_breakpoint(self.request, self.num_shared_elements - 1)
 
     def check(self) -> None:
         model_params = _get_model_params(self.model)
@@ -432,14 +526,16 @@ class _Request:
         if "temperature" not in self.request.keys() or self.request["temperature"] != 0:
             logger.warning("request's `temperature` not set to 0, which is required for reproducibility")
 
-    def load_cached_response(self):  # -> "_Response" | None
-        path = CACHE_PATH / f"{self.hash()}.json"
-        if path.is_file():
-            with open(path, "r", encoding="utf-8") as file:
-                cached_pair = json.load(file)
+    def is_deterministic(self) -> bool:
+        return self.request.get("temperature") == 0  # a duplicate must not yield a different response
+
+    def load_cached_response(self, cached_pairs: dict[str, dict]):  # -> "_Response" | None
+        cached_pair = cached_pairs.get(self.hash())
+        if cached_pair is not None:
             cached_request = _Request(cached_pair["request"])
             cached_response = _Response(cached_pair["response"])
-            if self.request == cached_request.request:
+            if self.request == cached_request.request \
+                    or canonical_request(self.request) == canonical_request(cached_request.request):
                 return cached_response
         return None
 
@@ -447,8 +543,8 @@ class _Request:
         req = {k: v for k, v in self.request.items() if k in {"messages", "model", "system", "tool_choice", "tools"}}
         while True:
             before = time.time()
-            http_response = requests.post(
-                url="https://api.anthropic.com/v1/messages/count_tokens",
+            http_response = http_post(
+                url=f"{BASE_URL}/messages/count_tokens",
                 json=req,
                 headers={
                     "content-type": "application/json",
@@ -457,7 +553,8 @@ class _Request:
                 }
             )
             after = time.time()
-            time.sleep(max(0.0, (60 / 4_000 - (after - before)) * 20 * 1.1))
+            # each thread sends at most one request per 1/COUNT_TOKENS_MAX_RUNNING of the rate limit (plus 10% slack)
+            time.sleep(max(0.0, 60 / COUNT_TOKENS_RPM * COUNT_TOKENS_MAX_RUNNING * 1.1 - (after - before)))
             match http_response.status_code:
                 case 200:
                     return http_response
@@ -465,9 +562,10 @@ class _Request:
                     logger.error(f"count_tokens error, retry: {http_response.content}")
 
     def execute(self) -> requests.Response:
-        http_response = requests.post(
-            url="https://api.anthropic.com/v1/messages",
-            json=self.request,
+        started_at = time.perf_counter()
+        http_response = http_post(
+            url=f"{BASE_URL}/messages",
+            json=self.payload(),
             headers={
                 "content-type": "application/json",
                 "x-api-key": f"{os.environ['ANTHROPIC_API_KEY']}",
@@ -476,13 +574,12 @@ class _Request:
         )
 
         if http_response.status_code == 200:
-            path = CACHE_PATH / f"{self.hash()}.json"
-            with open(path, "w", encoding="utf-8") as cache_file:
-                json.dump({"request": self.request, "response": http_response.json()}, cache_file)
+            latency = time.perf_counter() - started_at  # recorded for the `replay` API name
+            open_cache(CACHE_PATH).store(self.hash(), self.request, http_response.json(), latency)
         elif http_response.status_code == 429:
-            logger.info("retry request due to rate limit error")
+            logger.debug("request failed due to rate limit error")
         else:
-            logger.warning(f"request failed, no retry: {http_response.content}")
+            logger.warning(f"request failed with status {http_response.status_code}: {http_response.content}")
 
         return http_response
 
@@ -522,6 +619,13 @@ class _Response:
         else:
             return 0
 
+    @functools.cache
+    def cached_input_usage(self) -> int:
+        if self.was_successful() and self.usage.get("cache_read_input_tokens") is not None:
+            return self.usage["cache_read_input_tokens"]
+        else:
+            return 0
+
     @functools.cache
     def output_usage(self) -> int:
         if self.was_successful():
@@ -556,67 +660,91 @@ class _Response:
 class _Pair:
     request: _Request
     response: _Response | None = None
-    status: Literal["open"] | Literal["waiting"] | Literal["running"] | Literal["done"] = "open"
-    thread: threading.Thread | None = None
+    status: Literal["open"] | Literal["running"] | Literal["done"] = "open"
+    latency: float | None = None  # seconds from the start of the last attempt until the response
 
 
 @dataclasses.dataclass
 class _ModelBudgetState:
-    mode: Literal["sequential"] | Literal["parallel"]
     rpm: int | None
     tpm: int | None
     itpm: int | None
     otpm: int | None
-    r: int | None
-    t: int | None
-    it: int | None
-    ot: int | None
+    r: float | None
+    t: float | None
+    it: float | None
+    ot: float | None
     last_update: float
+    concurrency: ConcurrencyLimit = dataclasses.field(default_factory=ConcurrencyLimit)
+    num_running: int = 0
+    retry_at: float = 0.0
+    output_estimate: OutputLengthEstimate = dataclasses.field(default_factory=OutputLengthEstimate)
 
     @classmethod
     def new(cls) -> "_ModelBudgetState":
-        return cls("sequential", None, None, None, None, None, None, None, None, time.time())
+        return cls(None, None, None, None, None, None, None, None, time.time())
+
+    def expected_output_usage(self, request: _Request) -> int:
+        return self.output_estimate.predict(request.max_output_usage())
+
+    def expected_cost(self, request: _Request) -> float:
+        return request.max_cost(self.expected_output_usage(request))
 
     def is_enough_for_request(self, request: _Request) -> bool:
+        expected_output_usage = self.expected_output_usage(request)
         return (
                 (self.r is None or self.r >= 1)
-                and (self.t is None or self.t >= request.max_total_usage())
+                and (self.t is None or self.t >= request.max_input_usage() + expected_output_usage)
                 and (self.it is None or self.it >= request.max_input_usage())
-                and (self.ot is None or self.ot >= request.max_output_usage())
+                and (self.ot is None or self.ot >= expected_output_usage)
+        )
+
+    def seconds_until_enough(self, request: _Request) -> float:
+        expected_output_usage = self.expected_output_usage(request)
+        return max(
+            _seconds_until_refilled(self.r, self.rpm, 1),
+            _seconds_until_refilled(self.t, self.tpm, request.max_input_usage() + expected_output_usage),
+            _seconds_until_refilled(self.it, self.itpm, request.max_input_usage()),
+            _seconds_until_refilled(self.ot, self.otpm, expected_output_usage)
         )
 
     def consider_time(self) -> "_ModelBudgetState":
         now = time.time()
         delta = now - self.last_update
         if self.rpm is not None and self.r is not None:
-            self.r = min(self.rpm, int(self.r + self.rpm * delta / 60))
+            self.r = min(self.rpm, self.r + self.rpm * delta / 60)
         if self.tpm is not None and self.t is not None:
-            self.t = min(self.tpm, int(self.t + self.tpm * delta / 60))
+            self.t = min(self.tpm, self.t + self.tpm * delta / 60)
         if self.itpm is not None and self.it is not None:
-            self.it = min(self.itpm, int(self.it + self.itpm * delta / 60))
+            self.it = min(self.itpm, self.it + self.itpm * delta / 60)
         if self.otpm is not None and self.ot is not None:
-            self.ot = min(self.otpm, int(self.ot + self.otpm * delta / 60))
+            self.ot = min(self.otpm, self.ot + self.otpm * delta / 60)
         self.last_update = now
         return self
 
     def decrease_by_request(self, request: _Request) -> "_ModelBudgetState":
+        request.reserved_output_usage = self.expected_output_usage(request)
         if self.r is not None:
             self.r -= 1
         if self.t is not None:
-            self.t -= request.max_total_usage()
+            self.t -= request.max_input_usage() + request.reserved_output_usage
         if self.it is not None:
             self.it -= request.max_input_usage()
         if self.ot is not None:
-            self.ot -= request.max_output_usage()
+            self.ot -= request.reserved_output_usage
         return self
 
     def increase_by_response(self, request: _Request, response: _Response) -> "_ModelBudgetState":
-        if response.total_usage() < request.max_total_usage():
-            self.t = min(self.tpm, int(self.t + request.max_total_usage() - response.total_usage()))
-        if response.input_usage() < request.max_input_usage():
-            self.it = min(self.itpm, int(self.it + request.max_input_usage() - response.input_usage()))
-        if response.output_usage() < request.max_output_usage():
-            self.ot = min(self.otpm, int(self.ot + request.max_output_usage() - response.output_usage()))
+        # return the unused reservations, or charge the usage that exceeded the reservations
+        reserved_total_usage = request.max_input_usage() + request.reserved_output_usage
+        if self.t is not None and self.tpm is not None:
+            self.t = min(self.tpm, self.t + reserved_total_usage - response.total_usage())
+        if self.it is not None and self.itpm is not None:
+            self.it = min(self.itpm, self.it + request.max_input_usage() - response.input_usage())
+        if self.ot is not None and self.otpm is not None:
+            self.ot = min(self.otpm, self.ot + request.reserved_output_usage - response.output_usage())
+        if response.was_successful():
+            self.output_estimate.observe(response.output_usage())
         return self
 
     def set_from_headers(self, headers: dict[str, Any]) -> "_ModelBudgetState":
@@ -646,29 +774,35 @@ class _ModelBudgetState:
                 self.ot = header_ot
         return self
 
-    def to_parallel(self) -> "_ModelBudgetState":
-        self.mode = "parallel"
-        return self
 
-    def to_sequential(self) -> "_ModelBudgetState":
-        self.mode = "sequential"
-        return self
+def _seconds_until_refilled(budget: float | None, per_minute: int | None, required: int) -> float:
+    if budget is None or budget >= required:
+        return 0
+    elif per_minute is None or per_minute <= 0 or per_minute < required:
+        return 60  # the budget will never be enough, so only check once in a while
+    else:
+        return (required - budget) * 60 / per_minute
 
 
 class _ProgressBar(tqdm.tqdm):
     running: int
     failed: int
+    retries: int
     cached: int
     cost: float
-    bottleneck: Literal["T"] | Literal["L"] | Literal["P"] | Literal["Z"] | Literal["S"]
+    refreshed_at: float  # time of the last redraw due to a changed postfix
+    bottleneck: Literal["T"] | Literal["L"] | Literal["P"] | Literal["Z"] | Literal["S"] | Literal["B"] \
+            | Literal["C"]
 
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self.running = 0
         self.failed = 0
+        self.retries = 0
         self.cached = 0
         self.cost = 0
         self.bottleneck = "P"
+        self.refreshed_at = 0.0
         self.update_postfix()
 
     def __enter__(self):
@@ -683,5 +817,10 @@ class _ProgressBar(tqdm.tqdm):
 
     def update_postfix(self) -> None:
         self.set_postfix_str(
-            f"{self.bottleneck}{self.running:03d}, failed={self.failed}, cached={self.cached}, cost=${self.cost:.2f}"
+            f"{self.bottleneck}{self.running:03d}, failed={self.failed}, retries={self.retries}, cached={self.cached}, "
+            f"cost=${self.cost:.2f}",
+            refresh=False
         )
+        if not self.disable and time.time() - self.refreshed_at >= self.mininterval:  # redraw at most this often
+            self.refreshed_at = time.time()
+            self.refresh()
@@ -0,0 +1,244 @@
+########################################################################################################################
+# Batch API helpers version: 2026-10-18
+#
+# use the following methods:
+# execute_batches(...)     ==> execute pairs through a provider's batch API and cache their responses
+# batch_api_call(...)      ==> send a request to manage batches, retrying transient errors
+#
+# The OpenAI Batch API and the Anthropic Message Batches API process large numbers of requests within 24 hours at half
+# the price and with separate rate limits. The API helpers pack the uncached requests into batches of at most
+# `max_requests` requests and `max_bytes` bytes, submit them, poll them every BATCH_POLL_INTERVAL seconds, and store
+# the successful responses in their caches, so that later runs are served from the cache as usual.
+#
+# Each request is identified by its hash (custom_id). Each submitted batch is recorded in `registry_path` with the
+# hashes of its requests, so that a run that is interrupted while waiting picks up the batches of its requests instead
+# of submitting (and paying for) them again, even if its set of uncached requests has changed in the meantime: only
+# the requests that are not in any registered batch are packed into new batches. Once a batch has ended, it remains
+# registered only for its requests that belong to other runs and are not yet cached.
+# Requests without a result (e.g., because the batch expired) and requests that failed with a transient error are
+# returned to be executed online.
+########################################################################################################################
+import hashlib
+import json
+import logging
+import pathlib
+import time
+from typing import Callable, Iterator
+
+import requests
+
+from llms4de.model._cache import open_cache
+from llms4de.model._governor import CostGovernor
+from llms4de.model._retry import MAX_ATTEMPTS, is_retryable_error, is_retryable_status, retry_delay
+
+logger = logging.getLogger(__name__)
+
+BATCH_POLL_INTERVAL = 30.0  # seconds between status checks of the running batches
+BATCH_COST_FACTOR = 0.5  # both providers charge half the price for batch requests
+BATCH_SIZE_OVERHEAD = 200  # bytes per request in addition to its JSON, e.g., for the custom_id and URL
+
+
+########################################################################################################################
+# API
+########################################################################################################################
+
+
+def execute_batches(
+        pairs: list,
+        *,
+        submit: Callable[[list], str],
+        poll: Callable[[str], tuple[bool, int]],
+        results: Callable[[str], Iterator[tuple[str, int, dict]]],
+        response_cls: type,
+        cache_path: pathlib.Path,
+        registry_path: pathlib.Path,
+        progress_bar,
+        max_requests: int,
+        max_bytes: int,
+        group: Callable[[object], str] | None = None,
+        on_done: Callable | None = None,
+        governor: CostGovernor | None = None
+) -> list:
+    """Execute the pairs through a provider's batch API and cache their responses.
+
+    Args:
+        pairs: The pairs to execute, each request must provide `hash()`.
+        submit: Function that submits the pairs as one batch and returns the batch id.
+        poll: Function that returns whether the batch has ended and how many of its requests have finished.
+        results: Function that yields the custom_id, HTTP status code, and JSON body of each result of an ended batch.
+        response_cls: The class of the responses.
+        cache_path: The path of the cache to store the successful responses in.
+        registry_path: The directory in which to record the ids of the submitted batches.
+        progress_bar: The progress bar.
+        max_requests: The maximum number of requests per batch.
+        max_bytes: The maximum size of a batch in bytes.
+        group: Optional function that determines the group of a pair, each batch contains pairs of only one group.
+        on_done: Optional function that is called with each pair as soon as it has a response.
+        governor: Optional cost governor, the maximum cost of the new batches is reserved before they are submitted.
+
+    Returns:
+        The pairs without a result, which must be executed online.
+    """
+    pairs_by_id = {pair.request.hash(): pair for pair in pairs}
+    group = group if group is not None else lambda pair: ""
+
+    # continue with the registered batches that contain any of the requests, pack the other requests into new batches
+    batch_ids = []
+    registered = set()
+    for registry_file, batch_id, request_hashes in _registered_batches(registry_path):
+        num_pending = sum(1 for request_hash in request_hashes if request_hash in pairs_by_id.keys())
+        if num_pending > 0:
+            logger.info(f"continue with batch `{batch_id}` of {num_pending} requests submitted by an earlier run")
+            batch_ids.append((batch_id, registry_file, request_hashes))
+            registered.update(request_hashes)
+    new_pairs = [pair for pair in pairs if pair.request.hash() not in registered]
+    sorted_pairs = sorted(new_pairs, key=lambda pair: (group(pair), pair.request.hash()))
+    chunks = list(_chunks(sorted_pairs, max_requests, max_bytes, group))
+
+    # the batches cannot be stopped once they are submitted, so their maximum cost must fit into the limits right away
+    reserved_cost = 0.0
+    if governor is not None:
+        reserved_cost = sum(pair.request.max_cost() for pair in new_pairs) * BATCH_COST_FACTOR
+        if governor.try_reserve(reserved_cost) > 0:
+            raise AssertionError(
+                f"The batches may cost up to ${reserved_cost:.2f}, which could exceed the cost limits of the governor!"
+            )
+
+    try:
+        for chunk in chunks:
+            batch_id = submit(chunk)
+            registry_path.mkdir(parents=True, exist_ok=True)
+            registry_file = registry_path / f"{hashlib.sha256(batch_id.encode('utf-8')).hexdigest()[:32]}.json"
+            request_hashes = [pair.request.hash() for pair in chunk]
+            _register_batch(registry_file, batch_id, request_hashes)
+            logger.info(f"submitted batch `{batch_id}` of {len(chunk)} requests")
+            batch_ids.append((batch_id, registry_file, request_hashes))
+
+        # wait until the batches have ended, then unpack their results
+        progress_bar.bottleneck = "B"
+        open_batches = list(batch_ids)
+        while len(open_batches) > 0:
+            still_open = []
+            num_running = 0
+            for batch_id, registry_file, request_hashes in open_batches:
+                has_ended, num_finished = poll(batch_id)
+                if not has_ended:
+                    still_open.append((batch_id, registry_file, request_hashes))
+                    num_running += len(request_hashes) - num_finished
+                    continue
+
+                num_succeeded = 0
+                to_store = []
+                for custom_id, status_code, body in results(batch_id):
+                    pair = pairs_by_id.get(custom_id)
+                    if pair is None or pair.status == "done" or is_retryable_status(status_code):
+                        continue
+                    pair.response = response_cls(body)
+                    pair.status = "done"
+                    if status_code == 200:
+                        to_store.append((custom_id, pair.request.request, body))
+                        num_succeeded += 1
+                        progress_bar.cost += pair.response.total_cost() * BATCH_COST_FACTOR
+                        if governor is not None:
+                            governor.charge(pair.response.total_cost() * BATCH_COST_FACTOR)
+                    else:
+                        progress_bar.failed += 1
+                    progress_bar.update()
+                    if on_done is not None:
+                        on_done(pair)
+                open_cache(cache_path).store_many(to_store)
+
+                # the responses are cached, only other runs may still need the results of their uncached requests
+                other_hashes = [request_hash for request_hash in request_hashes if request_hash not in pairs_by_id]
+                if len(other_hashes) > 0:
+                    cached_hashes = set(open_cache(cache_path).present(other_hashes))
+                    other_hashes = [request_hash for request_hash in other_hashes if request_hash not in cached_hashes]
+                if len(other_hashes) > 0:
+                    _register_batch(registry_file, batch_id, other_hashes)
+                else:
+                    registry_file.unlink(missing_ok=True)
+                logger.info(
+                    f"batch `{batch_id}` ended with {num_succeeded} of {len(request_hashes)} successful requests"
+                )
+
+            open_batches = still_open
+            progress_bar.running = num_running
+            progress_bar.update_postfix()
+            if len(open_batches) > 0:
+                time.sleep(BATCH_POLL_INTERVAL)
+    finally:
+        if governor is not None:
+            governor.release(reserved_cost)  # the actual cost of the ended batches has been charged
+            governor.sync()
+
+    missing = [pair for pair in pairs if pair.status != "done"]
+    if len(missing) > 0:
+        logger.warning(f"{len(missing)} requests have no batch result and are executed online")
+    return missing
+
+
+def batch_api_call(send: Callable[[], requests.Response]) -> requests.Response:
+    """Send a request to manage batches, retrying transient errors.
+
+    Args:
+        send: Function that sends the HTTP request.
+
+    Returns:
+        The successful HTTP response.
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            http_response = send()
+        except Exception as e:
+            if not is_retryable_error(e) or attempt >= MAX_ATTEMPTS:
+                raise
+            delay = retry_delay(attempt, {})
+        else:
+            if http_response.status_code == 200:
+                return http_response
+            if not is_retryable_status(http_response.status_code) or attempt >= MAX_ATTEMPTS:
+                raise AssertionError(
+                    f"batch API request failed with status {http_response.status_code}: {http_response.content}"
+                )
+            delay = retry_delay(attempt, http_response.headers)
+        logger.info(f"retry batch API request in {delay:.1f} seconds (attempt {attempt})")
+        time.sleep(delay)
+
+
+########################################################################################################################
+# implementation
+########################################################################################################################
+
+
+def _chunks(pairs: list, max_requests: int, max_bytes: int, group: Callable[[object], str]) -> Iterator[list]:
+    chunk, chunk_bytes = [], 0
+    for pair in pairs:
+        num_bytes = len(json.dumps(pair.request.request).encode("utf-8")) + BATCH_SIZE_OVERHEAD
+        if len(chunk) > 0 and (
+                len(chunk) >= max_requests or chunk_bytes + num_bytes > max_bytes or group(pair) != group(chunk[0])
+        ):
+            yield chunk
+            chunk, chunk_bytes = [], 0
+        chunk.append(pair)
+        chunk_bytes += num_bytes
+    if len(chunk) > 0:
+        yield chunk
+
+
+def _register_batch(registry_file: pathlib.Path, batch_id: str, request_hashes: list[str]) -> None:
+    tmp_file = registry_file.with_name(registry_file.name + ".tmp")
+    with open(tmp_file, "w", encoding="utf-8") as file:
+        json.dump({"batch_id": batch_id, "request_hashes": request_hashes, "submitted_at": time.time()}, file)
+    tmp_file.replace(registry_file)  # an interrupted run never leaves a partial registry file
+
+
+def _registered_batches(registry_path: pathlib.Path) -> Iterator[tuple[pathlib.Path, str, list[str]]]:
+    for registry_file in sorted(registry_path.glob("*.json")):
+        try:
+            with open(registry_file, "r", encoding="utf-8") as file:
+                record = json.load(file)
+            yield registry_file, record["batch_id"], record["request_hashes"]
+        except (json.JSONDecodeError, KeyError):
+            logger.warning(f"ignore unreadable batch registry file {registry_file}")
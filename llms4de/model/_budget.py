@@ -0,0 +1,368 @@
+########################################################################################################################
+# Rate limit budget helpers version: 2026-10-18
+#
+# use the following methods:
+# OutputLengthEstimate     ==> running estimate of the number of output tokens of a model's responses
+# SharedContext(...)       ==> budget context shared by the processes on one machine
+# restore_budget_states(...) ==> restore the persisted budget states of the models into the context
+# persist_budget_states(...) ==> persist the budget states of the models in the context for the next run
+#
+# The budget states of the API helpers reserve tokens for each running request and reconcile the reservation with the
+# actual usage once the response arrives. Reserving the maximum number of output tokens (e.g., 16k tokens for gpt-4o
+# without `max_tokens`) makes the tokens per minute budget look exhausted while the actual usage is a fraction of it.
+# Instead, they reserve the predicted number of output tokens, which starts at the maximum and, after
+# OUTPUT_ESTIMATE_MIN_SAMPLES responses, follows the running mean plus OUTPUT_ESTIMATE_DEVIATIONS mean absolute
+# deviations of the observed output lengths. Responses that exceed their reservation are charged to the budget, and the
+# rate limit headers correct any remaining discrepancy.
+#
+# To share the budget states between processes, the API helpers accept a global context and semaphore. A
+# `multiprocessing.Manager` turns every access into a round-trip to the manager process. Instead, a SharedContext keeps
+# the context in a file that is guarded by a file lock. Acquiring `context.lock` locks the file and reloads the context
+# only if another process has changed it, releasing it writes the context back only if it was changed. All processes
+# that use the same path share the same budgets, so the path should identify the API key (see `shared_context_path`).
+# Like with a manager dictionary, changes to a value must be assigned back (`context[model] = state`). The first
+# process that attaches to a path resets the context, since the earlier processes may have left running requests.
+# The context is stored as JSON, so its values must be JSON values or dataclasses of llms4de modules (e.g., the budget
+# states). The files live in a directory of the current user (SHARED_CONTEXT_DIR), and a SharedContext refuses to
+# attach to files that belong to another user.
+#
+# Without any knowledge of the rate limits, a model starts with a concurrency of one and must wait for the rate limit
+# headers of its first responses. To start the next run in parallel right away, the API helpers persist the learned
+# budget states (limits, remaining budgets, concurrency, and output length estimate) per model and API key in the data
+# directory. A restored state ages like a running one: its remaining budgets refill with the time since it was stored,
+# and the rate limit headers of the first responses correct it. States older than BUDGET_STATE_MAX_AGE are discarded.
+########################################################################################################################
+import dataclasses
+import fcntl
+import hashlib
+import json
+import logging
+import math
+import os
+import pathlib
+import struct
+import sys
+import threading
+import time
+from typing import Any, KeysView
+
+from llms4de.data import get_data_path
+from llms4de.model._retry import ConcurrencyLimit
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_ESTIMATE_MIN_SAMPLES = 20  # number of responses before the estimate replaces the maximum output length
+OUTPUT_ESTIMATE_DEVIATIONS = 3.0  # safety margin in mean absolute deviations
+OUTPUT_ESTIMATE_SMOOTHING = 0.05  # weight of each new response in the running mean and deviation
+# per-user directory of the shared contexts, must be on a local file system
+SHARED_CONTEXT_DIR = pathlib.Path(os.environ["XDG_RUNTIME_DIR"]) / "llms4de_budgets" \
+        if "XDG_RUNTIME_DIR" in os.environ.keys() else get_data_path() / "shared_budgets"
+BUDGET_STATE_MAX_AGE = 24 * 60 * 60  # seconds after which persisted budget states are discarded
+
+
+########################################################################################################################
+# API
+########################################################################################################################
+
+
+@dataclasses.dataclass
+class OutputLengthEstimate:
+    """Running estimate of the number of output tokens of a model's responses."""
+    num_samples: int = 0
+    mean: float = 0.0
+    deviation: float = 0.0  # running mean absolute deviation
+
+    def observe(self, num_output_tokens: int) -> None:
+        """Update the estimate with the output length of a response.
+
+        Args:
+            num_output_tokens: The number of output tokens of the response.
+        """
+        self.num_samples += 1
+        if self.num_samples == 1:
+            self.mean = num_output_tokens
+            return
+        weight = max(1 / self.num_samples, OUTPUT_ESTIMATE_SMOOTHING)  # plain average for the first responses
+        self.deviation += weight * (abs(num_output_tokens - self.mean) - self.deviation)
+        self.mean += weight * (num_output_tokens - self.mean)
+
+    def predict(self, max_output_tokens: int) -> int:
+        """Predict the number of output tokens to reserve for a request.
+
+        Args:
+            max_output_tokens: The maximum number of output tokens of the request.
+
+        Returns:
+            The predicted number of output tokens, which never exceeds the maximum.
+        """
+        if self.num_samples < OUTPUT_ESTIMATE_MIN_SAMPLES:
+            return max_output_tokens
+        return min(max_output_tokens, math.ceil(self.mean + OUTPUT_ESTIMATE_DEVIATIONS * self.deviation))
+
+
+def shared_context_path(api_name: str, api_key: str) -> pathlib.Path:
+    """Determine the path of the shared context for an API key.
+
+    Args:
+        api_name: The name of the API.
+        api_key: The API key, which is only stored as a hash.
+
+    Returns:
+        The path of the shared context.
+    """
+    return SHARED_CONTEXT_DIR / f"{api_name}-{_api_key_hash(api_key)}.context"
+
+
+def restore_budget_states(
+        context: dict,
+        semaphore: "threading.Semaphore",
+        models: set[str],
+        *,
+        path: pathlib.Path,
+        api_key: str,
+        state_cls: type
+) -> None:
+    """Restore the persisted budget states of the models that are not yet in the context.
+
+    Args:
+        context: The context of the API helper.
+        semaphore: The semaphore that guards the context.
+        models: The names of the models.
+        path: The directory of the persisted budget states.
+        api_key: The API key, since the rate limits belong to the API key.
+        state_cls: The dataclass of the budget states.
+    """
+    with semaphore:
+        missing_models = {model for model in models if model not in context.keys()}
+    if len(missing_models) == 0:
+        return
+
+    states = _load_budget_states(path / f"{_api_key_hash(api_key)}.json", state_cls)
+    with semaphore:
+        for model in missing_models:
+            if model in states.keys() and model not in context.keys():
+                logger.debug(f"restore budget state of `{model}`")
+                context[model] = states[model]
+
+
+def persist_budget_states(
+        context: dict,
+        semaphore: "threading.Semaphore",
+        models: set[str],
+        *,
+        path: pathlib.Path,
+        api_key: str
+) -> None:
+    """Persist the budget states of the models in the context for the next run.
+
+    Args:
+        context: The context of the API helper.
+        semaphore: The semaphore that guards the context.
+        models: The names of the models.
+        path: The directory of the persisted budget states.
+        api_key: The API key, since the rate limits belong to the API key.
+    """
+    with semaphore:
+        states = {model: context[model] for model in models if model in context.keys()}
+    if len(states) > 0:
+        _store_budget_states(path / f"{_api_key_hash(api_key)}.json", states)
+
+
+class SharedContext:
+    """Budget context shared by the processes on one machine, backed by a file and guarded by a file lock."""
+    path: pathlib.Path
+    lock: "_SharedContextLock"
+
+    def __init__(self, path: pathlib.Path) -> None:
+        """Attach to the shared context at the given path.
+
+        Args:
+            path: The path of the file that backs the context.
+        """
+        self.path = path
+        self.lock = _SharedContextLock(self)
+        self._pid = None
+        self._attach()
+
+    def __getstate__(self) -> dict:
+        return {"path": self.path}  # the other process attaches on its own
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["path"])
+
+    def __getitem__(self, key: str) -> Any:
+        self._check_owner()
+        return self._data[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._check_owner()
+        self._data[key] = value
+        self._dirty = True
+
+    def __contains__(self, key: str) -> bool:
+        self._check_owner()
+        return key in self._data
+
+    def keys(self) -> KeysView[str]:
+        self._check_owner()
+        return self._data.keys()
+
+    def _attach(self) -> None:
+        if self._pid is not None:  # forked from a process that was already attached
+            os.close(self._fd)
+            os.close(self._users_fd)
+        self._pid = os.getpid()
+        self._thread_lock = threading.Lock()  # the file lock does not exclude the threads of this process
+        self._owner = None
+        self._version = None
+        self._data = {}
+        self._dirty = False
+
+        self.path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self._fd = _open_own_file(self.path)
+        self._users_fd = _open_own_file(self.path.with_name(self.path.name + ".users"))
+        try:
+            fcntl.flock(self._users_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            is_first = True
+        except BlockingIOError:
+            is_first = False
+        if is_first:
+            with self.lock:
+                self._data = {}
+                self._dirty = True
+        fcntl.flock(self._users_fd, fcntl.LOCK_SH)  # held until the process exits
+
+    def _acquire(self) -> None:
+        if self._pid != os.getpid():
+            self._attach()
+        self._thread_lock.acquire()
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            header = os.pread(self._fd, _HEADER.size, 0)
+            version, length = _HEADER.unpack(header) if len(header) == _HEADER.size else (0, 0)
+            if version != self._version:
+                try:
+                    payload = os.pread(self._fd, length, _HEADER.size) if length > 0 else b"{}"
+                    self._data = json.loads(payload, object_hook=_decode_dataclass)
+                except Exception as e:
+                    logger.warning(f"reset corrupted shared context {self.path}: {e}")
+                    self._data = {}
+                self._version = version
+            self._dirty = False
+            self._owner = threading.get_ident()
+        except BaseException:
+            self._thread_lock.release()
+            raise
+
+    def _release(self) -> None:
+        try:
+            if self._dirty:
+                payload = json.dumps(self._data, default=_encode_dataclass).encode("utf-8")
+                self._version = (self._version or 0) + 1
+                os.pwrite(self._fd, _HEADER.pack(self._version, len(payload)) + payload, 0)
+                self._dirty = False
+        finally:
+            self._owner = None
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            self._thread_lock.release()
+
+    def _check_owner(self) -> None:
+        if self._owner != threading.get_ident():
+            raise AssertionError("You must hold `context.lock` to access a shared context!")
+
+
+########################################################################################################################
+# implementation
+########################################################################################################################
+
+_HEADER = struct.Struct("<QQ")  # version and length of the JSON-encoded context
+
+
+def _api_key_hash(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def _open_own_file(path: pathlib.Path) -> int:
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    if os.fstat(fd).st_uid != os.getuid():
+        os.close(fd)
+        raise AssertionError(f"Refuse to attach to the shared context file {path}, which belongs to another user!")
+    return fd
+
+
+def _encode_dataclass(value: Any) -> dict:
+    if not dataclasses.is_dataclass(value) or isinstance(value, type):
+        raise TypeError(f"cannot store a `{type(value).__name__}` in a shared context")
+    fields = {field.name: getattr(value, field.name) for field in dataclasses.fields(value)}
+    return {"__dataclass__": f"{type(value).__module__}:{type(value).__qualname__}", "fields": fields}
+
+
+def _decode_dataclass(record: dict) -> Any:
+    if "__dataclass__" not in record.keys():
+        return record
+    # only instantiate dataclasses of llms4de modules that are already imported, never import or execute anything else
+    module_name, class_name = record["__dataclass__"].split(":")
+    module = sys.modules.get(module_name)
+    cls = getattr(module, class_name, None) if module_name.startswith("llms4de.") else None
+    if not isinstance(cls, type) or not dataclasses.is_dataclass(cls):
+        raise ValueError(f"unknown dataclass `{record['__dataclass__']}` in shared context")
+    return cls(**record["fields"])
+
+
+class _SharedContextLock:
+    """Lock of a shared context, used as the global semaphore of the API helpers."""
+
+    def __init__(self, context: SharedContext) -> None:
+        self.context = context
+
+    def __enter__(self) -> "_SharedContextLock":
+        self.context._acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.context._release()
+
+
+def _load_budget_states(file_path: pathlib.Path, state_cls: type) -> dict[str, Any]:
+    if not file_path.is_file():
+        return {}
+    try:
+        with open(file_path, "r", encoding="utf-8") as file:
+            records = json.load(file)
+    except json.JSONDecodeError:
+        logger.warning(f"ignore corrupted budget states {file_path}")
+        return {}
+
+    states = {}
+    for model, record in records.items():
+        try:
+            if time.time() - record["last_update"] > BUDGET_STATE_MAX_AGE:
+                continue
+            states[model] = state_cls(**{
+                **record,
+                "concurrency": ConcurrencyLimit(**record["concurrency"]),
+                "output_estimate": OutputLengthEstimate(**record["output_estimate"])
+            })
+        except (TypeError, KeyError):
+            logger.warning(f"ignore incompatible budget state for `{model}` in {file_path}")
+    return states
+
+
+def _store_budget_states(file_path: pathlib.Path, states: dict[str, Any]) -> None:
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    records = {}
+    if file_path.is_file():
+        try:
+            with open(file_path, "r", encoding="utf-8") as file:
+                records = json.load(file)
+        except json.JSONDecodeError:
+            pass
+    for model, state in states.items():
+        record = dataclasses.asdict(state)
+        record["num_running"] = 0  # the running requests belong to this run
+        records[model] = record
+
+    tmp_path = file_path.with_name(f"{file_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(records, file, indent=2)
+    os.replace(tmp_path, file_path)  # other processes never read a partial file
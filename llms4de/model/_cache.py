@@ -0,0 +1,528 @@
+########################################################################################################################
+# Cache helpers version: 2026-10-18
+#
+# use the following methods:
+# open_cache(...)                  ==> get the cache for the given cache path
+# canonical_hash(...)              ==> compute the cache key of a request
+# migrate_directory_cache(...)     ==> copy a directory with one JSON file per pair into a SQLite cache
+# rekey_cache(...)                 ==> recompute the cache keys of all pairs in a cache
+#
+# The API helpers store each executed pair of request and response under the hash of the request. The cache path
+# `data/<name>_cache` is either a directory with one `<hash>.json` file per pair (CACHE_BACKEND = "directory") or a
+# single SQLite file `data/<name>_cache.sqlite` (CACHE_BACKEND = "sqlite"). If the SQLite file does not exist yet but
+# the directory does, the directory is migrated automatically.
+#
+# Each cache keeps an in-memory index of the hashes it contains, so that cache misses never touch the disk. The index is
+# loaded once per process and refreshed incrementally when another process has added pairs. The cached pairs are loaded
+# in chunks by LOAD_THREADS worker threads.
+#
+# The hash is computed from the canonical JSON of the request (sorted keys, integral floats as integers, without
+# HASH_EXCLUDED_FIELDS), so that reordering the keys of a request does not lead to a cache miss. SQLite caches with
+# keys from an older hash function are re-keyed automatically, directory caches must be re-keyed using
+# `tasks/rekey_caches.py`. SQLite caches are re-keyed in place in a single transaction while holding the cache's file
+# lock, so that concurrent writes are never lost, while directory caches are rebuilt next to the old directory and
+# swapped in. Still, no other process may use the cache while it is re-keyed, since the in-memory indexes of other
+# processes would not reflect the new keys.
+#
+# The API helpers also record the wall-clock latency of each executed request, which the `replay` API name uses to
+# reproduce the timing of a run without sending any requests. Loaded pairs contain the key "latency" if it was recorded.
+########################################################################################################################
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import shutil
+import sqlite3
+import threading
+from typing import Any, Iterable, Iterator, Literal
+
+from llms4de.model._executor import map_concurrently
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND: Literal["sqlite", "directory"] = "sqlite"
+
+LOAD_THREADS = min(8, os.cpu_count() or 1)  # worker threads that load cached pairs
+LOAD_CHUNK_SIZE = 500  # pairs per worker task, SQLite limits the number of parameters
+
+HASH_VERSION = 1  # increase whenever `canonical_hash` changes
+HASH_EXCLUDED_FIELDS = {"user", "metadata", "store", "keep_alive"}  # fields that do not influence the response
+
+
+########################################################################################################################
+# API
+########################################################################################################################
+
+
+def open_cache(path: pathlib.Path):  # -> "_SQLiteCache" | "_DirectoryCache"
+    """Get the cache for the given cache path.
+
+    Args:
+        path: The cache path, e.g., `data/openai_cache`.
+
+    Returns:
+        The cache, which provides `load_many(hashes)`, `store(hash, request, response, latency)`, `hashes()`,
+        `iter_pairs()`, and `latencies()`.
+    """
+    match CACHE_BACKEND:
+        case "sqlite":
+            sqlite_path = path.with_suffix(".sqlite")
+            key = (str(sqlite_path), os.getpid())  # connections must not be shared with forked child processes
+            with _caches_lock:
+                if key not in _caches.keys():
+                    _migrate_if_necessary(path, sqlite_path)
+                    _rekey_if_necessary(sqlite_path)
+                    _caches[key] = _SQLiteCache(sqlite_path)
+                return _caches[key]
+        case "directory":
+            key = (str(path), os.getpid())
+            with _caches_lock:
+                if key not in _caches.keys():
+                    _caches[key] = _DirectoryCache(path)
+                return _caches[key]
+        case _:
+            raise AssertionError(f"unknown cache backend `{CACHE_BACKEND}`")
+
+
+def canonical_request(request: dict) -> dict:
+    """Normalize the request for hashing and comparison.
+
+    Args:
+        request: The API request.
+
+    Returns:
+        The request without HASH_EXCLUDED_FIELDS and with integral floats converted to integers.
+    """
+    return {key: _normalize(value) for key, value in request.items() if key not in HASH_EXCLUDED_FIELDS}
+
+
+def canonical_hash(request: dict) -> str:
+    """Compute the cache key of the request, which does not depend on the order of keys.
+
+    Args:
+        request: The API request.
+
+    Returns:
+        The SHA-256 hash of the canonical JSON of the request.
+    """
+    canonical_json = json.dumps(canonical_request(request), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(bytes(canonical_json, "utf-8")).hexdigest()
+
+
+def migrate_directory_cache(directory: pathlib.Path, sqlite_path: pathlib.Path, *, batch_size: int = 10_000) -> int:
+    """Copy all pairs from the cache directory into the SQLite cache.
+
+    The pairs are stored under their canonical hash. Pairs that already exist in the SQLite cache are overwritten, so
+    the migration can be repeated.
+
+    Args:
+        directory: The directory with one `<hash>.json` file per pair.
+        sqlite_path: The path of the SQLite file.
+        batch_size: How many pairs to insert per transaction.
+
+    Returns:
+        The number of migrated pairs.
+    """
+    cache = _SQLiteCache(sqlite_path)
+    num_migrated = 0
+    batch, latencies = [], []
+    for file_path in _directory_cache_files(directory):
+        try:
+            with open(file_path, "r", encoding="utf-8") as file:
+                cached_pair = json.load(file)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            logger.warning(f"skip invalid cache file `{file_path}`")
+            continue
+        batch.append((canonical_hash(cached_pair["request"]), cached_pair["request"], cached_pair["response"]))
+        latencies.append(cached_pair.get("latency"))
+        if len(batch) >= batch_size:
+            num_migrated += cache.store_many(batch, latencies)
+            batch, latencies = [], []
+            logger.info(f"migrated {num_migrated} pairs from `{directory}`")
+    num_migrated += cache.store_many(batch, latencies)
+    cache.set_hash_version(HASH_VERSION)
+    cache.close()
+    logger.info(f"migrated {num_migrated} pairs from `{directory}` to `{sqlite_path}`")
+    return num_migrated
+
+
+def rekey_cache(path: pathlib.Path) -> dict[str, int]:
+    """Store all pairs of the cache under their canonical hash.
+
+    Pairs whose requests have the same canonical form collapse into a single pair. No other process may use the cache
+    while it is re-keyed.
+
+    Args:
+        path: The cache path, e.g., `data/openai_cache`.
+
+    Returns:
+        A report with the number of pairs before and after re-keying, the number of re-keyed pairs, the number of
+        collapsed duplicates, and the number of collapsed duplicates whose response differed from the kept response.
+    """
+    match CACHE_BACKEND:
+        case "sqlite":
+            sqlite_path = path.with_suffix(".sqlite")
+            with _caches_lock:
+                for key in [key for key in _caches.keys() if key[0] == str(sqlite_path)]:
+                    _caches.pop(key).close()
+                _migrate_if_necessary(path, sqlite_path)
+                with _file_lock(sqlite_path):
+                    return _rekey(_SQLiteCache(sqlite_path), sqlite_path)
+        case "directory":
+            with _caches_lock:
+                _caches.pop((str(path), os.getpid()), None)
+                return _rekey(_DirectoryCache(path), path)
+        case _:
+            raise AssertionError(f"unknown cache backend `{CACHE_BACKEND}`")
+
+
+########################################################################################################################
+# implementation
+########################################################################################################################
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _directory_cache_files(directory: pathlib.Path) -> Iterator[pathlib.Path]:
+    with os.scandir(directory) as entries:  # avoid sorting millions of file names
+        for entry in entries:
+            if entry.name.endswith(".json") and entry.is_file():
+                yield pathlib.Path(entry.path)
+
+
+def _normalize(obj: Any) -> Any:
+    if isinstance(obj, str):  # most common case, checked first
+        return obj
+    elif isinstance(obj, dict):
+        return {key: _normalize(value) for key, value in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [_normalize(value) for value in obj]
+    elif isinstance(obj, float) and obj.is_integer():
+        return int(obj)
+    else:
+        return obj
+
+
+def _rekey(cache, path: pathlib.Path) -> dict[str, int]:  # cache: "_SQLiteCache" | "_DirectoryCache"
+    report = {"num_pairs": 0, "num_rekeyed": 0, "num_collapsed": 0, "num_conflicting": 0, "num_pairs_after": 0}
+    response_hashes = {}  # canonical hash ==> hash of the kept response
+    old_latencies = cache.latencies()
+
+    def rekeyed_pairs() -> Iterator[tuple[str, dict, dict, float | None]]:
+        for hash, request, response in cache.iter_pairs():
+            report["num_pairs"] += 1
+            new_hash = canonical_hash(request)
+            if new_hash != hash:
+                report["num_rekeyed"] += 1
+            response_hash = hashlib.sha256(bytes(json.dumps(response, sort_keys=True), "utf-8")).digest()
+            if new_hash in response_hashes.keys():
+                report["num_collapsed"] += 1
+                if response_hashes[new_hash] != response_hash:
+                    report["num_conflicting"] += 1
+                continue
+            response_hashes[new_hash] = response_hash
+            yield new_hash, request, response, old_latencies.get(hash)
+
+    if isinstance(cache, _SQLiteCache):
+        cache.replace_pairs(rekeyed_pairs(), HASH_VERSION)  # in place, so that concurrent writes are not lost
+        cache.close()
+    else:
+        tmp_path = path.with_name(f"{path.name}.tmp{os.getpid()}")
+        new_cache = _DirectoryCache(tmp_path)
+        for batch in _batches(rekeyed_pairs(), 10_000):
+            new_cache.store_many([pair[:3] for pair in batch], [pair[3] for pair in batch])
+        new_cache.set_hash_version(HASH_VERSION)
+        old_path = path.with_name(f"{path.name}.old{os.getpid()}")
+        os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path)
+    report["num_pairs_after"] = len(response_hashes)
+
+    logger.info(
+        f"re-keyed `{path}`: {report['num_pairs']} pairs, {report['num_rekeyed']} with new keys, "
+        f"{report['num_collapsed']} collapsed duplicates ({report['num_conflicting']} with different responses), "
+        f"{report['num_pairs_after']} pairs after re-keying"
+    )
+    return report
+
+
+def _batches(items: Iterable[Any], batch_size: int) -> Iterator[list[Any]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+@contextlib.contextmanager
+def _file_lock(sqlite_path: pathlib.Path) -> Iterator[None]:
+    sqlite_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(sqlite_path.with_suffix(".sqlite.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)  # another process may already be migrating or re-keying the cache
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _migrate_if_necessary(directory: pathlib.Path, sqlite_path: pathlib.Path) -> None:
+    if sqlite_path.is_file() or not directory.is_dir():
+        return
+
+    with _file_lock(sqlite_path):
+        if not sqlite_path.is_file():
+            logger.info(f"migrate cache directory `{directory}` to `{sqlite_path}`")
+            tmp_path = sqlite_path.with_suffix(f".sqlite.tmp{os.getpid()}")
+            migrate_directory_cache(directory, tmp_path)
+            os.replace(tmp_path, sqlite_path)
+
+
+def _rekey_if_necessary(sqlite_path: pathlib.Path) -> None:
+    if not sqlite_path.is_file():
+        return
+
+    with _file_lock(sqlite_path):
+        cache = _SQLiteCache(sqlite_path)
+        if cache.hash_version() < HASH_VERSION:
+            logger.info(f"re-key `{sqlite_path}` since it uses an older hash function")
+            _rekey(cache, sqlite_path)
+        else:
+            cache.close()
+
+
+class _SQLiteCache:
+    path: pathlib.Path
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")  # readers and writers of many processes
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS pairs (hash TEXT PRIMARY KEY, request TEXT NOT NULL, response TEXT NOT NULL)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS latencies (hash TEXT PRIMARY KEY, latency REAL NOT NULL)"
+            )
+            if self._connection.execute("SELECT hash FROM pairs LIMIT 1").fetchone() is None:
+                self._connection.execute(f"PRAGMA user_version = {HASH_VERSION}")  # new caches use the current hash
+            self._connection.commit()
+        self._index = set()
+        self._index_max_rowid = 0
+        self._index_data_version = None
+
+    def load_many(self, hashes: list[str]) -> dict[str, dict]:
+        present_hashes = self.present(hashes)
+        chunks = [present_hashes[idx:idx + LOAD_CHUNK_SIZE] for idx in range(0, len(present_hashes), LOAD_CHUNK_SIZE)]
+        if len(chunks) > 1 and LOAD_THREADS > 1:
+            results = map_concurrently(self._load_chunk_with_new_connection, chunks, max_running=LOAD_THREADS)
+        else:
+            with self._lock:
+                results = [self._load_chunk(self._connection, chunk) for chunk in chunks]
+        cached_pairs = {}
+        for result in results:
+            cached_pairs.update(result)
+        return cached_pairs
+
+    def present(self, hashes: list[str]) -> list[str]:
+        with self._lock:
+            # the data version changes whenever another connection has committed changes
+            data_version = self._connection.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._index_data_version:
+                cursor = self._connection.execute(
+                    "SELECT rowid, hash FROM pairs WHERE rowid > ?", (self._index_max_rowid,)
+                )
+                for rowid, hash in cursor:  # replaced rows get new rowids, so they are included
+                    self._index.add(hash)
+                    self._index_max_rowid = max(self._index_max_rowid, rowid)
+                self._index_data_version = data_version
+            return [hash for hash in set(hashes) if hash in self._index]
+
+    def _load_chunk_with_new_connection(self, hashes: list[str]) -> dict[str, dict]:
+        connection = sqlite3.connect(self.path, timeout=60)  # connections must not be used by two threads at once
+        try:
+            return self._load_chunk(connection, hashes)
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _load_chunk(connection: sqlite3.Connection, hashes: list[str]) -> dict[str, dict]:
+        cursor = connection.execute(
+            "SELECT hash, request, response, latency FROM pairs LEFT JOIN latencies USING (hash) "
+            f"WHERE hash IN ({', '.join('?' * len(hashes))})",
+            hashes
+        )
+        cached_pairs = {}
+        for hash, request, response, latency in cursor:
+            cached_pairs[hash] = {"request": json.loads(request), "response": json.loads(response)}
+            if latency is not None:
+                cached_pairs[hash]["latency"] = latency
+        return cached_pairs
+
+    def store(self, hash: str, request: dict, response: dict, latency: float | None = None) -> None:
+        self.store_many([(hash, request, response)], [latency])
+
+    def store_many(self, pairs: list[tuple[str, dict, dict]], latencies: list[float | None] | None = None) -> int:
+        rows = [(hash, json.dumps(request), json.dumps(response)) for hash, request, response in pairs]
+        latency_rows = [] if latencies is None else [
+            (hash, latency) for (hash, _, _), latency in zip(pairs, latencies) if latency is not None
+        ]
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO pairs VALUES (?, ?, ?)", rows)
+            self._connection.executemany("INSERT OR REPLACE INTO latencies VALUES (?, ?)", latency_rows)
+            self._connection.commit()
+            self._index.update(hash for hash, _, _ in rows)  # own commits do not change the data version
+        return len(rows)
+
+    def hashes(self) -> list[str]:
+        with self._lock:
+            return [hash for hash, in self._connection.execute("SELECT hash FROM pairs")]
+
+    def iter_pairs(self) -> Iterator[tuple[str, dict, dict]]:
+        cursor = self._connection.cursor()  # separate cursor, since the iteration is not guarded by the lock
+        for hash, request, response in cursor.execute("SELECT hash, request, response FROM pairs"):
+            yield hash, json.loads(request), json.loads(response)
+
+    def latencies(self) -> dict[str, float]:
+        with self._lock:
+            return dict(self._connection.execute("SELECT hash, latency FROM latencies"))
+
+    def hash_version(self) -> int:
+        with self._lock:
+            return self._connection.execute("PRAGMA user_version").fetchone()[0]
+
+    def replace_pairs(self, pairs: Iterable[tuple[str, dict, dict, float | None]], hash_version: int) -> None:
+        # the pairs may be read from this cache (`iter_pairs`), the new tables replace the old ones in one transaction
+        with self._lock:
+            connection = self._connection
+            connection.execute("BEGIN IMMEDIATE")  # other connections wait until the transaction has been committed
+            try:
+                connection.execute(
+                    "CREATE TABLE new_pairs (hash TEXT PRIMARY KEY, request TEXT NOT NULL, response TEXT NOT NULL)"
+                )
+                connection.execute("CREATE TABLE new_latencies (hash TEXT PRIMARY KEY, latency REAL NOT NULL)")
+                for batch in _batches(pairs, 10_000):
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO new_pairs VALUES (?, ?, ?)",
+                        [(hash, json.dumps(request), json.dumps(response)) for hash, request, response, _ in batch]
+                    )
+                    connection.executemany(
+                        "INSERT OR REPLACE INTO new_latencies VALUES (?, ?)",
+                        [(hash, latency) for hash, _, _, latency in batch if latency is not None]
+                    )
+                connection.execute("DROP TABLE pairs")
+                connection.execute("DROP TABLE latencies")
+                connection.execute("ALTER TABLE new_pairs RENAME TO pairs")
+                connection.execute("ALTER TABLE new_latencies RENAME TO latencies")
+                connection.execute(f"PRAGMA user_version = {int(hash_version)}")
+                connection.commit()
+            except BaseException:
+                connection.rollback()
+                raise
+            self._index = set()
+            self._index_max_rowid = 0
+            self._index_data_version = None
+
+    def set_hash_version(self, hash_version: int) -> None:
+        with self._lock:
+            self._connection.execute(f"PRAGMA user_version = {int(hash_version)}")
+            self._connection.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class _DirectoryCache:
+    path: pathlib.Path
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        path.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index = set()
+        self._index_mtime = None
+
+    def load_many(self, hashes: list[str]) -> dict[str, dict]:
+        present_hashes = self.present(hashes)
+        chunks = [present_hashes[idx:idx + LOAD_CHUNK_SIZE] for idx in range(0, len(present_hashes), LOAD_CHUNK_SIZE)]
+        if len(chunks) > 1 and LOAD_THREADS > 1:
+            results = map_concurrently(self._load_chunk, chunks, max_running=LOAD_THREADS)
+        else:
+            results = [self._load_chunk(chunk) for chunk in chunks]
+        cached_pairs = {}
+        for result in results:
+            cached_pairs.update(result)
+        return cached_pairs
+
+    def present(self, hashes: list[str]) -> list[str]:
+        with self._lock:
+            # the modification time of the directory changes whenever a file is added
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime != self._index_mtime:
+                self._index = set(file_path.stem for file_path in _directory_cache_files(self.path))
+                self._index_mtime = mtime
+            return [hash for hash in set(hashes) if hash in self._index]
+
+    def _load_chunk(self, hashes: list[str]) -> dict[str, dict]:
+        cached_pairs = {}
+        for hash in hashes:
+            try:
+                with open(self.path / f"{hash}.json", "r", encoding="utf-8") as file:
+                    cached_pairs[hash] = json.load(file)
+            except FileNotFoundError:  # removed since the index was loaded
+                pass
+        return cached_pairs
+
+    def store(self, hash: str, request: dict, response: dict, latency: float | None = None) -> None:
+        cached_pair = {"request": request, "response": response}
+        if latency is not None:
+            cached_pair["latency"] = latency
+        with self._lock:
+            index_is_current = os.stat(self.path).st_mtime_ns == self._index_mtime
+            with open(self.path / f"{hash}.json", "w", encoding="utf-8") as file:
+                json.dump(cached_pair, file)
+            self._index.add(hash)
+            if index_is_current:  # avoid re-scanning the directory because of this process' own files
+                self._index_mtime = os.stat(self.path).st_mtime_ns
+
+    def store_many(self, pairs: list[tuple[str, dict, dict]], latencies: list[float | None] | None = None) -> int:
+        latencies = [None] * len(pairs) if latencies is None else latencies
+        for (hash, request, response), latency in zip(pairs, latencies):
+            self.store(hash, request, response, latency)
+        return len(pairs)
+
+    def hashes(self) -> list[str]:
+        return [file_path.stem for file_path in _directory_cache_files(self.path)]
+
+    def iter_pairs(self) -> Iterator[tuple[str, dict, dict]]:
+        for file_path in _directory_cache_files(self.path):
+            with open(file_path, "r", encoding="utf-8") as file:
+                cached_pair = json.load(file)
+            yield file_path.stem, cached_pair["request"], cached_pair["response"]
+
+    def latencies(self) -> dict[str, float]:
+        latencies = {}
+        for file_path in _directory_cache_files(self.path):
+            with open(file_path, "r", encoding="utf-8") as file:
+                cached_pair = json.load(file)
+            if "latency" in cached_pair.keys():
+                latencies[file_path.stem] = cached_pair["latency"]
+        return latencies
+
+    def set_hash_version(self, hash_version: int) -> None:
+        pass  # directory caches do not record the hash version
+
+    def close(self) -> None:
+        pass
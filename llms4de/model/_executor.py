@@ -0,0 +1,653 @@
+########################################################################################################################
+# Executor helpers version: 2026-10-18
+#
+# use the following methods:
+# execute_pairs(...)       ==> execute the pairs of an API helper on an asyncio event loop
+# map_concurrently(...)    ==> apply a blocking function to many items with bounded concurrency
+# fold_duplicates(...)     ==> collapse items with the same key before executing them
+# fan_out(...)             ==> distribute the results of the collapsed items to all original positions
+# fan_out_callback(...)    ==> distribute the result of one collapsed item to a callback for all original positions
+# release_method_caches(...) ==> clear the `functools.cache` of all methods of the request and response classes
+#
+# The API helpers (`_openai.py`, `_anthropic.py`, `_ollama.py`) create the pairs and the progress bar, while this module
+# schedules their execution. Instead of repeatedly polling all pairs, the scheduler keeps a ready queue and sleeps until
+# a request completes or the rate limit budget has refilled enough for the next request. Failed requests are put back
+# into the ready queue according to the retry policy of `_retry.py`. A request that still fails afterward (e.g., with a
+# status 400 or an exception that is not retryable) receives an error response and counts as failed, while the other
+# requests continue; the failures are reported at the end of the run.
+#
+# The scheduler records the latency of each pair from the start of its last attempt until its response. A few slow
+# requests (e.g., on an overloaded replica) dominate the wall time of a run, so with a `hedge_percentile`, a
+# deterministic request that is still running after that percentile of the recent latencies is sent a second time, and
+# the first response wins. The duplicates count against the rate limit budgets like any other request, but they may
+# exceed `max_running` and the concurrency limits by HEDGE_MAX_RUNNING_FRACTION, since the executor typically runs at
+# these limits. The slower attempt is left to finish in the background (the read timeout of `_http.py` bounds how long
+# it can take) and occupies one of these extra slots until then.
+#
+# With a `telemetry`, the scheduler also records why it waits (the bottleneck letters of the progress bar), the budget
+# states, the latencies, retries, and cost of the run (see _telemetry.py).
+#
+# With a cost `governor`, the scheduler reserves the cost of each request before it starts it and charges the actual
+# cost of the response (see _governor.py). With rate limiting, the reservation assumes the expected output length of
+# the model (`state.expected_cost(request)`, see OutputLengthEstimate in _budget.py), otherwise the maximum cost. If the
+# governor does not allow a request, the scheduler waits ("C" in the progress bar), or stops starting requests, waits
+# for the running ones, and raises the governor's AssertionError.
+########################################################################################################################
+import asyncio
+import collections
+import concurrent.futures
+import copy
+import logging
+import math
+import time
+from typing import Any, Callable, Iterable
+
+from llms4de.model._governor import CostGovernor
+from llms4de.model._retry import MAX_ATTEMPTS, MAX_RATE_LIMIT_ATTEMPTS, is_retryable_error, is_retryable_status, \
+        retry_delay
+from llms4de.model._telemetry import Telemetry
+
+logger = logging.getLogger(__name__)
+
+LATENCY_WINDOW = 1_000  # number of recent latencies to determine the hedging threshold from
+HEDGE_MIN_SAMPLES = 20  # number of responses before requests are hedged
+HEDGE_MAX_RUNNING_FRACTION = 0.1  # extra slots for duplicates relative to `max_running`
+
+
+########################################################################################################################
+# API
+########################################################################################################################
+
+
+def execute_pairs(
+        pairs: list,
+        *,
+        context: dict,
+        semaphore: "threading.Semaphore | multiprocessing.Semaphore",
+        progress_bar: "tqdm.tqdm",
+        response_cls: type,
+        max_running: int,
+        new_budget_state: Callable[[], Any] | None = None,
+        concurrency_limit: Any | None = None,
+        track_cost: bool = False,
+        poll_interval: float | None = None,
+        on_done: Callable[[Any], None] | None = None,
+        hedge_percentile: float | None = None,
+        telemetry: Telemetry | None = None,
+        governor: CostGovernor | None = None,
+        stop: "threading.Event | None" = None
+) -> None:
+    """Execute the given pairs and set their responses and latencies.
+
+    The budget state objects (if any) must provide the fields `concurrency` (a `ConcurrencyLimit`), `num_running`, and
+    `retry_at`, and the methods `consider_time()`, `is_enough_for_request(...)`, `seconds_until_enough(...)`,
+    `decrease_by_request(...)`, `increase_by_response(...)`, and `set_from_headers(...)`.
+
+    Failed requests are retried according to `_retry.py`. To hedge requests, their request objects must provide
+    `is_deterministic()`.
+
+    Args:
+        pairs: The pairs to execute, which must all have status "open".
+        context: The (possibly global) context that stores `num_running` and the budget states of the models.
+        semaphore: The (possibly global) semaphore that guards the context.
+        progress_bar: The progress bar of the API helper.
+        response_cls: The class that wraps the JSON response.
+        max_running: The maximum number of requests running in parallel.
+        new_budget_state: Optional factory for the budget state of a model, None to disable rate limiting.
+        concurrency_limit: Optional adaptive limit for APIs without budget states, which must provide
+            `allows(num_running)` and `on_complete(started_at, response, num_running, status_code)`, whose status
+            code is None for timeouts and connection errors.
+        track_cost: Whether to accumulate the responses' `total_cost()` in the progress bar.
+        poll_interval: Optional interval in which to re-check the context, required if it is shared between processes.
+        on_done: Optional function that receives each pair as soon as it is done, which must not block.
+        hedge_percentile: Optional latency percentile (e.g., 0.95) after which to send a duplicate of a deterministic
+            request, None to disable hedging.
+        telemetry: Optional telemetry of the run, which records the bottlenecks, latencies, budgets, and cost.
+        governor: Optional cost governor, which requires `track_cost`, request objects that provide `max_cost()`, and
+            budget states that provide `expected_cost(request)`.
+        stop: Optional event after which no more requests are started, the running requests finish and then an
+            AssertionError is raised.
+    """
+    if governor is not None and not track_cost:
+        raise AssertionError("A cost governor requires `track_cost`!")
+    scheduler = _Scheduler(
+        pairs=pairs,
+        context=context,
+        semaphore=semaphore,
+        progress_bar=progress_bar,
+        response_cls=response_cls,
+        max_running=max_running,
+        new_budget_state=new_budget_state,
+        concurrency_limit=concurrency_limit,
+        track_cost=track_cost,
+        poll_interval=poll_interval,
+        on_done=on_done,
+        hedge_percentile=hedge_percentile,
+        telemetry=telemetry,
+        governor=governor,
+        stop=stop
+    )
+    try:
+        _run_coroutine(scheduler.run())
+    finally:
+        if governor is not None:
+            governor.sync()  # write the costs of the run to the ledger and return the unused headroom
+
+
+def map_concurrently(
+        function: Callable[[Any], Any],
+        items: Iterable[Any],
+        *,
+        max_running: int,
+        callback: Callable[[Any, Any], None] | None = None
+) -> list[Any]:
+    """Apply the blocking function to all items with at most `max_running` calls in parallel.
+
+    Args:
+        function: The blocking function.
+        items: The items to apply the function to.
+        max_running: The maximum number of calls running in parallel.
+        callback: Optional function that receives each item and its result as soon as the call has finished.
+
+    Returns:
+        The results in the order of the items.
+    """
+    items = list(items)
+
+    async def run() -> list[Any]:
+        loop = asyncio.get_running_loop()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_running)) as thread_pool:
+            async def apply(item: Any) -> Any:
+                result = await loop.run_in_executor(thread_pool, function, item)
+                if callback is not None:
+                    callback(item, result)
+                return result
+
+            return await asyncio.gather(*(apply(item) for item in items))
+
+    if len(items) == 0:
+        return []
+    return _run_coroutine(run())
+
+
+def fold_duplicates(items: list[Any], key: Callable[[Any], Any]) -> tuple[list[Any], list[int]]:
+    """Collapse items with the same key into the first of them.
+
+    Args:
+        items: The items, e.g., the pairs of an API helper.
+        key: Function that computes the key of an item, e.g., the hash of the request.
+
+    Returns:
+        The unique items and, for each of the given items, the position of its unique item.
+    """
+    positions_by_key = {}
+    unique_items = []
+    positions = []
+    for item in items:
+        item_key = key(item)
+        if item_key not in positions_by_key.keys():
+            positions_by_key[item_key] = len(unique_items)
+            unique_items.append(item)
+        positions.append(positions_by_key[item_key])
+    return unique_items, positions
+
+
+def fan_out(unique_results: list[Any], positions: list[int]) -> list[Any]:
+    """Distribute the results of the unique items to the positions of all items.
+
+    Duplicates receive deep copies, so that callers can modify each result independently.
+
+    Args:
+        unique_results: The results of the unique items returned by `fold_duplicates`.
+        positions: The positions returned by `fold_duplicates`.
+
+    Returns:
+        The results in the order of all items.
+    """
+    is_used = [False] * len(unique_results)
+    results = []
+    for position in positions:
+        if is_used[position]:
+            results.append(copy.deepcopy(unique_results[position]))
+        else:
+            results.append(unique_results[position])
+            is_used[position] = True
+    return results
+
+
+def fan_out_callback(
+        callback: Callable[[int, Any], None] | None,
+        positions: list[int]
+) -> Callable[[int, Any], None]:
+    """Wrap the callback for all items so that it can be called once for each unique item.
+
+    Like `fan_out`, duplicates receive deep copies.
+
+    Args:
+        callback: Optional function that receives the index of an item and its result, None to ignore the results.
+        positions: The positions returned by `fold_duplicates`.
+
+    Returns:
+        A function that receives the position of a unique item and its result.
+    """
+    indices_by_position = collections.defaultdict(list)
+    for idx, position in enumerate(positions):
+        indices_by_position[position].append(idx)
+
+    def call(position: int, result: Any) -> None:
+        if callback is not None:
+            for jdx, idx in enumerate(indices_by_position[position]):
+                callback(idx, result if jdx == 0 else copy.deepcopy(result))
+
+    return call
+
+
+def release_method_caches(*classes: type) -> None:
+    """Clear the `functools.cache` of all methods of the given classes.
+
+    A method decorated with `functools.cache` keeps every instance it was called on alive, so the API helpers must
+    release the caches once their pairs are no longer needed.
+
+    Args:
+        *classes: The classes, e.g., the request and response classes of an API helper.
+    """
+    for cls in classes:
+        for attribute in vars(cls).values():
+            if hasattr(attribute, "cache_clear"):
+                attribute.cache_clear()
+
+
+########################################################################################################################
+# implementation
+########################################################################################################################
+
+
+def _run_coroutine(coroutine) -> Any:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:  # no event loop is running in this thread
+        return asyncio.run(coroutine)
+
+    # an event loop is already running in this thread (e.g., in a notebook) ==> run in a separate thread
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as thread_pool:
+        return thread_pool.submit(asyncio.run, coroutine).result()
+
+
+class _Scheduler:
+
+    def __init__(
+            self,
+            *,
+            pairs: list,
+            context: dict,
+            semaphore: "threading.Semaphore | multiprocessing.Semaphore",
+            progress_bar: "tqdm.tqdm",
+            response_cls: type,
+            max_running: int,
+            new_budget_state: Callable[[], Any] | None,
+            concurrency_limit: Any | None,
+            track_cost: bool,
+            poll_interval: float | None,
+            on_done: Callable[[Any], None] | None,
+            hedge_percentile: float | None,
+            telemetry: Telemetry | None,
+            governor: CostGovernor | None,
+            stop: "threading.Event | None"
+    ) -> None:
+        self.context = context
+        self.semaphore = semaphore
+        self.progress_bar = progress_bar
+        self.response_cls = response_cls
+        self.max_running = max_running
+        self.new_budget_state = new_budget_state
+        self.concurrency_limit = concurrency_limit
+        self.track_cost = track_cost
+        self.poll_interval = poll_interval
+        self.on_done = on_done
+        self.hedge_percentile = hedge_percentile
+        self.telemetry = telemetry
+        self.governor = governor
+        self.stop = stop
+
+        self.ready = collections.deque(pairs)
+        self.attempts = collections.Counter()  # id of pair ==> number of failed attempts
+        self.reserved_costs = collections.defaultdict(list)  # id of pair ==> reserved costs of its running attempts
+        self.tasks = set()
+        self.error = None
+        self.exceptions = collections.Counter()  # type of exception ==> number of pairs that failed with it
+        self.wake_up = None
+        self.thread_pool = None
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.abandoned = {}  # attempt that lost against its duplicate ==> pair
+        self.num_hedged = 0
+        self.max_extra_running = 0 if hedge_percentile is None else math.ceil(HEDGE_MAX_RUNNING_FRACTION * max_running)
+        self.num_extra_running = 0  # running attempts of hedged requests in addition to one attempt per request
+        self.last_model = None  # model of the last started request, the stragglers are accounted to it
+
+    async def run(self) -> None:
+        self.wake_up = asyncio.Event()
+        self.thread_pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_running + self.max_extra_running)
+        try:
+            while (len(self.ready) > 0 or len(self.tasks) > 0) and self.error is None:
+                if self.stop is not None and self.stop.is_set():
+                    self.error = AssertionError("Stopped starting requests, since the run was stopped!")
+                    break
+                if len(self.ready) > 0:
+                    with self.semaphore:
+                        started_at, delay = self._try_start(self.ready[0])
+                    if started_at is not None:
+                        pair = self.ready.popleft()
+                        task = asyncio.create_task(self._execute(pair, started_at))
+                        self.tasks.add(task)
+                        continue
+                else:
+                    self._set_bottleneck("Z", "stragglers", self.last_model)  # wait for stragglers
+                    delay = math.inf
+
+                # nothing can be started right now ==> sleep until a request completes or the budget has refilled
+                if self.poll_interval is not None:
+                    delay = min(delay, self.poll_interval)
+                self.wake_up.clear()
+                try:
+                    await asyncio.wait_for(self.wake_up.wait(), timeout=None if math.isinf(delay) else delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            if len(self.tasks) > 0:  # only in case of an error
+                await asyncio.gather(*self.tasks, return_exceptions=True)
+        finally:
+            # the slower attempts of hedged requests are not awaited, but they no longer count as running
+            with self.semaphore:
+                for attempt, pair in list(self.abandoned.items()):
+                    del self.abandoned[attempt]
+                    self._release(pair)
+            self.thread_pool.shutdown(wait=False)
+
+        if len(self.latencies) > 0:
+            message = f"request latency: p50 {_percentile(self.latencies, 0.5):.2f} seconds, " \
+                      f"p99 {_percentile(self.latencies, 0.99):.2f} seconds"
+            if self.num_hedged > 0:
+                message += f", hedged {self.num_hedged} requests"
+            logger.info(message)
+
+        if len(self.exceptions) > 0:
+            summary = ", ".join(f"{count}x {name}" for name, count in self.exceptions.most_common())
+            logger.warning(f"{sum(self.exceptions.values())} requests failed with exceptions: {summary}")
+
+        if self.error is not None:
+            raise self.error
+
+    def _try_start(self, pair, is_duplicate: bool = False) -> tuple[float | None, float]:
+        """Start the pair and return its start time, or return how long to wait (inf means until completion)."""
+        model = pair.request.model
+        if self.new_budget_state is not None:
+            if model not in self.context.keys():
+                self.context[model] = self.new_budget_state()
+            state = self.context[model].consider_time()
+            if self.telemetry is not None:
+                self.telemetry.on_budget(model, state)
+
+            if state.retry_at > time.time():
+                self.context[model] = state
+                self._set_bottleneck("L", "rate_limit_pause", model)
+                return None, state.retry_at - time.time()
+
+            if not state.is_enough_for_request(pair.request):
+                self.context[model] = state
+                is_rpm = getattr(state, "r", None) is not None and state.r < 1
+                self._set_bottleneck("L", "requests_per_minute" if is_rpm else "tokens_per_minute", model)
+                return None, state.seconds_until_enough(pair.request)
+
+            if not is_duplicate and not state.concurrency.allows(state.num_running):
+                self.context[model] = state
+                self._set_bottleneck("S", "concurrency", model)
+                return None, math.inf
+
+            if not is_duplicate and self.context["num_running"] >= self.max_running:
+                self.context[model] = state
+                self._set_bottleneck("T", "max_running", model)
+                return None, math.inf
+
+            delay = self._reserve_cost(pair, is_duplicate, state)
+            if delay is not None:
+                self.context[model] = state
+                return None, delay
+
+            logger.debug(f"execute request for `{model}` with concurrency {int(state.concurrency.limit)}")
+            state = state.decrease_by_request(pair.request)
+            state.num_running += 1
+            self.context[model] = state
+        else:
+            if not is_duplicate and self.context["num_running"] >= self.max_running:
+                self._set_bottleneck("T", "max_running", model)
+                return None, math.inf
+
+            if not is_duplicate and self.concurrency_limit is not None \
+                    and not self.concurrency_limit.allows(self.context["num_running"]):
+                self._set_bottleneck("S", "concurrency", model)
+                return None, math.inf
+
+            delay = self._reserve_cost(pair, is_duplicate, None)
+            if delay is not None:
+                return None, delay
+
+        pair.status = "running"
+        self.last_model = model
+        self.context["num_running"] = self.context["num_running"] + 1
+        self.progress_bar.running = self.context["num_running"]
+        self._set_bottleneck("P", "starting", model)
+        return time.time(), 0
+
+    async def _execute(self, pair, started_at: float) -> None:
+        try:
+            await self._execute_pair(pair, started_at)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.tasks.discard(asyncio.current_task())
+            self.wake_up.set()
+
+    async def _execute_pair(self, pair, started_at: float) -> None:
+        model = pair.request.model
+        attempt = await self._send(pair, started_at)
+        try:
+            http_response = attempt.result()
+        except Exception as e:
+            with self.semaphore:
+                if self.concurrency_limit is not None and is_retryable_error(e):  # e.g., a timeout
+                    self.concurrency_limit.on_complete(started_at, None, self.context["num_running"], None)
+                self._release(pair)
+            self.attempts[id(pair)] += 1
+            if is_retryable_error(e) and self.attempts[id(pair)] < MAX_ATTEMPTS:
+                await self._retry_later(pair, retry_delay(self.attempts[id(pair)], {}), type(e).__name__)
+            else:
+                logger.debug(f"request for `{model}` failed with {type(e).__name__}: {e}")
+                with self.semaphore:
+                    self.exceptions[type(e).__name__] += 1
+                    self._fail(pair, {"type": "error", "error": {"type": type(e).__name__, "message": str(e)}})
+            return
+
+        status_code = http_response.status_code
+        response = self.response_cls(http_response.json()) if status_code == 200 else None
+        with self.semaphore:
+            if self.concurrency_limit is not None:
+                self.concurrency_limit.on_complete(started_at, response, self.context["num_running"], status_code)
+            self._release(pair)
+            if self.new_budget_state is not None:
+                state = self.context[model].set_from_headers(http_response.headers)
+                self.context[model] = state
+
+            if status_code == 200:
+                pair.response = response
+                pair.latency = time.time() - started_at
+                self.latencies.append(pair.latency)
+                if self.new_budget_state is not None:
+                    state = self.context[model].increase_by_response(pair.request, pair.response)
+                    state.concurrency.on_success(self.max_running)
+                    self.context[model] = state
+                if self.telemetry is not None:
+                    self.telemetry.on_response(model, pair.latency, pair.response)
+                if self.track_cost:
+                    self._add_cost(pair.response.total_cost())
+                pair.status = "done"
+                self.progress_bar.update()
+                if self.on_done is not None:
+                    self.on_done(pair)
+                return
+
+            self.attempts[id(pair)] += 1
+            delay = retry_delay(self.attempts[id(pair)], http_response.headers)
+            if status_code == 429 and self.new_budget_state is not None:
+                if self.attempts[id(pair)] >= MAX_RATE_LIMIT_ATTEMPTS:  # e.g., the quota is exhausted
+                    self._fail(pair, _json_or_error(http_response))
+                    return
+                # pause all requests for the model, the budget state determines when to continue
+                state = self.context[model]
+                state.concurrency.on_rate_limit(started_at)
+                state.retry_at = max(state.retry_at, time.time() + delay)
+                self.context[model] = state
+                logger.debug(f"rate limit error for `{model}` -> wait for {delay:.1f} seconds")
+                pair.status = "open"
+                self.ready.appendleft(pair)
+                self.progress_bar.retries += 1
+                self.progress_bar.update_postfix()  # not done -> update only postfix
+                if self.telemetry is not None:
+                    self.telemetry.on_retry(model, f"status {status_code}")
+                return
+
+            if not is_retryable_status(status_code) or self.attempts[id(pair)] >= MAX_ATTEMPTS:
+                self._fail(pair, _json_or_error(http_response))
+                return
+
+        await self._retry_later(pair, delay, f"status {status_code}")
+
+    async def _send(self, pair, started_at: float) -> asyncio.Future:
+        """Send the request (and possibly a duplicate) and return the first attempt that finishes."""
+        loop = asyncio.get_running_loop()
+        attempts = {loop.run_in_executor(self.thread_pool, pair.request.execute): started_at}
+        if self.hedge_percentile is not None and len(self.latencies) >= HEDGE_MIN_SAMPLES \
+                and pair.request.is_deterministic():
+            hedge_at = started_at + _percentile(self.latencies, self.hedge_percentile)
+            done, _ = await asyncio.wait(attempts.keys(), timeout=max(0.0, hedge_at - time.time()))
+            if len(done) == 0 and self.num_extra_running < self.max_extra_running:
+                with self.semaphore:
+                    hedged_at, _ = self._try_start(pair, is_duplicate=True)
+                if hedged_at is not None:  # otherwise, the budget does not allow a duplicate right now
+                    self.num_extra_running += 1
+                    logger.debug(f"hedge request for `{pair.request.model}` after {hedged_at - started_at:.2f} seconds")
+                    attempts[loop.run_in_executor(self.thread_pool, pair.request.execute)] = hedged_at
+                    self.num_hedged += 1
+
+        done, _ = await asyncio.wait(attempts.keys(), return_when=asyncio.FIRST_COMPLETED)
+        winner = next(attempt for attempt in attempts.keys() if attempt in done)
+        for attempt in attempts.keys():
+            if attempt is not winner:
+                self.abandoned[attempt] = pair
+                attempt.add_done_callback(self._on_abandoned_done)
+        return winner
+
+    def _on_abandoned_done(self, attempt: asyncio.Future) -> None:
+        """Account for the slower attempt of a hedged request once it has finished."""
+        if attempt not in self.abandoned.keys():  # already released at the end of the run
+            return
+        pair = self.abandoned.pop(attempt)
+        self.num_extra_running -= 1
+        model = pair.request.model
+        http_response = None if attempt.cancelled() or attempt.exception() is not None else attempt.result()
+        with self.semaphore:
+            self._release(pair)
+            if http_response is not None and self.new_budget_state is not None:
+                state = self.context[model].set_from_headers(http_response.headers)
+                if http_response.status_code == 200:
+                    state = state.increase_by_response(pair.request, self.response_cls(http_response.json()))
+                self.context[model] = state
+        if http_response is not None and http_response.status_code == 200 and self.track_cost:
+            self._add_cost(self.response_cls(http_response.json()).total_cost())  # duplicates are billed, too
+        self.progress_bar.update_postfix()
+        self.wake_up.set()
+
+    async def _retry_later(self, pair, delay: float, reason: str) -> None:
+        logger.info(f"retry request in {delay:.1f} seconds after {reason} (attempt {self.attempts[id(pair)]})")
+        pair.status = "open"
+        self.progress_bar.retries += 1
+        self.progress_bar.update_postfix()
+        if self.telemetry is not None:
+            self.telemetry.on_retry(pair.request.model, reason)
+        await asyncio.sleep(delay)
+        self.ready.appendleft(pair)
+
+    def _fail(self, pair, body: dict) -> None:
+        """Give up on the pair with the given error response, requires the semaphore."""
+        pair.response = self.response_cls(body)
+        if self.telemetry is not None:
+            self.telemetry.on_response(pair.request.model, None, pair.response)
+        if self.track_cost:
+            self._add_cost(pair.response.total_cost())
+        pair.status = "done"
+        self.progress_bar.failed += 1
+        self.progress_bar.update()
+        if self.on_done is not None:
+            self.on_done(pair)
+
+    def _reserve_cost(self, pair, is_duplicate: bool, state: Any | None) -> float | None:
+        """Reserve the expected cost of the pair, or return how long to wait (inf means until completion).
+
+        If the governor does not allow the pair at all, the error is recorded so that the run stops cleanly.
+        """
+        if self.governor is None:
+            return None
+        cost = pair.request.max_cost() if state is None else state.expected_cost(pair.request)
+        try:
+            delay = self.governor.try_reserve(cost)
+        except AssertionError as e:
+            if is_duplicate:
+                return math.inf
+            logger.warning(str(e))
+            self.error = e  # stop starting requests, but wait for the running ones
+            return 0.0  # let the run loop notice the error right away
+        if delay == 0:
+            self.reserved_costs[id(pair)].append(cost)
+            return None
+        self._set_bottleneck("C", "cost_limit", pair.request.model)
+        return delay
+
+    def _set_bottleneck(self, letter: str, bottleneck: str, model: str | None) -> None:
+        """Show the bottleneck in the progress bar and record it in the telemetry."""
+        self.progress_bar.bottleneck = letter
+        self.progress_bar.update_postfix()
+        if self.telemetry is not None:
+            self.telemetry.on_bottleneck(model, bottleneck)
+
+    def _add_cost(self, cost: float) -> None:
+        self.progress_bar.cost += cost
+        if self.governor is not None:
+            self.governor.charge(cost)
+        if self.telemetry is not None:
+            self.telemetry.on_cost(cost)
+
+    def _release(self, pair) -> None:
+        """Count the request of the pair as no longer running, requires the semaphore."""
+        model = pair.request.model
+        if self.governor is not None:
+            reserved_costs = self.reserved_costs[id(pair)]
+            self.governor.release(reserved_costs.pop())
+            if len(reserved_costs) == 0:
+                del self.reserved_costs[id(pair)]
+        self.context["num_running"] = self.context["num_running"] - 1
+        if self.new_budget_state is not None:
+            state = self.context[model]
+            state.num_running -= 1
+            self.context[model] = state
+        self.progress_bar.running = self.context["num_running"]
+
+
+def _percentile(values: Iterable[float], percentile: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(percentile * len(values)))]
+
+
+def _json_or_error(http_response: "requests.Response") -> dict:
+    try:
+        return http_response.json()
+    except ValueError:  # e.g., HTML error pages of proxies
+        return {"type": "error", "error": {"message": http_response.text, "status_code": http_response.status_code}}
@@ -0,0 +1,236 @@
+########################################################################################################################
+# Cost governor helpers version: 2026-10-18
+#
+# use the following methods:
+# CostGovernor(...)        ==> hard ceilings on the actual cost per run and per day
+# governor.sync()          ==> write the cost to the ledger and return the unused headroom, e.g., at the end of a run
+#
+# Without a governor, the API helpers compare the maximum cost of all requests to `force` once and otherwise ask for
+# confirmation. With a governor, they never ask, but the executor reserves the cost of each request before it starts
+# it and replaces the reservation with the actual cost (`_Response.total_cost()`) once the response arrives. A request
+# only starts if the actual cost plus the reservations of the running requests plus its own reservation stay within the
+# limits:
+# - if only the running requests' reservations are in the way, the executor waits for them to finish
+# - if the actual cost leaves no room for the request, the executor stops starting requests, waits for the running
+#   requests (whose responses are cached and delivered as usual), and raises an AssertionError, or, for the daily
+#   limit and with `wait_for_next_day`, pauses until the next day (UTC)
+#
+# The executor reserves the maximum cost of a request (including the cache writes of Anthropic's `cache_control`
+# breakpoints) until the output length estimate of its model has enough samples (see OutputLengthEstimate in
+# _budget.py), and afterward the cost with the expected output length. A response that is longer than expected is
+# still charged in full, so the limits can be exceeded by the unexpected output of the requests that are running when
+# they are reached. Without rate limiting and for batches, the executor always reserves the maximum cost, so that the
+# limits are hard ceilings, but a run stops as soon as the actual cost plus the maximum cost of the next request
+# exceed a limit, which, e.g., with `max_tokens=None`, can be well below the limit.
+#
+# The run limit applies to everything that is executed with the same governor, e.g., all windows of
+# `execute_requests_iter`. The daily cost is shared by all processes on this machine through the ledger at
+# COST_LEDGER_PATH, which is guarded by a file lock. To keep the ledger off the hot path, each governor reserves a
+# share of COST_LEDGER_LEASE of the daily limit in the ledger at once, serves the reservations of its requests from it
+# in memory, and writes its costs to the ledger when it needs more headroom, after COST_LEDGER_SYNC_INTERVAL seconds,
+# and at the end of each run (`sync()`), when it also returns the unused headroom. Reservations of processes that no
+# longer exist are discarded.
+########################################################################################################################
+import contextlib
+import datetime
+import fcntl
+import itertools
+import json
+import logging
+import math
+import os
+import pathlib
+import threading
+import time
+from typing import Iterator
+
+from llms4de.data import get_data_path
+
+logger = logging.getLogger(__name__)
+
+COST_LEDGER_PATH = get_data_path() / "cost_ledger.json"  # cost per day and running reservations of all processes
+COST_LEDGER_LEASE = 0.05  # share of `max_cost_per_day` that a governor reserves in the ledger in addition to its needs
+COST_LEDGER_SYNC_INTERVAL = 10.0  # seconds after which a governor writes its costs to the ledger at the latest
+COST_POLL_INTERVAL = 1.0  # seconds after which to check again whether the reservations of other processes are released
+
+
+########################################################################################################################
+# API
+########################################################################################################################
+
+
+class CostGovernor:
+    """Hard ceilings on the actual cost per run and per day."""
+    max_cost_per_run: float | None
+    max_cost_per_day: float | None
+    wait_for_next_day: bool
+
+    def __init__(
+            self,
+            *,
+            max_cost_per_run: float | None = None,
+            max_cost_per_day: float | None = None,
+            wait_for_next_day: bool = False,
+            ledger_path: pathlib.Path | None = None
+    ) -> None:
+        """Create a governor for a run.
+
+        Args:
+            max_cost_per_run: Optional ceiling on the cost in USD of everything executed with this governor.
+            max_cost_per_day: Optional ceiling on the cost in USD of all runs on this machine per day (UTC).
+            wait_for_next_day: Whether to pause until the next day instead of aborting at the daily limit.
+            ledger_path: Optional path of the ledger, defaults to COST_LEDGER_PATH.
+        """
+        self.max_cost_per_run = max_cost_per_run
+        self.max_cost_per_day = max_cost_per_day
+        self.wait_for_next_day = wait_for_next_day
+        self.ledger_path = ledger_path
+        self.run_cost = 0.0
+        self.run_reserved = 0.0
+        self.day_cost = 0.0  # cost of today in the ledger when it was last synced
+        self.unsynced_cost = 0.0  # cost that has not yet been written to the ledger
+        self.lease = 0.0  # reservation of this governor in the ledger, covers `run_reserved` and `unsynced_cost`
+        self.synced_at = -math.inf
+        self._ledger_key = f"{os.getpid()}:{next(_ledger_keys)}"
+        self._lock = threading.Lock()
+
+    def try_reserve(self, cost: float) -> float:
+        """Reserve the cost of a request that is about to start.
+
+        Args:
+            cost: The cost of the request in USD to reserve.
+
+        Returns:
+            Zero if the cost was reserved, otherwise how many seconds to wait before trying again.
+
+        Raises:
+            AssertionError: If the request could exceed a limit even after the running requests have finished.
+        """
+        with self._lock:
+            if self.max_cost_per_run is not None:
+                if self.run_cost + cost > self.max_cost_per_run:
+                    raise AssertionError(
+                        f"Stopped at `max_cost_per_run`: spent ${self.run_cost:.2f} of ${self.max_cost_per_run:.2f} "
+                        f"and the next request may cost up to ${cost:.2f}!"
+                    )
+                if self.run_cost + self.run_reserved + cost > self.max_cost_per_run:
+                    return COST_POLL_INTERVAL
+
+            if self.max_cost_per_day is not None:
+                if self.unsynced_cost + self.run_reserved + cost > self.lease \
+                        or time.monotonic() - self.synced_at > COST_LEDGER_SYNC_INTERVAL:
+                    self._sync(cost)
+                day_cost = self.day_cost + self.unsynced_cost
+                if day_cost + cost > self.max_cost_per_day:
+                    if self.wait_for_next_day:
+                        seconds = _seconds_until_next_day()
+                        logger.info(f"reached `max_cost_per_day` -> pause for {seconds / 3600:.1f} hours")
+                        return seconds
+                    raise AssertionError(
+                        f"Stopped at `max_cost_per_day`: spent ${day_cost:.2f} of ${self.max_cost_per_day:.2f} "
+                        f"today and the next request may cost up to ${cost:.2f}!"
+                    )
+                if self.unsynced_cost + self.run_reserved + cost > self.lease:
+                    return COST_POLL_INTERVAL
+
+            self.run_reserved += cost
+            return 0.0
+
+    def release(self, cost: float) -> None:
+        """Release the reservation of a request that has finished.
+
+        Args:
+            cost: The cost of the request in USD that was reserved.
+        """
+        with self._lock:
+            self.run_reserved = max(0.0, self.run_reserved - cost)
+
+    def charge(self, cost: float) -> None:
+        """Record the actual cost of a response.
+
+        Args:
+            cost: The cost of the response in USD.
+        """
+        with self._lock:
+            self.run_cost += cost
+            if self.max_cost_per_day is not None:
+                self.unsynced_cost += cost
+                if time.monotonic() - self.synced_at > COST_LEDGER_SYNC_INTERVAL:
+                    self._sync(0.0)
+
+    def sync(self) -> None:
+        """Write the cost to the ledger and return the headroom that the running requests do not need."""
+        with self._lock:
+            if self.max_cost_per_day is not None:
+                self._sync(None)
+
+    def _sync(self, cost: float | None) -> None:
+        """Write the cost to the ledger and renew the lease, requires the lock.
+
+        Args:
+            cost: The cost of the request that is about to start, or None to only keep the running reservations.
+        """
+        with self._ledger() as ledger:
+            today = _today()
+            ledger["costs"][today] = ledger["costs"].get(today, 0.0) + self.unsynced_cost
+            self.unsynced_cost = 0.0
+            self.day_cost = ledger["costs"][today]
+            others_reserved = sum(reserved for key, reserved in ledger["reserved"].items() if key != self._ledger_key)
+            headroom = self.max_cost_per_day - self.day_cost - others_reserved
+            self.lease = self.run_reserved
+            if cost is not None and self.run_reserved + cost <= headroom:
+                self.lease = min(headroom, self.run_reserved + cost + COST_LEDGER_LEASE * self.max_cost_per_day)
+            ledger["reserved"][self._ledger_key] = self.lease
+        self.synced_at = time.monotonic()
+
+    @contextlib.contextmanager
+    def _ledger(self) -> Iterator[dict]:
+        """Lock, load, and afterward store the ledger."""
+        path = self.ledger_path if self.ledger_path is not None else COST_LEDGER_PATH
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path.with_name(path.name + ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            ledger = {"costs": {}, "reserved": {}}
+            if path.is_file():
+                try:
+                    with open(path, "r", encoding="utf-8") as file:
+                        ledger = json.load(file)
+                except json.JSONDecodeError:
+                    logger.warning(f"reset corrupted cost ledger {path}")
+            ledger["reserved"] = {
+                key: reserved for key, reserved in ledger["reserved"].items() if _is_alive(int(key.split(":")[0]))
+            }
+            yield ledger
+
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(ledger, file, indent=2)
+            os.replace(tmp_path, path)  # a crash never leaves a partial ledger
+
+
+########################################################################################################################
+# implementation
+########################################################################################################################
+
+
+_ledger_keys = itertools.count()  # the governors of a process have separate reservations in the ledger
+
+
+def _today() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).date().isoformat()
+
+
+def _seconds_until_next_day() -> float:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    next_day = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time(), now.tzinfo)
+    return (next_day - now).total_seconds()
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # the process exists, but belongs to another user
+        return True
+    return True
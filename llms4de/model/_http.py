@@ -0,0 +1,124 @@
+########################################################################################################################
+# HTTP helpers version: 2026-10-18
+#
+# use the following methods:
+# http_post(...)           ==> send a POST request using the shared connection pool
+# http_get(...)            ==> send a GET request using the shared connection pool
+#
+# All API helpers of a process share one `requests.Session` whose connections are kept alive and reused. The number of
+# connections per host is limited to MAX_CONNECTIONS_PER_HOST, additional requests block until a connection is free.
+#
+# Unless the caller passes a `timeout`, requests fail with a `requests.Timeout` (which the executor retries) if the
+# connection cannot be established within CONNECT_TIMEOUT seconds or the server sends nothing for READ_TIMEOUT seconds.
+# Without a timeout, a single hung connection would keep its request running forever.
+#
+# By default, `requests` reads the proxy settings from the environment variables for every request, which costs about
+# as much CPU time as sending the request itself. The shared session reads them only once per host (and per process).
+########################################################################################################################
+import logging
+import os
+import threading
+import urllib.parse
+
+import requests
+import requests.adapters
+
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS_PER_HOST = 200
+MAX_HOSTS = 16
+CONNECT_TIMEOUT = 10.0  # seconds to establish a connection
+READ_TIMEOUT = 600.0  # seconds to wait for the server to send data, i.e., the response of a non-streaming request
+
+
+########################################################################################################################
+# API
+########################################################################################################################
+
+
+def http_post(url: str, **kwargs) -> requests.Response:
+    """Send a POST request using the shared connection pool.
+
+    Args:
+        url: The URL.
+        **kwargs: Further arguments for `requests.Session.post`.
+
+    Returns:
+        The HTTP response.
+    """
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    return _get_session().post(url, **kwargs)
+
+
+def http_get(url: str, **kwargs) -> requests.Response:
+    """Send a GET request using the shared connection pool.
+
+    Args:
+        url: The URL.
+        **kwargs: Further arguments for `requests.Session.get`.
+
+    Returns:
+        The HTTP response.
+    """
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    return _get_session().get(url, **kwargs)
+
+
+def close_connections() -> None:
+    """Close all pooled connections, the next request opens a new pool."""
+    global _session, _session_pid
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _session_pid = None
+
+
+########################################################################################################################
+# implementation
+########################################################################################################################
+
+
+_session: requests.Session | None = None
+_session_pid: int | None = None
+_session_lock = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    global _session, _session_pid
+    with _session_lock:
+        # connections must not be shared with forked child processes
+        if _session is None or _session_pid != os.getpid():
+            logger.debug("create new HTTP connection pool")
+            _session = _new_session()
+            _session_pid = os.getpid()
+        return _session
+
+
+class _Session(requests.Session):
+    """Session that caches the settings from the environment per host."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._environment_settings = {}  # (scheme, host, stream, verify, cert) ==> settings
+
+    def merge_environment_settings(self, url, proxies, stream, verify, cert) -> dict:
+        if proxies:  # explicit proxies must be merged with the environment
+            return super().merge_environment_settings(url, proxies, stream, verify, cert)
+        key = (*urllib.parse.urlsplit(url)[:2], stream, verify, cert)
+        if key not in self._environment_settings.keys():
+            self._environment_settings[key] = super().merge_environment_settings(url, {}, stream, verify, cert)
+        settings = self._environment_settings[key]
+        return {**settings, "proxies": dict(settings["proxies"])}
+
+
+def _new_session() -> requests.Session:
+    session = _Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=MAX_HOSTS,
+        pool_maxsize=MAX_CONNECTIONS_PER_HOST,
+        pool_block=True  # wait for a free connection instead of opening more than `pool_maxsize` connections
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
@@ -0,0 +1,151 @@
+########################################################################################################################
+# Run journal helpers version: 2026-10-18
+#
+# use the following methods:
+# RunJournal(...)          ==> append-only journal of the submitted and completed requests of a run
+#
+# A resumed run appends to the journal of the previous run, while a run without `resume` truncates it, so that the
+# journal only grows across the runs that belong together.
+#
+# The journal is a JSON lines file with one record per event:
+# {"event": "start", "resume": false}                  ==> a run starts, without `resume` no earlier records precede it
+# {"event": "submit", "name": "0.json", "hash": ...}   ==> the request was submitted for execution
+# {"event": "complete", "name": "0.json", "hash": ...} ==> the response of the request was written
+#
+# Records are flushed and synced to disk in batches of JOURNAL_FSYNC_RECORDS records or after JOURNAL_FSYNC_INTERVAL
+# seconds, whichever comes first. A crash may therefore lose the last records, which only means that the affected
+# requests are executed again (and most likely served from the cache). Torn records at the end of the file are ignored.
+########################################################################################################################
+import json
+import logging
+import os
+import pathlib
+import time
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_FSYNC_RECORDS = 1_000  # number of records after which to sync the journal to disk
+JOURNAL_FSYNC_INTERVAL = 1.0  # seconds after which to sync the journal to disk
+
+
+########################################################################################################################
+# API
+########################################################################################################################
+
+
+class RunJournal:
+    """Append-only journal of the submitted and completed requests of a run."""
+    path: pathlib.Path
+    completed: dict[str, str]
+    submitted: dict[str, str]
+
+    def __init__(self, path: pathlib.Path, *, resume: bool) -> None:
+        """Open the journal and start a new run.
+
+        Args:
+            path: The path of the journal file.
+            resume: Whether to continue the previous run, otherwise the journal is truncated.
+        """
+        self.path = path
+        self.completed = {}  # request name -> request hash of the completed requests
+        self.submitted = {}  # request name -> request hash of the submitted but not completed requests
+        if resume and path.is_file():
+            self._replay()
+
+        self._file = open(path, "a" if resume else "w", encoding="utf-8")
+        if self._file.tell() > 0:
+            with open(path, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                if file.read(1) != b"\n":
+                    self._file.write("\n")  # do not append to a torn record
+        self._num_unsynced = 0
+        self._last_sync = time.time()
+        self._append({"event": "start", "resume": resume})
+        self.sync()
+
+    def in_flight(self) -> set[str]:
+        """Names of the requests that were submitted but not completed in the previous run.
+
+        Returns:
+            The set of request names.
+        """
+        return set(self.submitted.keys())
+
+    def is_completed(self, name: str, request_hash: str) -> bool:
+        """Determine whether the request was completed with the same request hash.
+
+        Args:
+            name: The name of the request.
+            request_hash: The hash of the current request.
+
+        Returns:
+            Whether the request was completed.
+        """
+        return self.completed.get(name) == request_hash
+
+    def record_submitted(self, names_and_hashes: list[tuple[str, str]]) -> None:
+        """Record that the requests were submitted for execution.
+
+        Args:
+            names_and_hashes: The names and hashes of the requests.
+        """
+        for name, request_hash in names_and_hashes:
+            self.submitted[name] = request_hash
+            self._append({"event": "submit", "name": name, "hash": request_hash})
+        self.sync()  # the submissions must be on disk before any request is executed
+
+    def record_completed(self, name: str, request_hash: str) -> None:
+        """Record that the response of the request was written.
+
+        Args:
+            name: The name of the request.
+            request_hash: The hash of the request.
+        """
+        self.submitted.pop(name, None)
+        self.completed[name] = request_hash
+        self._append({"event": "complete", "name": name, "hash": request_hash})
+
+    def sync(self) -> None:
+        """Flush the journal and sync it to disk."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._num_unsynced = 0
+        self._last_sync = time.time()
+
+    def close(self) -> None:
+        """Sync and close the journal."""
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self) -> "RunJournal":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _append(self, record: dict) -> None:
+        self._file.write(json.dumps(record) + "\n")
+        self._num_unsynced += 1
+        if self._num_unsynced >= JOURNAL_FSYNC_RECORDS or time.time() - self._last_sync >= JOURNAL_FSYNC_INTERVAL:
+            self.sync()
+
+    def _replay(self) -> None:
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"ignore torn record in journal {self.path}")
+                    continue
+                match record["event"]:
+                    case "start":
+                        if not record["resume"]:
+                            self.completed = {}
+                            self.submitted = {}
+                    case "submit":
+                        self.completed.pop(record["name"], None)
+                        self.submitted[record["name"]] = record["hash"]
+                    case "complete":
+                        self.submitted.pop(record["name"], None)
+                        self.completed[record["name"]] = record["hash"]
@@ -0,0 +1,618 @@
+########################################################################################################################
+# Mock server helpers version: 2026-10-18
+#
+# use the following methods:
+# MockServer(...)          ==> local stand-in for the OpenAI, Anthropic, and Ollama APIs
+# MockServerProcess(...)   ==> mock server that runs in a separate process
+#
+# The mock server answers every request with the same text and can be used in tests and benchmarks:
+# with MockServer(latency=0.01) as server:
+#     _openai.BASE_URL = f"{server.url}/v1"
+#     ...
+#
+# The latency of each request is `latency`, spread by a log-normal distribution with `latency_sigma`, plus
+# `latency_per_output_token` for each of the `num_output_tokens` output tokens of a generation request.
+# To imitate the rate limits of a provider, set `rpm` and `tpm`: the server keeps a budget per model that refills
+# continuously, charges each generation request with its input and output tokens, answers requests that exceed the
+# budget with a rate limit error (429), and sends the OpenAI `x-ratelimit-*` or Anthropic `anthropic-ratelimit-*`
+# headers. Benchmarks should use a MockServerProcess, so that the server does not compete with the client for the GIL.
+#
+# To imitate a local Ollama server with OLLAMA_NUM_PARALLEL=4, set `num_parallel=4`: further requests wait in a queue.
+# To imitate Ollama swapping models, set `model_load_latency`: the server keeps one model loaded and must first load
+# the model of each chat request for another model or another `num_ctx`.
+# To test the retry policy, it can inject rate limit errors (429) and server errors (503) into the generation requests.
+# To imitate a slow replica, set `slow_rate` and `slow_latency`: that fraction of the generation requests takes
+# `slow_latency` seconds instead of `latency` seconds.
+# Like Anthropic's prompt caching, it reads the prefix up to a `cache_control` breakpoint from its cache if an earlier
+# request with the same prefix has written it.
+# It also implements the OpenAI Batch API and the Anthropic Message Batches API: a batch ends `batch_latency` seconds
+# after it was submitted, and all its requests succeed.
+########################################################################################################################
+import contextlib
+import datetime
+import email.parser
+import http.server
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+MOCK_RESPONSE_TEXT = "This is the response."
+
+_GENERATION_PATHS = {"/v1/chat/completions", "/v1/messages", "/api/chat"}  # paths that may return injected errors
+_BATCH_PATH_PREFIXES = ("/v1/files", "/v1/batches", "/v1/messages/batches")
+_COUNTERS = ["num_requests", "num_connections", "num_rate_limit_errors", "num_server_errors", "max_num_running"]
+
+
+########################################################################################################################
+# API
+########################################################################################################################
+
+
+class MockServer:
+    """Local HTTP server that speaks the OpenAI, Anthropic, and Ollama chat protocols."""
+    latency: float
+    latency_sigma: float
+    latency_per_output_token: float
+    slow_rate: float
+    slow_latency: float
+    num_output_tokens: int
+    rpm: int | None
+    tpm: int | None
+    rate_limit_rate: float
+    server_error_rate: float
+    retry_after: float | None
+    num_parallel: int | None
+    model_load_latency: float
+    num_requests: int
+    num_connections: int
+    num_rate_limit_errors: int
+    num_server_errors: int
+    num_running: int
+    max_num_running: int
+    num_model_loads: int
+    batch_latency: float
+    num_batches: int
+
+    def __init__(
+            self,
+            *,
+            latency: float = 0.0,
+            latency_sigma: float = 0.0,
+            latency_per_output_token: float = 0.0,
+            slow_rate: float = 0.0,
+            slow_latency: float = 0.0,
+            num_output_tokens: int | None = None,
+            rpm: int | None = None,
+            tpm: int | None = None,
+            rate_limit_rate: float = 0.0,
+            server_error_rate: float = 0.0,
+            retry_after: float | None = None,
+            num_parallel: int | None = None,
+            model_load_latency: float = 0.0,
+            batch_latency: float = 0.0,
+            seed: int = 0,
+            port: int = 0
+    ) -> None:
+        """Create the mock server.
+
+        Args:
+            latency: How long to wait before sending each response in seconds (the median if `latency_sigma` > 0).
+            latency_sigma: The standard deviation of the logarithm of the latency, 0 for a constant latency.
+            latency_per_output_token: Additional latency for each output token of a generation request in seconds.
+            slow_rate: The fraction of generation requests that take `slow_latency` seconds instead.
+            slow_latency: How long to wait before sending the response of a slow request in seconds.
+            num_output_tokens: The number of output tokens in the usage of each response, None for the number of words
+                of MOCK_RESPONSE_TEXT.
+            rpm: Optional number of generation requests per minute and model, None for no limit.
+            tpm: Optional number of input and output tokens per minute and model, None for no limit.
+            rate_limit_rate: The fraction of requests to answer with a rate limit error (429).
+            server_error_rate: The fraction of requests to answer with a server error (503).
+            retry_after: Optional value of the `retry-after` header of rate limit errors in seconds.
+            num_parallel: Optional number of requests that are processed in parallel, further requests wait in a queue.
+            model_load_latency: How long it takes to load another model for an Ollama chat request in seconds.
+            batch_latency: How long it takes until a batch has ended in seconds.
+            seed: The seed for injecting errors.
+            port: The port to listen on, 0 means any free port.
+        """
+        self.latency = latency
+        self.latency_sigma = latency_sigma
+        self.latency_per_output_token = latency_per_output_token
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.num_output_tokens = _count_tokens(MOCK_RESPONSE_TEXT) if num_output_tokens is None else num_output_tokens
+        self.rpm = rpm
+        self.tpm = tpm
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.retry_after = retry_after
+        self.num_parallel = num_parallel
+        self.model_load_latency = model_load_latency
+        self.num_requests = 0
+        self.num_connections = 0
+        self.num_rate_limit_errors = 0
+        self.num_server_errors = 0
+        self.num_running = 0
+        self.max_num_running = 0
+        self.num_model_loads = 0
+        self.batch_latency = batch_latency
+        self.num_batches = 0
+        self._budgets = {}  # model ==> remaining requests and tokens
+        self._prompt_cache = set()  # prefixes up to the `cache_control` breakpoints of earlier requests
+        self._files = {}  # file id -> content of the OpenAI files
+        self._batches = {}  # batch id -> batch object, results, and end time
+        self._ids = itertools.count()
+        self._loaded_model = None
+        self._model_lock = threading.Lock()
+        self._slots = None if num_parallel is None else threading.Semaphore(num_parallel)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = _HTTPServer(("127.0.0.1", port), _Handler)
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self) -> "MockServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    def handle(self, path: str, request: dict) -> tuple[int, dict, dict]:
+        """Compute the status code, headers, and JSON body for the given request.
+
+        Args:
+            path: The path of the URL.
+            request: The JSON request.
+
+        Returns:
+            The HTTP status code, additional headers, and JSON body.
+        """
+        is_generation = path in _GENERATION_PATHS
+        with self._lock:
+            self.num_requests += 1
+            draw = self._random.random() if is_generation else 1.0
+            if self.slow_rate > 0 and is_generation and self._random.random() < self.slow_rate:
+                latency = self.slow_latency
+            elif self.latency_sigma > 0:
+                latency = self.latency * self._random.lognormvariate(0.0, self.latency_sigma)
+            else:
+                latency = self.latency
+            if is_generation:
+                latency += self.latency_per_output_token * self.num_output_tokens
+
+            headers = {}
+            if is_generation and (self.rpm is not None or self.tpm is not None):
+                num_tokens = _count_tokens(request) + self.num_output_tokens
+                is_allowed, headers = self._charge_budget(path, request.get("model", ""), num_tokens)
+                if not is_allowed:  # providers reject such requests right away
+                    self.num_rate_limit_errors += 1
+                    return 429, headers, {"error": {"type": "rate_limit_error", "message": "mock rate limit exceeded"}}
+
+        # wait for a free slot, then process the request
+        before = time.perf_counter()
+        with self._slots if self._slots is not None else contextlib.nullcontext():
+            if path == "/api/chat":
+                load_seconds = self._load_model(request.get("model", ""), request.get("options", {}).get("num_ctx"))
+            else:
+                load_seconds = 0.0
+            queue_seconds = time.perf_counter() - before - load_seconds
+            with self._lock:
+                self.num_running += 1
+                self.max_num_running = max(self.max_num_running, self.num_running)
+            if latency > 0:
+                time.sleep(latency)
+            with self._lock:
+                self.num_running -= 1
+
+        if draw < self.rate_limit_rate:
+            with self._lock:
+                self.num_rate_limit_errors += 1
+            if self.retry_after is not None:
+                headers["retry-after"] = str(self.retry_after)
+            return 429, headers, {"error": {"type": "rate_limit_error", "message": "mock rate limit error"}}
+        if draw < self.rate_limit_rate + self.server_error_rate:
+            with self._lock:
+                self.num_server_errors += 1
+            return 503, {}, {"error": {"type": "overloaded_error", "message": "mock server error"}}
+
+        status_code, body = self._handle_successfully(path, request, queue_seconds, load_seconds)
+        return status_code, headers, body
+
+    def handle_batch(self, method: str, path: str, request: dict) -> tuple[int, dict | str]:
+        """Compute the status code and JSON body (or JSON lines content) for the given batch API request.
+
+        Args:
+            method: The HTTP method.
+            path: The path of the URL.
+            request: The JSON request or the fields of the multipart form.
+
+        Returns:
+            The HTTP status code and the JSON body or the content of a JSON lines file.
+        """
+        parts = path.strip("/").split("/")
+        with self._lock:
+            match method, parts:
+                case "POST", ["v1", "files"]:
+                    file_id = f"file-{next(self._ids)}"
+                    self._files[file_id] = request["file"].decode("utf-8")
+                    return 200, {"id": file_id, "object": "file", "purpose": request["purpose"].decode("utf-8")}
+                case "GET", ["v1", "files", file_id, "content"] if file_id in self._files.keys():
+                    return 200, self._files[file_id]
+                case "POST", ["v1", "batches"] if request.get("input_file_id") in self._files.keys():
+                    results = []
+                    for line in self._files[request["input_file_id"]].splitlines():
+                        line = json.loads(line)
+                        _, body = self._handle_successfully(line["url"], line["body"], 0.0, 0.0)
+                        results.append({
+                            "id": f"batch_req_{next(self._ids)}",
+                            "custom_id": line["custom_id"],
+                            "response": {"status_code": 200, "request_id": "mock", "body": body},
+                            "error": None
+                        })
+                    return 200, self._new_batch(f"batch_{next(self._ids)}", "openai", results)
+                case "GET", ["v1", "batches", batch_id] if batch_id in self._batches.keys():
+                    return 200, self._batch_object(batch_id)
+                case "POST", ["v1", "messages", "batches"]:
+                    results = []
+                    for batch_request in request["requests"]:
+                        _, body = self._handle_successfully("/v1/messages", batch_request["params"], 0.0, 0.0)
+                        results.append({
+                            "custom_id": batch_request["custom_id"],
+                            "result": {"type": "succeeded", "message": body}
+                        })
+                    return 200, self._new_batch(f"msgbatch_{next(self._ids)}", "anthropic", results)
+                case "GET", ["v1", "messages", "batches", batch_id] if batch_id in self._batches.keys():
+                    return 200, self._batch_object(batch_id)
+                case "GET", ["v1", "messages", "batches", batch_id, "results"] if batch_id in self._batches.keys():
+                    return 200, "".join(json.dumps(result) + "\n" for result in self._batches[batch_id]["results"])
+                case _:
+                    return 404, {"error": {"message": f"unknown batch path `{path}`"}}
+
+    def _new_batch(self, batch_id: str, api_name: str, results: list[dict]) -> dict:
+        self.num_batches += 1
+        self._batches[batch_id] = {
+            "api_name": api_name,
+            "results": results,
+            "created_at": time.time(),
+            "ends_at": time.time() + self.batch_latency
+        }
+        return self._batch_object(batch_id)
+
+    def _batch_object(self, batch_id: str) -> dict:
+        batch = self._batches[batch_id]
+        has_ended = time.time() >= batch["ends_at"]
+        num_requests = len(batch["results"])
+        if batch["api_name"] == "openai":
+            output_file_id = None
+            if has_ended:
+                output_file_id = f"file-{batch_id}-output"
+                self._files[output_file_id] = "".join(json.dumps(result) + "\n" for result in batch["results"])
+            return {
+                "id": batch_id,
+                "object": "batch",
+                "status": "completed" if has_ended else "in_progress",
+                "output_file_id": output_file_id,
+                "error_file_id": None,
+                "request_counts": {"total": num_requests, "completed": num_requests if has_ended else 0, "failed": 0}
+            }
+        else:
+            return {
+                "id": batch_id,
+                "type": "message_batch",
+                "processing_status": "ended" if has_ended else "in_progress",
+                "request_counts": {
+                    "processing": 0 if has_ended else num_requests,
+                    "succeeded": num_requests if has_ended else 0,
+                    "errored": 0,
+                    "canceled": 0,
+                    "expired": 0
+                },
+                "results_url": f"{self.url}/v1/messages/batches/{batch_id}/results" if has_ended else None
+            }
+
+    def _charge_budget(self, path: str, model: str, num_tokens: int) -> tuple[bool, dict]:
+        """Charge the request to the budget of the model and compute the rate limit headers, requires the lock."""
+        if model not in self._budgets.keys():
+            self._budgets[model] = {
+                name: _Budget(per_minute) for name, per_minute in [("requests", self.rpm), ("tokens", self.tpm)]
+                if per_minute is not None
+            }
+        budgets = self._budgets[model]
+        for budget in budgets.values():
+            budget.refill()
+        costs = {"requests": 1, "tokens": num_tokens}
+        is_allowed = all(budget.remaining >= costs[name] for name, budget in budgets.items())
+        if is_allowed:
+            for name, budget in budgets.items():
+                budget.remaining -= costs[name]
+
+        headers = {}
+        for name, budget in budgets.items():
+            seconds = budget.seconds_until_full()
+            if path == "/v1/chat/completions":
+                headers[f"x-ratelimit-limit-{name}"] = str(budget.per_minute)
+                headers[f"x-ratelimit-remaining-{name}"] = str(int(budget.remaining))
+                headers[f"x-ratelimit-reset-{name}"] = f"{math.ceil(seconds * 1000)}ms"
+            elif path == "/v1/messages":
+                reset_at = datetime.datetime.fromtimestamp(time.time() + seconds, tz=datetime.timezone.utc)
+                headers[f"anthropic-ratelimit-{name}-limit"] = str(budget.per_minute)
+                headers[f"anthropic-ratelimit-{name}-remaining"] = str(int(budget.remaining))
+                headers[f"anthropic-ratelimit-{name}-reset"] = reset_at.isoformat(timespec="milliseconds")
+        return is_allowed, headers
+
+    def _load_model(self, model: str, num_ctx: int | None) -> float:
+        with self._model_lock:  # while a model is loaded, the server cannot process other requests
+            if self._loaded_model == (model, num_ctx):
+                return 0.0
+            with self._lock:
+                self.num_model_loads += 1
+            if self.model_load_latency > 0:
+                time.sleep(self.model_load_latency)
+            self._loaded_model = (model, num_ctx)
+            return self.model_load_latency
+
+    def _handle_successfully(
+            self,
+            path: str,
+            request: dict,
+            queue_seconds: float,
+            load_seconds: float
+    ) -> tuple[int, dict]:
+        num_input_tokens = _count_tokens(request)
+        num_output_tokens = self.num_output_tokens
+        match path:
+            case "/v1/chat/completions":
+                return 200, {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get("model", ""),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": MOCK_RESPONSE_TEXT},
+                        "logprobs": None,
+                        "finish_reason": "stop"
+                    }],
+                    "usage": {
+                        "prompt_tokens": num_input_tokens,
+                        "completion_tokens": num_output_tokens,
+                        "total_tokens": num_input_tokens + num_output_tokens,
+                        "prompt_tokens_details": {"cached_tokens": 0}
+                    }
+                }
+            case "/v1/messages/count_tokens":
+                return 200, {"input_tokens": num_input_tokens}
+            case "/v1/messages":
+                num_cache_creation_tokens, num_cache_read_tokens = 0, 0
+                prefix = _cache_control_prefix(request)
+                if prefix is not None:
+                    prefix_key = json.dumps(prefix, sort_keys=True)
+                    with self._lock:
+                        is_cached = prefix_key in self._prompt_cache
+                        self._prompt_cache.add(prefix_key)
+                    if is_cached:
+                        num_cache_read_tokens = _count_tokens(prefix)
+                    else:
+                        num_cache_creation_tokens = _count_tokens(prefix)
+                    num_input_tokens -= num_cache_creation_tokens + num_cache_read_tokens
+                return 200, {
+                    "id": "msg_mock",
+                    "type": "message",
+                    "role": "assistant",
+                    "model": request.get("model", ""),
+                    "content": [{"type": "text", "text": MOCK_RESPONSE_TEXT}],
+                    "stop_reason": "end_turn",
+                    "stop_sequence": None,
+                    "usage": {
+                        "input_tokens": num_input_tokens,
+                        "output_tokens": num_output_tokens,
+                        "cache_creation_input_tokens": num_cache_creation_tokens,
+                        "cache_read_input_tokens": num_cache_read_tokens
+                    }
+                }
+            case "/api/chat":
+                return 200, {
+                    "model": request.get("model", ""),
+                    "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "message": {"role": "assistant", "content": MOCK_RESPONSE_TEXT},
+                    "done_reason": "stop",
+                    "done": True,
+                    "total_duration": int((queue_seconds + load_seconds + self.latency) * 1e9),
+                    "load_duration": int(load_seconds * 1e9),
+                    "prompt_eval_count": num_input_tokens,
+                    "prompt_eval_duration": int(self.latency * 0.1e9),
+                    "eval_count": num_output_tokens,
+                    "eval_duration": int(self.latency * 0.9e9)
+                }
+            case _:
+                return 404, {"error": {"message": f"unknown path `{path}`"}}
+
+
+class MockServerProcess:
+    """Mock server that runs in a separate process and reports its counters when it stops."""
+    url: str | None
+    counters: dict[str, int]
+
+    def __init__(self, **kwargs) -> None:
+        """Create the mock server process.
+
+        Args:
+            **kwargs: The arguments of the MockServer.
+        """
+        self.kwargs = kwargs
+        self.url = None
+        self.counters = {}
+        self._process = None
+        self._connection = None
+        self._stop_event = None
+
+    def start(self) -> "MockServerProcess":
+        mp_context = multiprocessing.get_context("spawn")
+        self._connection, child_connection = mp_context.Pipe()
+        self._stop_event = mp_context.Event()
+        self._process = mp_context.Process(
+            target=_serve,
+            args=(self.kwargs, self._stop_event, child_connection),
+            daemon=True
+        )
+        self._process.start()
+        self.url = self._connection.recv()
+        return self
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.counters = self._connection.recv()
+        self._process.join()
+
+    def __enter__(self) -> "MockServerProcess":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+
+########################################################################################################################
+# implementation
+########################################################################################################################
+
+
+class _Budget:
+    """Budget of requests or tokens per minute that refills continuously."""
+
+    def __init__(self, per_minute: int) -> None:
+        self.per_minute = per_minute
+        self.remaining = float(per_minute)
+        self.updated_at = time.time()
+
+    def refill(self) -> None:
+        now = time.time()
+        self.remaining = min(self.per_minute, self.remaining + (now - self.updated_at) * self.per_minute / 60)
+        self.updated_at = now
+
+    def seconds_until_full(self) -> float:
+        return (self.per_minute - self.remaining) * 60 / self.per_minute if self.per_minute > 0 else 60.0
+
+
+def _serve(kwargs: dict, stop_event: "multiprocessing.Event", connection: "multiprocessing.Connection") -> None:
+    with MockServer(**kwargs) as server:
+        connection.send(server.url)
+        stop_event.wait()
+        connection.send({name: getattr(server, name) for name in _COUNTERS})
+
+
+def _count_tokens(obj: dict | list | str) -> int:
+    if isinstance(obj, str):
+        return len(obj.split())
+    elif isinstance(obj, dict):
+        return sum(
+            _count_tokens(v) for k, v in obj.items() if k in {"messages", "content", "prompt", "system", "text"}
+        )
+    elif isinstance(obj, list):
+        return sum(_count_tokens(v) for v in obj)
+    else:
+        return 0
+
+
+def _parse_multipart(content_type: str, body: bytes) -> dict[str, bytes]:
+    header = bytes(f"Content-Type: {content_type}\r\n\r\n", "utf-8")
+    message = email.parser.BytesParser().parsebytes(header + body)
+    return {
+        part.get_param("name", header="content-disposition"): part.get_payload(decode=True)
+        for part in message.get_payload()
+    }
+
+
+def _cache_control_prefix(request: dict) -> list[dict] | None:
+    # the blocks of the tools, system prompt, and messages up to the last breakpoint, without the breakpoints
+    blocks = list(request.get("tools", []))
+    system = request.get("system", [])
+    blocks += [{"type": "text", "text": system}] if isinstance(system, str) else system
+    for message in request.get("messages", []):
+        content = message["content"]
+        content = [{"type": "text", "text": content}] if isinstance(content, str) else content
+        blocks += [{"role": message["role"], **block} for block in content]
+    breakpoints = [idx for idx, block in enumerate(blocks) if "cache_control" in block.keys()]
+    if len(breakpoints) == 0:
+        return None
+    return [{key: value for key, value in block.items() if key != "cache_control"} for block in
+            blocks[:breakpoints[-1] + 1]]
+
+
+class _HTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+    mock: MockServer
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # required for keep-alive connections
+    disable_nagle_algorithm = True  # otherwise, delayed ACKs slow down keep-alive connections
+    server: _HTTPServer
+
+    def handle(self) -> None:
+        with self.server.mock._lock:
+            self.server.mock.num_connections += 1
+        super().handle()
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        if self.headers.get("Content-Type", "").startswith("multipart/form-data"):
+            request = _parse_multipart(self.headers["Content-Type"], body)
+        else:
+            try:
+                request = json.loads(body) if length > 0 else {}
+            except json.JSONDecodeError:
+                request = {}
+        if self.path.startswith(_BATCH_PATH_PREFIXES):
+            status_code, response = self.server.mock.handle_batch("POST", self.path, request)
+            self._send_json(status_code, {}, response)
+        else:
+            status_code, headers, response = self.server.mock.handle(self.path, request)
+            self._send_json(status_code, headers, response)
+
+    def do_GET(self) -> None:
+        if self.path == "/api/version":  # used as a health check for Ollama servers
+            self._send_json(200, {}, {"version": "mock"})
+        elif self.path.startswith(_BATCH_PATH_PREFIXES):
+            status_code, response = self.server.mock.handle_batch("GET", self.path, {})
+            self._send_json(status_code, {}, response)
+        else:
+            self.send_error(501, "Unsupported method ('GET')")
+
+    def _send_json(self, status_code: int, headers: dict, response: dict | str) -> None:
+        if isinstance(response, str):  # content of a JSON lines file
+            data, content_type = bytes(response, "utf-8"), "application/jsonl"
+        else:
+            data, content_type = bytes(json.dumps(response), "utf-8"), "application/json"
+        self.send_response(status_code)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format % args)
@@ -1,32 +1,74 @@
 ########################################################################################################################
-# Ollama API helpers version: 2025-02-10
+# Ollama API helpers version: 2026-10-18
 #
 # use the following methods:
 # ollama_execute(...)      ==> execute API requests
+# ollama_concurrency()     ==> get the current concurrency limit and the observed throughput
+# ollama_hosts()           ==> get the state of the pooled Ollama servers
+# ollama_model_durations() ==> get the load and generation durations per model
+#
+# Switching between models forces Ollama to evict and reload gigabytes of weights. Therefore, ollama_execute(...)
+# executes the requests of one model after the other. Ollama also reloads a model whenever `num_ctx` changes, so the
+# requests of a model are executed in groups of the same `num_ctx` (see OLLAMA_NUM_CTX_BUCKETS in generic.py). Each
+# group's model is preloaded on all servers before sending its requests. Once all requests of a group have been sent,
+# the next group's model is preloaded while the last requests finish, so the servers start loading it as soon as they
+# become idle. The load and generation durations that Ollama reports are accumulated per model.
+#
+# To distribute the requests across several Ollama servers, list their URLs in the OLLAMA_URLS environment variable,
+# for example using:
+# export OLLAMA_URLS="http://gpu-1:11434,http://gpu-2:11434"
+# Each request is sent to the healthy server with the fewest outstanding requests. If a server cannot be reached, it is
+# marked as unhealthy, the request fails over to another server, and the server is probed again after
+# HEALTH_CHECK_INTERVAL seconds. All servers share one response cache, since they must host the same models.
+#
+# Ollama processes only OLLAMA_NUM_PARALLEL requests at a time and queues all further requests. Instead of a fixed
+# number of parallel requests, ollama_execute(...) adapts the concurrency limit to the server's capacity: it computes
+# how long each request waited in the server's queue (the latency minus the load and evaluation durations) and
+# increases the limit while requests do not wait, but decreases it when they do.
 ########################################################################################################################
+import collections
+import concurrent.futures
 import dataclasses
 import functools
-import hashlib
-import json
 import logging
+import math
+import os
 import threading
 import time
-from typing import Literal
+from typing import Callable, Literal
 
 import requests
 import tqdm
 
 from llms4de.data import get_data_path
+from llms4de.model._cache import open_cache, canonical_hash, canonical_request
+from llms4de.model._executor import execute_pairs, fold_duplicates, fan_out, fan_out_callback, map_concurrently, \
+        release_method_caches
+from llms4de.model._http import CONNECT_TIMEOUT, http_post, http_get
+from llms4de.model._retry import is_retryable_error
+from llms4de.model._telemetry import Telemetry
 
 logger = logging.getLogger(__name__)
 
 OLLAMA_CACHE_PATH = get_data_path() / "ollama_cache"
+OLLAMA_URL = "http://localhost:11434"
+OLLAMA_URLS = [url for url in os.environ.get("OLLAMA_URLS", "").split(",") if url != ""]  # empty to use OLLAMA_URL
+HEALTH_CHECK_INTERVAL = 10  # seconds after which to probe an unhealthy server again
+HEALTH_CHECK_TIMEOUT = 2  # timeout of the health check in seconds
+OLLAMA_READ_TIMEOUT = 60 * 60  # seconds, since loading a model and generating on a CPU can take a long time
+OLLAMA_KEEP_ALIVE = "30m"  # how long the servers should keep a preloaded model in memory
+OLLAMA_MAX_CONCURRENCY = 200  # upper bound for the adaptive concurrency limit
+QUEUE_TOLERANCE = 0.1  # waiting time relative to the processing time above which requests count as queued
+DECREASE_FACTOR = 0.9  # factor to decrease the concurrency limit by when requests are queued
+THROUGHPUT_WINDOW = 30  # seconds over which to measure the throughput
 
 
 def ollama_execute(
         requests: list[dict],
         *,
-        silent: bool = False
+        silent: bool = False,
+        callback: Callable[[int, dict], None] | None = None,
+        stop: threading.Event | None = None
 ) -> list[dict]:
     """Execute a list of requests against the Ollama API.
 
@@ -35,6 +77,8 @@ def ollama_execute(
     Args:
         requests: A list of API requests.
         silent: Whether to display log messages and progress bars.
+        callback: Optional function that receives the index and response of each request as soon as it is available.
+        stop: Optional event after which no more requests are started, e.g., once the responses are no longer needed.
 
     Returns:
         A list of API responses.
@@ -46,31 +90,47 @@ def ollama_execute(
     with semaphore:
         if "num_running" not in context.keys():
             context["num_running"] = 0
+        if "concurrency_limit" not in context.keys():
+            context["concurrency_limit"] = _AdaptiveConcurrencyLimit()
+        if "model_durations" not in context.keys():
+            context["model_durations"] = {}
 
+    # create pairs, identical requests share one pair
     before = time.perf_counter()
-    pairs = [_Pair(_Request(request)) for request in requests]
+    pairs, positions = fold_duplicates(
+        [_Pair(_Request(request)) for request in requests],
+        key=lambda pair: pair.request.hash()
+    )
     if _do_benchmark:
         logger.info(f"created pairs in {time.perf_counter() - before} seconds")
+    if len(pairs) < len(positions) and not silent:
+        logger.info(f"folded {len(positions) - len(pairs)} duplicate requests into {len(pairs)} unique requests")
+    notify = fan_out_callback(callback, positions)
+    position_by_pair = {id(pair): position for position, pair in enumerate(pairs)}
 
-    with _ProgressBar(total=len(pairs), desc="", disable=silent) as progress_bar:
-
-        # create cache directory
-        OLLAMA_CACHE_PATH.mkdir(parents=True, exist_ok=True)
+    with _ProgressBar(total=len(pairs), desc="", disable=silent) as progress_bar, Telemetry("ollama") as telemetry:
 
         # load cached pairs
         before = time.perf_counter()
         pairs_to_execute = []
         progress_bar.set_description("load responses")
         progress_bar.reset(total=len(pairs))
-        for pair in pairs:
-            pair.response = pair.request.load_cached_response()
+        cached_pairs = open_cache(OLLAMA_CACHE_PATH).load_many([pair.request.hash() for pair in pairs])
+        for position, pair in enumerate(pairs):
+            pair.response = pair.request.load_cached_response(cached_pairs)
             if pair.response is None:
                 pairs_to_execute.append(pair)
             else:
                 progress_bar.cached += 1
+                notify(position, pair.response.response)
             progress_bar.update()
+        telemetry.on_cache(len(pairs), progress_bar.cached)
         if _do_benchmark:
-            logger.info(f"loaded responses in {time.perf_counter() - before} seconds")
+            seconds = time.perf_counter() - before
+            logger.info(
+                f"loaded responses in {seconds} seconds ({len(pairs) / max(seconds, 1e-9):.0f} pairs/sec, "
+                f"{progress_bar.cached} cached)"
+            )
 
         # in case some pairs were not cached, execute them
         if len(pairs_to_execute) > 0:
@@ -84,72 +144,103 @@ def ollama_execute(
             if _do_benchmark:
                 logger.info(f"checked requests in {time.perf_counter() - before} seconds")
 
+            # execute the requests of one model after the other, requests with the same context size together
+            pairs_by_group = {}
+            for pair in sorted(pairs_to_execute, key=lambda pair: pair.request.num_ctx):
+                pairs_by_group.setdefault((pair.request.model, pair.request.num_ctx), []).append(pair)
+            pairs_by_group = dict(sorted(pairs_by_group.items(), key=lambda item: item[0][0]))  # stable per model
+
             # execute requests
             before = time.perf_counter()
             progress_bar.set_description("execute requests")
             progress_bar.reset(total=len(pairs))
             progress_bar.update(progress_bar.cached)
-            while True:  # break if all(pair.status == "done" for pair in pairs_to_execute)
-                logger.debug("repeatedly iterate through pairs until all are done")
-                for pair in pairs_to_execute:
+            progress_bar.concurrency_limit = context["concurrency_limit"]
+            groups = list(pairs_by_group.items())
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as preloader:
+                next_preload = preloader.submit(_preload_model, *groups[0][0])
+                for idx, ((model, num_ctx), group_pairs) in enumerate(groups):
+                    preload_responses = next_preload.result()  # wait until the group's model is loaded
+                    next_preload = None
+                    num_done = 0
+
+                    def on_done(pair: _Pair) -> None:
+                        nonlocal num_done, next_preload
+                        notify(position_by_pair[id(pair)], pair.response.response)
+                        num_done += 1
+                        # all requests of the group have been sent ==> load the next model while the last ones finish
+                        if next_preload is None and idx + 1 < len(groups) \
+                                and len(group_pairs) - num_done <= context["num_running"]:
+                            next_preload = preloader.submit(_preload_model, *groups[idx + 1][0])
+
+                    execute_pairs(
+                        group_pairs,
+                        context=context,
+                        semaphore=semaphore,
+                        progress_bar=progress_bar,
+                        response_cls=_Response,
+                        max_running=OLLAMA_MAX_CONCURRENCY,
+                        concurrency_limit=context["concurrency_limit"],
+                        on_done=on_done,
+                        telemetry=telemetry,
+                        stop=stop
+                    )
+                    if next_preload is None and idx + 1 < len(groups):
+                        next_preload = preloader.submit(_preload_model, *groups[idx + 1][0])
+                    responses = preload_responses + [pair.response for pair in group_pairs if pair.response is not None]
                     with semaphore:
-                        if pair.status != "open":
-                            continue
-                        pair.status = "waiting"
-
-                    while True:  # break if request is "running" in parallel execution
-                        with semaphore:
-                            if context["num_running"] < 200:  # max. num. of parallel requests
-                                progress_bar.bottleneck = "P"
-
-                                pair.status = "running"
-                                context["num_running"] = context["num_running"] + 1
-                                progress_bar.running = context["num_running"]
-                                progress_bar.update_postfix()
-
-                                def execute(p: _Pair, pb: _ProgressBar, c: dict, s: threading.Semaphore) -> None:
-                                    http_response = p.request.execute()
-                                    p.response = _Response(http_response.json())
-
-                                    with s:
-                                        c["num_running"] = c["num_running"] - 1
-                                        pb.running = c["num_running"]
-
-                                        match http_response.status_code:
-                                            case 200:
-                                                p.status = "done"
-                                                pb.update()
-                                            case _:
-                                                p.status = "done"
-                                                pb.failed += 1
-                                                pb.update()
-
-                                pair.thread = threading.Thread(
-                                    target=execute,
-                                    args=(pair, progress_bar, context, semaphore)
-                                )
-                                pair.thread.start()
-                                break
-                            else:
-                                progress_bar.bottleneck = "T"
-                                progress_bar.update_postfix()
-
-                        time.sleep(0.05)  # sleep to wait for thread limit
-
-                if all(pair.status == "done" for pair in pairs_to_execute):
-                    break
-                progress_bar.bottleneck = "Z"
-                progress_bar.update_postfix()
-                time.sleep(1)  # sleep to wait for stragglers and failures
-
-            for pair in pairs_to_execute:
-                if pair.thread is not None:
-                    pair.thread.join()
+                        _add_model_durations(context["model_durations"], model, responses)
 
             if _do_benchmark:
                 logger.info(f"executed requests in {time.perf_counter() - before} seconds")
+            if not silent:
+                logger.info(
+                    f"concurrency limit {int(context['concurrency_limit'].limit)}, "
+                    f"throughput {context['concurrency_limit'].throughput():.2f} requests/sec"
+                )
+                for model in dict.fromkeys(model for model, _ in pairs_by_group.keys()):
+                    durations = context["model_durations"][model]
+                    logger.info(
+                        f"{model}: load {durations['load_seconds']:.1f} seconds, prompt evaluation "
+                        f"{durations['prompt_eval_seconds']:.1f} seconds, generation {durations['eval_seconds']:.1f} "
+                        f"seconds in total"
+                    )
+
+        responses = fan_out([pair.response.response for pair in pairs], positions)
+        release_method_caches(_Request, _Response)  # the pairs are no longer needed
+        return responses
+
+
+def ollama_concurrency() -> dict:
+    """Get the current concurrency limit and the observed throughput.
 
-        return [pair.response.response for pair in pairs]
+    Returns:
+        A dictionary with the concurrency `limit` and the `throughput` in requests per second.
+    """
+    concurrency_limit = _local_context.get("concurrency_limit", _AdaptiveConcurrencyLimit())
+    return {"limit": int(concurrency_limit.limit), "throughput": concurrency_limit.throughput()}
+
+
+def ollama_hosts() -> list[dict]:
+    """Get the state of the pooled Ollama servers.
+
+    Returns:
+        A list with the `url`, `healthy`, `num_outstanding`, `num_requests`, and `num_failures` of each server.
+    """
+    return _get_host_pool().describe()
+
+
+def ollama_model_durations() -> dict[str, dict]:
+    """Get the load and generation durations per model.
+
+    The durations are accumulated over all executed requests, including the requests that preload the models.
+
+    Returns:
+        A dictionary that maps each model to its `num_requests`, `load_seconds`, `prompt_eval_seconds`, and
+        `eval_seconds`.
+    """
+    with _local_semaphore:
+        return {model: dict(durations) for model, durations in _local_context.get("model_durations", {}).items()}
 
 
 ########################################################################################################################
@@ -167,9 +258,19 @@ class _Request:
     def __init__(self, request: dict) -> None:
         self.request = request
 
+    @functools.cached_property
+    def model(self) -> str:
+        if "model" not in self.request.keys():
+            raise AttributeError("Missing field `model` in request!")
+        return self.request["model"]
+
+    @functools.cached_property
+    def num_ctx(self) -> int:
+        return self.request.get("options", {}).get("num_ctx", 0)
+
     @functools.cache
     def hash(self) -> str:
-        return hashlib.sha256(bytes(json.dumps(self.request), "utf-8")).hexdigest()
+        return canonical_hash(self.request)
 
     def check(self) -> None:
         if "model" not in self.request.keys():
@@ -192,29 +293,45 @@ class _Request:
                 or "seed" not in self.request["options"].keys():
             logger.warning("missing optional option `seed`, which is required for reproducibility")
 
-    def load_cached_response(self):  # -> "_Response" | None
-        path = OLLAMA_CACHE_PATH / f"{self.hash()}.json"
-        if path.is_file():
-            with open(path, "r", encoding="utf-8") as file:
-                cached_pair = json.load(file)
+    def load_cached_response(self, cached_pairs: dict[str, dict]):  # -> "_Response" | None
+        cached_pair = cached_pairs.get(self.hash())
+        if cached_pair is not None:
             cached_request = _Request(cached_pair["request"])
             cached_response = _Response(cached_pair["response"])
-            if self.request == cached_request.request:
+            if self.request == cached_request.request \
+                    or canonical_request(self.request) == canonical_request(cached_request.request):
                 return cached_response
         return None
 
     def execute(self) -> requests.Response:
-        http_response = requests.post(
-            url="http://localhost:11434/api/chat",
-            json=self.request
-        )
+        started_at = time.perf_counter()
+        host_pool = _get_host_pool()
+        tried_hosts = set()
+        while True:  # fail over to the other servers if a server cannot be reached
+            host = host_pool.acquire(exclude=tried_hosts)
+            tried_hosts.add(host.url)
+            try:
+                http_response = http_post(
+                    url=f"{host.url}/api/chat",
+                    json=self.request,
+                    timeout=(CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT)
+                )
+            except Exception as e:
+                host_pool.release(host, failed=is_retryable_error(e))
+                if is_retryable_error(e) and len(tried_hosts) < len(host_pool.hosts):
+                    logger.warning(f"cannot reach Ollama server {host.url}, fail over to another server")
+                    continue
+                raise
+            host_pool.release(host, failed=False)
+            break
 
         if http_response.status_code == 200:
-            path = OLLAMA_CACHE_PATH / f"{self.hash()}.json"
-            with open(path, "w", encoding="utf-8") as cache_file:
-                json.dump({"request": self.request, "response": http_response.json()}, cache_file)
+            latency = time.perf_counter() - started_at  # recorded for the `replay` API name
+            open_cache(OLLAMA_CACHE_PATH).store(self.hash(), self.request, http_response.json(), latency)
         else:
-            logger.warning(f"request failed, no retry: {http_response.content}")
+            logger.warning(
+                f"request failed with status {http_response.status_code} on {host.url}: {http_response.content}"
+            )
 
         return http_response
 
@@ -225,27 +342,229 @@ class _Response:
     def __init__(self, response: dict) -> None:
         self.response = response
 
+    def input_usage(self) -> int:
+        return self.response.get("prompt_eval_count", 0)
+
+    def output_usage(self) -> int:
+        return self.response.get("eval_count", 0)
+
+    def processing_seconds(self) -> float | None:
+        if "eval_duration" not in self.response.keys():
+            return None
+        durations = ["load_duration", "prompt_eval_duration", "eval_duration"]
+        return sum(self.response.get(duration, 0) for duration in durations) / 1e9
+
+
+def _preload_model(model: str, num_ctx: int) -> list["_Response"]:
+    # a request without messages loads the model without generating anything
+    request = {"model": model, "messages": [], "keep_alive": OLLAMA_KEEP_ALIVE, "stream": False}
+    if num_ctx > 0:
+        request["options"] = {"num_ctx": num_ctx}
+
+    def preload(host: "_Host") -> _Response | None:
+        try:
+            http_response = http_post(
+                url=f"{host.url}/api/chat",
+                json=request,
+                timeout=(CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT)
+            )
+        except requests.RequestException as e:
+            logger.warning(f"failed to preload `{model}` on {host.url}: {e}")
+            if is_retryable_error(e):
+                host_pool.mark_unhealthy(host)
+            return None
+        if http_response.status_code != 200:
+            logger.warning(f"failed to preload `{model}` on {host.url}: {http_response.content}")
+            return None
+        return _Response(http_response.json())
+
+    host_pool = _get_host_pool()
+    host_pool.check_health()
+    hosts = [host for host in host_pool.hosts if host.healthy]
+    responses = map_concurrently(preload, hosts, max_running=len(hosts))
+    return [response for response in responses if response is not None]
+
+
+def _add_model_durations(model_durations: dict[str, dict], model: str, responses: list["_Response"]) -> None:
+    if model not in model_durations.keys():
+        model_durations[model] = {
+            "num_requests": 0,
+            "load_seconds": 0.0,
+            "prompt_eval_seconds": 0.0,
+            "eval_seconds": 0.0
+        }
+    durations = model_durations[model]
+    for response in responses:
+        durations["num_requests"] += 1
+        durations["load_seconds"] += response.response.get("load_duration", 0) / 1e9
+        durations["prompt_eval_seconds"] += response.response.get("prompt_eval_duration", 0) / 1e9
+        durations["eval_seconds"] += response.response.get("eval_duration", 0) / 1e9
+
+
+@dataclasses.dataclass
+class _AdaptiveConcurrencyLimit:
+    limit: float = 1.0
+    threshold: float = math.inf  # slow start until the limit reaches this threshold
+    last_decrease: float = 0.0
+    min_latency: float = math.inf  # used if the responses do not include the durations
+    completions: collections.deque = dataclasses.field(default_factory=collections.deque)
+
+    def allows(self, num_running: int) -> bool:
+        return num_running < int(self.limit)
+
+    def on_complete(
+            self,
+            started_at: float,
+            response: _Response | None,
+            num_running: int,
+            status_code: int | None
+    ) -> None:
+        now = time.time()
+        latency = now - started_at
+        if status_code is not None and 400 <= status_code < 500 and status_code != 429:
+            return  # e.g., a bad request or an unknown model, which says nothing about the load of the server
+        if response is None:  # timeouts, connection errors, and server errors indicate an overloaded server
+            is_queued = True
+        else:
+            self.completions.append(now)
+            processing_seconds = response.processing_seconds()
+            if processing_seconds is None:
+                self.min_latency = min(self.min_latency, latency)
+                processing_seconds = self.min_latency
+            is_queued = latency - processing_seconds > QUEUE_TOLERANCE * processing_seconds + 0.005
+
+        if is_queued:
+            if started_at >= self.last_decrease:  # decrease only once for the requests running at the time
+                self.limit = max(1.0, self.limit * DECREASE_FACTOR)
+                self.threshold = self.limit
+                self.last_decrease = now
+        elif num_running >= int(self.limit):  # increase only if the limit was reached
+            if self.limit < self.threshold:
+                self.limit += 1  # doubles the limit with every round trip
+            else:
+                self.limit += 1 / self.limit  # increases the limit by one with every round trip
+            self.limit = min(self.limit, OLLAMA_MAX_CONCURRENCY)
+
+    def throughput(self) -> float:
+        while len(self.completions) > 0 and self.completions[0] < time.time() - THROUGHPUT_WINDOW:
+            self.completions.popleft()
+        if len(self.completions) < 2:
+            return 0.0
+        return (len(self.completions) - 1) / max(self.completions[-1] - self.completions[0], 1e-9)
+
+
+@dataclasses.dataclass
+class _Host:
+    url: str
+    healthy: bool = True
+    next_health_check: float = 0.0
+    num_outstanding: int = 0
+    num_requests: int = 0
+    num_failures: int = 0
+
+
+class _HostPool:
+    hosts: list[_Host]
+
+    def __init__(self, urls: list[str]) -> None:
+        self.hosts = [_Host(url.rstrip("/")) for url in urls]
+        self._lock = threading.Lock()
+
+    def acquire(self, exclude: set[str]) -> _Host:
+        self.check_health()
+        with self._lock:
+            healthy = [host for host in self.hosts if host.healthy and host.url not in exclude]
+            if len(healthy) == 0:
+                raise requests.ConnectionError("cannot reach any Ollama server")
+            host = min(healthy, key=lambda host: host.num_outstanding)  # route to the least busy server
+            host.num_outstanding += 1
+            host.num_requests += 1
+            return host
+
+    def release(self, host: _Host, *, failed: bool) -> None:
+        with self._lock:
+            host.num_outstanding -= 1
+        if failed:
+            self.mark_unhealthy(host)
+
+    def mark_unhealthy(self, host: _Host) -> None:
+        with self._lock:
+            host.num_failures += 1
+            if host.healthy:
+                logger.warning(f"mark Ollama server {host.url} as unhealthy")
+            host.healthy = False
+            host.next_health_check = time.time() + HEALTH_CHECK_INTERVAL
+
+    def check_health(self) -> None:
+        with self._lock:  # only one thread probes each unhealthy server
+            now = time.time()
+            hosts_to_check = [host for host in self.hosts if not host.healthy and host.next_health_check <= now]
+            for host in hosts_to_check:
+                host.next_health_check = now + HEALTH_CHECK_INTERVAL
+
+        for host in hosts_to_check:
+            try:
+                healthy = http_get(f"{host.url}/api/version", timeout=HEALTH_CHECK_TIMEOUT).status_code == 200
+            except requests.RequestException:
+                healthy = False
+            if healthy:
+                logger.info(f"Ollama server {host.url} is healthy again")
+                with self._lock:
+                    host.healthy = True
+
+    def describe(self) -> list[dict]:
+        self.check_health()
+        with self._lock:
+            return [
+                {
+                    "url": host.url,
+                    "healthy": host.healthy,
+                    "num_outstanding": host.num_outstanding,
+                    "num_requests": host.num_requests,
+                    "num_failures": host.num_failures
+                } for host in self.hosts
+            ]
+
+
+_host_pool: _HostPool | None = None
+_host_pool_lock = threading.Lock()
+
+
+def _get_host_pool() -> _HostPool:
+    global _host_pool
+    urls = [url.rstrip("/") for url in (OLLAMA_URLS if len(OLLAMA_URLS) > 0 else [OLLAMA_URL])]
+    with _host_pool_lock:
+        if _host_pool is None or [host.url for host in _host_pool.hosts] != urls:
+            _host_pool = _HostPool(urls)
+        return _host_pool
+
 
 @dataclasses.dataclass
 class _Pair:
     request: _Request
     response: _Response | None = None
-    status: Literal["open"] | Literal["waiting"] | Literal["running"] | Literal["done"] = "open"
-    thread: threading.Thread | None = None
+    status: Literal["open"] | Literal["running"] | Literal["done"] = "open"
+    latency: float | None = None  # seconds from the start of the last attempt until the response
 
 
 class _ProgressBar(tqdm.tqdm):
     running: int
     failed: int
+    retries: int
     cached: int
-    bottleneck: Literal["T"] | Literal["P"] | Literal["Z"]
+    bottleneck: Literal["T"] | Literal["P"] | Literal["Z"] | Literal["S"]
+    concurrency_limit: _AdaptiveConcurrencyLimit | None
+    refreshed_at: float  # time of the last redraw due to a changed postfix
 
     def __init__(self, *args, **kwargs) -> None:
+        self.concurrency_limit = None
         super().__init__(*args, **kwargs)
         self.running = 0
         self.failed = 0
+        self.retries = 0
         self.cached = 0
         self.bottleneck = "P"
+        self.refreshed_at = 0.0
         self.update_postfix()
 
     def __enter__(self):
@@ -259,6 +578,12 @@ class _ProgressBar(tqdm.tqdm):
         super().update(*args, **kwargs)
 
     def update_postfix(self) -> None:
-        self.set_postfix_str(
-            f"{self.bottleneck}{self.running:03d}, failed={self.failed}, cached={self.cached}"
-        )
+        postfix = f"{self.bottleneck}{self.running:03d}, failed={self.failed}, retries={self.retries}, " \
+                  f"cached={self.cached}"
+        if self.concurrency_limit is not None:
+            postfix += f", limit={int(self.concurrency_limit.limit)}, " \
+                       f"{self.concurrency_limit.throughput():.1f} req/s"
+        self.set_postfix_str(postfix, refresh=False)
+        if not self.disable and time.time() - self.refreshed_at >= self.mininterval:  # redraw at most this often
+            self.refreshed_at = time.time()
+            self.refresh()
@@ -1,5 +1,5 @@
 ########################################################################################################################
-# OpenAI API helpers version: 2025-02-04
+# OpenAI API helpers version: 2026-10-18
 #
 # use the following methods:
 # openai_model(...)        ==> get model info
@@ -8,33 +8,63 @@
 # You must store your OpenAI API key in an environment variable, for example using:
 # export OPENAI_API_KEY="<your-key>"
 #
-# To call openai_execute(...) from multiple processes, you must use a global context:
-# with multiprocessing.Manager() as manager:
-#     context = manager.dict()
-#     semaphore = manager.Semaphore()
-#     # every call now requires the context and semaphore:
-#     responses = openai_execute(requests, global_context=context, global_semaphore=semaphore)
+# To call openai_execute(...) from multiple processes, you must use a global context that shares the budgets of the API
+# key between the processes on this machine:
+# context = SharedContext(shared_context_path("openai", os.environ["OPENAI_API_KEY"]))
+# # every call now requires the context and its lock:
+# responses = openai_execute(requests, global_context=context, global_semaphore=context.lock)
+#
+# A `multiprocessing.Manager().dict()` and `Manager().Semaphore()` also work, but are much slower (see _budget.py).
+#
+# With `mode="batch"`, openai_execute(...) submits the uncached requests to the Batch API instead, which is half the
+# price but may take up to 24 hours (see _batch.py).
+#
+# Requests that share a prefix (e.g., the same instructions) are executed together, so that OpenAI's automatic prompt
+# caching can reuse the prefix (see _prefix.py).
+#
+# Without a `governor`, openai_execute(...) asks for confirmation if the maximum cost exceeds `force`. With a
+# governor, it never asks, but enforces hard limits on the actual cost per run and per day instead (see _governor.py):
+# responses = openai_execute(requests, governor=CostGovernor(max_cost_per_run=5.0, max_cost_per_day=50.0))
 ########################################################################################################################
 
+import collections
 import dataclasses
 import functools
-import hashlib
 import json
 import logging
 import os
 import threading
 import time
-from typing import Literal, Any
+from typing import Callable, Literal, Any, Iterator
 
 import requests
 import tiktoken
 import tqdm
 
 from llms4de.data import get_data_path
+from llms4de.model._batch import BATCH_COST_FACTOR, execute_batches, batch_api_call
+from llms4de.model._budget import OutputLengthEstimate, restore_budget_states, persist_budget_states
+from llms4de.model._cache import open_cache, canonical_hash, canonical_request
+from llms4de.model._executor import execute_pairs, fold_duplicates, fan_out, fan_out_callback, \
+        release_method_caches
+from llms4de.model._governor import CostGovernor
+from llms4de.model._http import http_post, http_get
+from llms4de.model._prefix import group_by_shared_prefix, prefix_elements
+from llms4de.model._retry import ConcurrencyLimit
+from llms4de.model._telemetry import Telemetry
 
 logger = logging.getLogger(__name__)
 
 CACHE_PATH = get_data_path() / "openai_cache"
+RATE_LIMITS_PATH = get_data_path() / "openai_rate_limits"  # learned budget states per API key, see _budget.py
+BATCHES_PATH = get_data_path() / "openai_batches"  # ids of submitted batches, see _batch.py
+BASE_URL = "https://api.openai.com/v1"
+BATCH_MAX_REQUESTS = 50_000  # see https://platform.openai.com/docs/guides/batch
+BATCH_MAX_BYTES = 200_000_000
+# threads for tiktoken's `encode_batch`, 1 to encode one text at a time, which was faster on the single CPU of
+# experiments/executor_benchmarks/cached_rerun.txt, so only raise it after benchmarking it on the target machine
+TOKENIZER_THREADS = 1
+TOKENIZER_CHUNK_SIZE = 1_000  # requests tokenized at once, limits the memory for the token lists
 
 MODEL_PARAMETERS = {  # see https://platform.openai.com/docs/models and https://openai.com/api/pricing/
     # GPT-3.5 Turbo Instruct
@@ -187,8 +217,13 @@ def openai_execute(
         *,
         force: float | None = None,
         silent: bool = False,
+        callback: Callable[[int, dict], None] | None = None,
+        mode: Literal["online"] | Literal["batch"] = "online",
+        hedge_percentile: float | None = None,
         global_context: dict | None = None,
-        global_semaphore: "multiprocessing.Semaphore | None" = None
+        global_semaphore: "multiprocessing.Semaphore | None" = None,
+        governor: CostGovernor | None = None,
+        stop: threading.Event | None = None
 ) -> list[dict]:
     """Execute a list of requests against the OpenAI API.
 
@@ -199,8 +234,14 @@ def openai_execute(
         requests: A list of API requests.
         force: An optional float specifying the cost below or equal to which no confirmation should be required.
         silent: Whether to display log messages and progress bars.
+        callback: Optional function that receives the index and response of each request as soon as it is available.
+        mode: Whether to execute the requests one by one ("online") or through the Batch API ("batch").
+        hedge_percentile: Optional latency percentile (e.g., 0.95) after which to send a duplicate of a request with
+            `temperature` 0, None to disable hedging.
         global_context: Optional global context for use with multiprocessing.
         global_semaphore: Optional global semaphore for use with multiprocessing.
+        governor: Optional cost governor that limits the actual cost instead of asking for confirmation.
+        stop: Optional event after which no more requests are started, e.g., once the responses are no longer needed.
 
     Returns:
         A list of API responses.
@@ -221,206 +262,172 @@ def openai_execute(
         if "num_running" not in context.keys():
             context["num_running"] = 0
 
+    # create pairs, identical requests share one pair
     before = time.perf_counter()
-    pairs = [_Pair(_Request(request)) for request in requests]
+    pairs, positions = fold_duplicates(
+        [_Pair(_Request(request)) for request in requests],
+        key=lambda pair: pair.request.hash()
+    )
     if _do_benchmark:
         logger.info(f"created pairs in {time.perf_counter() - before} seconds")
+    if len(pairs) < len(positions) and not silent:
+        logger.info(f"folded {len(positions) - len(pairs)} duplicate requests into {len(pairs)} unique requests")
+    notify = fan_out_callback(callback, positions)
+    position_by_pair = {id(pair): position for position, pair in enumerate(pairs)}
+    input_tokens = collections.Counter()  # cached and uncached input tokens of the executed requests
 
-    with _ProgressBar(total=len(pairs), desc="", disable=silent) as progress_bar:
-
-        # check requests
-        before = time.perf_counter()
-        progress_bar.set_description("check requests")
-        progress_bar.reset(total=len(pairs))
-        for pair in pairs:
-            pair.request.check()
-            progress_bar.update()
-        if _do_benchmark:
-            logger.info(f"checked requests in {time.perf_counter() - before} seconds")
+    def on_done(pair: _Pair) -> None:
+        input_tokens["cached"] += pair.response.cached_input_usage()
+        input_tokens["uncached"] += pair.response.input_usage() - pair.response.cached_input_usage()
+        notify(position_by_pair[id(pair)], pair.response.response)
 
-        # create cache directory
-        CACHE_PATH.mkdir(parents=True, exist_ok=True)
+    with _ProgressBar(total=len(pairs), desc="", disable=silent) as progress_bar, Telemetry("openai") as telemetry:
 
         # load cached pairs
         before = time.perf_counter()
         pairs_to_execute = []
         progress_bar.set_description("load responses")
         progress_bar.reset(total=len(pairs))
-        for pair in pairs:
-            pair.response = pair.request.load_cached_response()
+        cached_pairs = open_cache(CACHE_PATH).load_many([pair.request.hash() for pair in pairs])
+        for position, pair in enumerate(pairs):
+            pair.response = pair.request.load_cached_response(cached_pairs)
             if pair.response is None:
                 pairs_to_execute.append(pair)
             else:
                 progress_bar.cached += 1
+                notify(position, pair.response.response)
             progress_bar.update()
+        telemetry.on_cache(len(pairs), progress_bar.cached)
         if _do_benchmark:
-            logger.info(f"loaded responses in {time.perf_counter() - before} seconds")
+            seconds = time.perf_counter() - before
+            logger.info(
+                f"loaded responses in {seconds} seconds ({len(pairs) / max(seconds, 1e-9):.0f} pairs/sec, "
+                f"{progress_bar.cached} cached)"
+            )
 
         # in case some pairs were not cached, execute them
         if len(pairs_to_execute) > 0:
-            progress_bar.clear()  # clear before printing/logging
 
             if "OPENAI_API_KEY" not in os.environ.keys():
                 raise AssertionError(f"Missing `OPENAI_API_KEY` in environment variables!")
 
+            # count tokens
+            before = time.perf_counter()
+            progress_bar.set_description("count tokens")
+            progress_bar.reset(total=len(pairs))
+            progress_bar.update(progress_bar.cached)
+            for idx in range(0, len(pairs_to_execute), TOKENIZER_CHUNK_SIZE):
+                chunk = pairs_to_execute[idx:idx + TOKENIZER_CHUNK_SIZE]
+                _count_input_tokens([pair.request for pair in chunk])
+                progress_bar.update(len(chunk))
+            if _do_benchmark:
+                logger.info(f"counted tokens in {time.perf_counter() - before} seconds")
+
+            progress_bar.clear()  # clear before printing/logging
+
+            # check requests
+            before = time.perf_counter()
+            for pair in pairs_to_execute:
+                pair.request.check()
+            if _do_benchmark:
+                logger.info(f"checked requests in {time.perf_counter() - before} seconds")
+
             # compute maximum cost
             before = time.perf_counter()
             total_max_cost = sum(pair.request.max_cost() for pair in pairs_to_execute)
+            if mode == "batch":
+                total_max_cost *= BATCH_COST_FACTOR
             if _do_benchmark:
                 logger.info(f"computed maximum cost in {time.perf_counter() - before} seconds")
 
-            if force is None or total_max_cost > force:
+            if governor is not None:
+                if not silent:
+                    logger.info(f"spending up to around ${total_max_cost:.2f} within the limits of the governor")
+            elif force is None or total_max_cost > force:
                 logger.info(f"press enter to continue and spend up to around ${total_max_cost:.2f}")
                 input()
             elif not silent:
                 logger.info(f"spending up to around ${total_max_cost:.2f}")
 
-            # sort requests to execute longest requests first, put one short request first to quickly obtain HTTP header
+            # execute the shortest request first to quickly obtain HTTP headers, and requests with the same prefix
+            # together
             before = time.perf_counter()
-            pairs_to_execute.sort(key=lambda p: p.request.max_total_usage(), reverse=True)
-            pairs_to_execute = pairs_to_execute[-1:] + pairs_to_execute[:-1]
+            probe = min(pairs_to_execute, key=lambda p: p.request.max_input_usage())
+            grouped_pairs, _ = group_by_shared_prefix(
+                [pair for pair in pairs_to_execute if pair is not probe],
+                elements=lambda p: prefix_elements(p.request.request),
+                size=lambda p: p.request.max_total_usage()
+            )
+            pairs_to_execute = [probe] + grouped_pairs
             if _do_benchmark:
-                logger.info(f"sorted requests in {time.perf_counter() - before} seconds")
-
-            # execute requests
-            before = time.perf_counter()
-            progress_bar.set_description("execute requests")
-            progress_bar.reset(total=len(pairs))
-            progress_bar.update(progress_bar.cached)
-            while True:  # break if all(pair.status == "done" for pair in pairs_to_execute)
-                logger.debug("repeatedly iterate through pairs until all are done")
-                for pair in pairs_to_execute:
-                    with semaphore:
-                        if pair.status != "open":
-                            continue
-                        pair.status = "waiting"
-
-                        if pair.request.model not in context.keys():
-                            context[pair.request.model] = _ModelBudgetState.new()
-
-                    while True:  # break if request is "done" in sequential execution or "running" in parallel execution
-                        with semaphore:
-                            context[pair.request.model] = context[pair.request.model].consider_time()
-
-                            if context[pair.request.model].is_enough_for_request(pair.request):
-                                match context[pair.request.model].mode:
-                                    case "sequential" if context["num_running"] == 0:
-                                        logger.debug(f"sequential execution for `{pair.request.model}`: execute")
-                                        progress_bar.bottleneck = "S"
-
-                                        pair.status = "running"
-                                        context["num_running"] = context["num_running"] + 1
-                                        progress_bar.running = context["num_running"]
-                                        progress_bar.update_postfix()
-
-                                        context[pair.request.model] = context[pair.request.model].decrease_by_request(
-                                            pair.request
-                                        )
-
-                                        http_response = pair.request.execute()
-                                        pair.response = _Response(http_response.json())
-
-                                        context[pair.request.model] = context[pair.request.model].set_from_headers(
-                                            http_response.headers
-                                        )
-
-                                        context["num_running"] = context["num_running"] - 1
-                                        progress_bar.running = context["num_running"]
-                                        progress_bar.cost += pair.response.total_cost()
-
-                                        match http_response.status_code:
-                                            case 200:
-                                                context[pair.request.model] = context[pair.request.model].to_parallel()
-                                                pair.status = "done"
-                                                progress_bar.update()
-                                                break
-                                            case 429:
-                                                pair.status = "open"
-                                                progress_bar.update_postfix()  # not done -> update only postfix
-                                                logger.info("sleep for 30 seconds")
-                                                time.sleep(30)
-                                            case _:
-                                                pair.status = "done"
-                                                progress_bar.failed += 1
-                                                progress_bar.update()
-                                                break
-                                    case "parallel" if context["num_running"] < 200:  # max. num. of parallel requests
-                                        logger.debug(f"parallel execution for `{pair.request.model}`: execute")
-                                        progress_bar.bottleneck = "P"
-
-                                        pair.status = "running"
-                                        context["num_running"] = context["num_running"] + 1
-                                        progress_bar.running = context["num_running"]
-                                        progress_bar.update_postfix()
-
-                                        context[pair.request.model] = context[pair.request.model].decrease_by_request(
-                                            pair.request
-                                        )
-
-                                        def execute(p: _Pair, pb: _ProgressBar, c: dict,
-                                                    s: threading.Semaphore) -> None:
-                                            http_response = p.request.execute()
-                                            p.response = _Response(http_response.json())
-
-                                            with s:
-                                                c[pair.request.model] = c[p.request.model].set_from_headers(
-                                                    http_response.headers
-                                                )
-
-                                                c["num_running"] = c["num_running"] - 1
-                                                pb.running = c["num_running"]
-                                                pb.cost += p.response.total_cost()
-
-                                                match http_response.status_code:
-                                                    case 200:
-                                                        c[p.request.model] = c[p.request.model].increase_by_response(
-                                                            p.request,
-                                                            p.response
-                                                        )
-                                                        p.status = "done"
-                                                        pb.update()
-                                                    case 429:
-                                                        logger.debug(
-                                                            f"parallel execution for `{p.request.model}`: "
-                                                            f"rate limit error -> switch to sequential execution"
-                                                        )
-                                                        p.status = "open"
-                                                        c[p.request.model] = c[p.request.model].to_sequential()
-                                                        pb.update_postfix()  # not done -> update only postfix
-                                                    case _:
-                                                        p.status = "done"
-                                                        pb.failed += 1
-                                                        pb.update()
-
-                                        pair.thread = threading.Thread(
-                                            target=execute,
-                                            args=(pair, progress_bar, context, semaphore)
-                                        )
-                                        pair.thread.start()
-                                        break
-                                    case _:
-                                        progress_bar.bottleneck = "T"
-                                        progress_bar.update_postfix()
-                            else:
-                                progress_bar.bottleneck = "L"
-                                progress_bar.update_postfix()
-
-                        time.sleep(0.05)  # sleep to wait for thread limit or rate limit budget
-
-                if all(pair.status == "done" for pair in pairs_to_execute):
-                    break
-                progress_bar.bottleneck = "Z"
-                progress_bar.update_postfix()
-                time.sleep(1)  # sleep to wait for stragglers and failures
-
-            for pair in pairs_to_execute:
-                if pair.thread is not None:
-                    pair.thread.join()
-
-            if _do_benchmark:
-                logger.info(f"executed requests in {time.perf_counter() - before} seconds")
-
-    return [pair.response.response for pair in pairs]
+                logger.info(f"grouped requests in {time.perf_counter() - before} seconds")
+
+            # execute requests through the Batch API, requests without a result are executed online afterward
+            if mode == "batch":
+                progress_bar.set_description("execute batches")
+                progress_bar.reset(total=len(pairs))
+                progress_bar.update(progress_bar.cached)
+                pairs_to_execute = execute_batches(
+                    pairs_to_execute,
+                    submit=_submit_batch,
+                    poll=_poll_batch,
+                    results=_batch_results,
+                    response_cls=_Response,
+                    cache_path=CACHE_PATH,
+                    registry_path=BATCHES_PATH,
+                    progress_bar=progress_bar,
+                    max_requests=BATCH_MAX_REQUESTS,
+                    max_bytes=BATCH_MAX_BYTES,
+                    group=lambda pair: pair.request.url(),
+                    on_done=on_done,
+                    governor=governor
+                )
+
+            if len(pairs_to_execute) > 0:
+                # start with the budget states that earlier runs have learned
+                models = {pair.request.model for pair in pairs_to_execute}
+                api_key = os.environ["OPENAI_API_KEY"]
+                restore_budget_states(
+                    context, semaphore, models, path=RATE_LIMITS_PATH, api_key=api_key, state_cls=_ModelBudgetState
+                )
+
+                # execute requests
+                before = time.perf_counter()
+                progress_bar.set_description("execute requests")
+                progress_bar.reset(total=len(pairs))
+                progress_bar.update(len(pairs) - len(pairs_to_execute))
+                try:
+                    execute_pairs(
+                        pairs_to_execute,
+                        context=context,
+                        semaphore=semaphore,
+                        progress_bar=progress_bar,
+                        response_cls=_Response,
+                        max_running=200,  # max. num. of parallel requests
+                        new_budget_state=_ModelBudgetState.new,
+                        track_cost=True,
+                        poll_interval=None if global_context is None else 0.05,  # other processes cannot wake it up
+                        on_done=on_done,
+                        hedge_percentile=hedge_percentile,
+                        telemetry=telemetry,
+                        governor=governor,
+                        stop=stop
+                    )
+                finally:
+                    persist_budget_states(context, semaphore, models, path=RATE_LIMITS_PATH, api_key=api_key)
+
+                if _do_benchmark:
+                    logger.info(f"executed requests in {time.perf_counter() - before} seconds")
+
+            if not silent and input_tokens.total() > 0:
+                logger.info(
+                    f"input tokens: {input_tokens['cached']} cached "
+                    f"({input_tokens['cached'] / input_tokens.total():.0%}), {input_tokens['uncached']} uncached"
+                )
+
+    responses = fan_out([pair.response.response for pair in pairs], positions)
+    release_method_caches(_Request, _Response)  # the pairs are no longer needed
+    return responses
 
 
 ########################################################################################################################
@@ -446,11 +453,92 @@ def _get_encoding_cached(model: str) -> tiktoken.Encoding:
     return tiktoken.encoding_for_model(model)
 
 
+def _count_input_tokens(requests: list["_Request"]) -> None:
+    requests_by_model = collections.defaultdict(list)
+    for request in requests:
+        requests_by_model[request.model].append(request)
+
+    for model, model_requests in requests_by_model.items():
+        encoding = _get_encoding_cached(model)
+        match _get_model_params(model)["chat_or_completion"]:
+            case "chat":
+                extra_tokens = 5  # number of additional tokens in each message
+                texts = [message["content"] for request in model_requests for message in request.messages]
+                lengths = iter(_num_tokens_batch(encoding, texts))
+                for request in model_requests:
+                    request.num_input_tokens = sum(next(lengths) + extra_tokens for _ in request.messages)
+            case "completion":
+                texts = [request.prompt for request in model_requests]
+                lengths = iter(_num_tokens_batch(encoding, texts))
+                for request in model_requests:
+                    request.num_input_tokens = next(lengths)
+            case _:
+                raise AssertionError(f"Invalid parameter `chat_or_completion` for model `{model}`!")
+
+
+def _num_tokens_batch(encoding: tiktoken.Encoding, texts: list[str]) -> list[int]:
+    if TOKENIZER_THREADS > 1:
+        return [len(tokens) for tokens in encoding.encode_batch(texts, num_threads=TOKENIZER_THREADS)]
+    else:  # `encode_batch` only adds overhead without multiple threads
+        return [len(encoding.encode(text)) for text in texts]
+
+
+def _auth_headers() -> dict:
+    return {"Authorization": f"Bearer {os.environ['OPENAI_API_KEY']}"}
+
+
+def _submit_batch(pairs: list["_Pair"]) -> str:
+    endpoint = "/v1" + pairs[0].request.url().removeprefix(BASE_URL)  # all pairs of a batch share the endpoint
+    lines = "".join(
+        json.dumps({"custom_id": pair.request.hash(), "method": "POST", "url": endpoint, "body": pair.request.request})
+        + "\n" for pair in pairs
+    )
+    file = batch_api_call(lambda: http_post(
+        url=f"{BASE_URL}/files",
+        data={"purpose": "batch"},
+        files={"file": ("batch.jsonl", lines.encode("utf-8"), "application/jsonl")},
+        headers=_auth_headers()
+    )).json()
+    batch = batch_api_call(lambda: http_post(
+        url=f"{BASE_URL}/batches",
+        json={"input_file_id": file["id"], "endpoint": endpoint, "completion_window": "24h"},
+        headers={"Content-Type": "application/json", **_auth_headers()}
+    )).json()
+    return batch["id"]
+
+
+def _poll_batch(batch_id: str) -> tuple[bool, int]:
+    batch = batch_api_call(lambda: http_get(f"{BASE_URL}/batches/{batch_id}", headers=_auth_headers())).json()
+    has_ended = batch["status"] in {"completed", "failed", "expired", "cancelled"}
+    request_counts = batch.get("request_counts") or {}
+    return has_ended, request_counts.get("completed", 0) + request_counts.get("failed", 0)
+
+
+def _batch_results(batch_id: str) -> Iterator[tuple[str, int, dict]]:
+    batch = batch_api_call(lambda: http_get(f"{BASE_URL}/batches/{batch_id}", headers=_auth_headers())).json()
+    for file_id in [batch.get("output_file_id"), batch.get("error_file_id")]:
+        if file_id is None:
+            continue
+        content = batch_api_call(lambda: http_get(f"{BASE_URL}/files/{file_id}/content", headers=_auth_headers()))
+        for line in content.text.splitlines():
+            if line.strip() == "":
+                continue
+            result = json.loads(line)
+            if result.get("response") is not None:
+                yield result["custom_id"], result["response"]["status_code"], result["response"]["body"]
+            else:  # the request could not be processed, so execute it online
+                yield result["custom_id"], 500, {"error": result.get("error")}
+
+
 class _Request:
     request: dict
+    num_input_tokens: int | None
+    reserved_usage: int  # number of tokens reserved in the budget while the request is running
 
     def __init__(self, request: dict) -> None:
         self.request = request
+        self.num_input_tokens = None
+        self.reserved_usage = 0
 
     @functools.cached_property
     def model(self) -> str:
@@ -478,22 +566,9 @@ class _Request:
     def url(self) -> str:
         match self.is_chat_or_completion():
             case "chat":
-                return "https://api.openai.com/v1/chat/completions"
+                return f"{BASE_URL}/chat/completions"
             case "completion":
-                return "https://api.openai.com/v1/completions"
-            case _:
-                raise AssertionError(f"Invalid parameter `chat_or_completion` for model `{self.model}`!")
-
-    @functools.cache
-    def num_input_tokens(self) -> int:
-        encoding = _get_encoding_cached(self.model)
-
-        match self.is_chat_or_completion():
-            case "chat":
-                extra_tokens = 5  # number of additional tokens in each message
-                return sum(len(encoding.encode(message["content"])) + extra_tokens for message in self.messages)
-            case "completion":
-                return len(encoding.encode(self.prompt))
+                return f"{BASE_URL}/completions"
             case _:
                 raise AssertionError(f"Invalid parameter `chat_or_completion` for model `{self.model}`!")
 
@@ -505,7 +580,7 @@ class _Request:
             return self.request["max_tokens"]
         else:
             model_params = _get_model_params(self.model)
-            left_for_output = max(0, model_params["max_context"] - self.num_input_tokens())
+            left_for_output = max(0, model_params["max_context"] - self.num_input_tokens)
             if model_params["max_output_tokens"] is not None and model_params["max_output_tokens"] < left_for_output:
                 return model_params["max_output_tokens"]
             else:
@@ -513,7 +588,7 @@ class _Request:
 
     @functools.cache
     def max_total_tokens(self) -> int:
-        return self.num_input_tokens() + self.max_num_output_tokens()
+        return self.num_input_tokens + self.max_num_output_tokens()
 
     @functools.cache
     def max_input_usage(self) -> int:
@@ -523,7 +598,7 @@ class _Request:
             n = self.request["n"]
         else:
             n = 1
-        return n * self.num_input_tokens()
+        return n * self.num_input_tokens
 
     @functools.cache
     def max_output_usage(self) -> int:
@@ -540,20 +615,22 @@ class _Request:
         return self.max_input_usage() + self.max_output_usage()
 
     @functools.cache
-    def max_cost(self) -> float:
+    def max_cost(self, output_usage: int | None = None) -> float:  # with `output_usage` instead of the maximum
         model_params = _get_model_params(self.model)
         input_cost = self.max_input_usage() * (model_params["cost_per_1k_input_tokens"] / 1000)
-        output_cost = self.max_output_usage() * (model_params["cost_per_1k_output_tokens"] / 1000)
+        if output_usage is None:
+            output_usage = self.max_output_usage()
+        output_cost = output_usage * (model_params["cost_per_1k_output_tokens"] / 1000)
         return input_cost + output_cost
 
     @functools.cache
     def hash(self) -> str:
-        return hashlib.sha256(bytes(json.dumps(self.request), "utf-8")).hexdigest()
+        return canonical_hash(self.request)
 
     def check(self) -> None:
         model_params = _get_model_params(self.model)
 
-        if self.num_input_tokens() > model_params["max_context"]:
+        if self.num_input_tokens > model_params["max_context"]:
             logger.warning("request's number of input tokens exceeds model's `max_context`")
 
         if "max_tokens" in self.request.keys() and "max_completion_tokens" in self.request.keys():
@@ -570,7 +647,7 @@ class _Request:
             if model_params["max_output_tokens"] is not None and token_limit > model_params["max_output_tokens"]:
                 logger.warning("request's `max_tokens` or `max_completion_tokens` exceeds model's `max_output_tokens`")
 
-            if self.num_input_tokens() + token_limit > model_params["max_context"]:
+            if self.num_input_tokens + token_limit > model_params["max_context"]:
                 logger.warning(
                     "request's input tokens + `max_tokens` or `max_completion_tokens` exceeds model's `max_context`")
 
@@ -580,32 +657,34 @@ class _Request:
         if "temperature" not in self.request.keys() or self.request["temperature"] != 0:
             logger.warning("request's `temperature` not set to 0, which is required for reproducibility")
 
-    def load_cached_response(self):  # -> "_Response" | None
-        path = CACHE_PATH / f"{self.hash()}.json"
-        if path.is_file():
-            with open(path, "r", encoding="utf-8") as file:
-                cached_pair = json.load(file)
+    def is_deterministic(self) -> bool:
+        return self.request.get("temperature") == 0  # a duplicate must not yield a different response
+
+    def load_cached_response(self, cached_pairs: dict[str, dict]):  # -> "_Response" | None
+        cached_pair = cached_pairs.get(self.hash())
+        if cached_pair is not None:
             cached_request = _Request(cached_pair["request"])
             cached_response = _Response(cached_pair["response"])
-            if self.request == cached_request.request:
+            if self.request == cached_request.request \
+                    or canonical_request(self.request) == canonical_request(cached_request.request):
                 return cached_response
         return None
 
     def execute(self) -> requests.Response:
-        http_response = requests.post(
+        started_at = time.perf_counter()
+        http_response = http_post(
             url=self.url(),
             json=self.request,
             headers={"Content-Type": "application/json", "Authorization": f"Bearer {os.environ['OPENAI_API_KEY']}"}
         )
 
         if http_response.status_code == 200:
-            path = CACHE_PATH / f"{self.hash()}.json"
-            with open(path, "w", encoding="utf-8") as cache_file:
-                json.dump({"request": self.request, "response": http_response.json()}, cache_file)
+            latency = time.perf_counter() - started_at  # recorded for the `replay` API name
+            open_cache(CACHE_PATH).store(self.hash(), self.request, http_response.json(), latency)
         elif http_response.status_code == 429:
-            logger.info("retry request due to rate limit error")
+            logger.debug("request failed due to rate limit error")
         else:
-            logger.warning(f"request failed, no retry: {http_response.content}")
+            logger.warning(f"request failed with status {http_response.status_code}: {http_response.content}")
 
         return http_response
 
@@ -632,6 +711,27 @@ class _Response:
             raise AttributeError("Missing field `usage` in response, which is required for successful requests!")
         return self.response["usage"]
 
+    @functools.cache
+    def input_usage(self) -> int:
+        if self.was_successful():
+            return self.usage.get("prompt_tokens", 0)
+        else:
+            return 0
+
+    @functools.cache
+    def cached_input_usage(self) -> int:
+        if self.was_successful():
+            return (self.usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+        else:
+            return 0
+
+    @functools.cache
+    def output_usage(self) -> int:
+        if self.was_successful():
+            return self.usage.get("completion_tokens", 0)
+        else:
+            return 0
+
     @functools.cache
     def total_usage(self) -> int:
         if self.was_successful():
@@ -657,46 +757,65 @@ class _Response:
 class _Pair:
     request: _Request
     response: _Response | None = None
-    status: Literal["open"] | Literal["waiting"] | Literal["running"] | Literal["done"] = "open"
-    thread: threading.Thread | None = None
+    status: Literal["open"] | Literal["running"] | Literal["done"] = "open"
+    latency: float | None = None  # seconds from the start of the last attempt until the response
 
 
 @dataclasses.dataclass
 class _ModelBudgetState:
-    mode: Literal["sequential"] | Literal["parallel"]
     rpm: int | None
     tpm: int | None
-    r: int | None
-    t: int | None
+    r: float | None
+    t: float | None
     last_update: float
+    concurrency: ConcurrencyLimit = dataclasses.field(default_factory=ConcurrencyLimit)
+    num_running: int = 0
+    retry_at: float = 0.0
+    output_estimate: OutputLengthEstimate = dataclasses.field(default_factory=OutputLengthEstimate)
 
     @classmethod
     def new(cls) -> "_ModelBudgetState":
-        return cls("sequential", None, None, None, None, time.time())
+        return cls(None, None, None, None, time.time())
+
+    def expected_usage(self, request: _Request) -> int:
+        return request.max_input_usage() + self.output_estimate.predict(request.max_output_usage())
+
+    def expected_cost(self, request: _Request) -> float:
+        return request.max_cost(self.output_estimate.predict(request.max_output_usage()))
 
     def is_enough_for_request(self, request: _Request) -> bool:
-        return (self.r is None or self.r >= 1) and (self.t is None or self.t >= request.max_total_usage())
+        return (self.r is None or self.r >= 1) and (self.t is None or self.t >= self.expected_usage(request))
+
+    def seconds_until_enough(self, request: _Request) -> float:
+        return max(
+            _seconds_until_refilled(self.r, self.rpm, 1),
+            _seconds_until_refilled(self.t, self.tpm, self.expected_usage(request))
+        )
 
     def consider_time(self) -> "_ModelBudgetState":
         now = time.time()
         delta = now - self.last_update
         if self.rpm is not None and self.r is not None:
-            self.r = min(self.rpm, int(self.r + self.rpm * delta / 60))
+            self.r = min(self.rpm, self.r + self.rpm * delta / 60)
         if self.tpm is not None and self.t is not None:
-            self.t = min(self.tpm, int(self.t + self.tpm * delta / 60))
+            self.t = min(self.tpm, self.t + self.tpm * delta / 60)
         self.last_update = now
         return self
 
     def decrease_by_request(self, request: _Request) -> "_ModelBudgetState":
+        request.reserved_usage = self.expected_usage(request)
         if self.r is not None:
             self.r -= 1
         if self.t is not None:
-            self.t -= request.max_total_usage()
+            self.t -= request.reserved_usage
         return self
 
     def increase_by_response(self, request: _Request, response: _Response) -> "_ModelBudgetState":
-        if response.total_usage() < request.max_total_usage():
-            self.t = min(self.tpm, int(self.t + request.max_total_usage() - response.total_usage()))
+        # return the unused reservation, or charge the usage that exceeded the reservation
+        if self.t is not None and self.tpm is not None:
+            self.t = min(self.tpm, self.t + request.reserved_usage - response.total_usage())
+        if response.was_successful():
+            self.output_estimate.observe(response.output_usage())
         return self
 
     def set_from_headers(self, headers: dict[str, Any]) -> "_ModelBudgetState":
@@ -714,29 +833,35 @@ class _ModelBudgetState:
                 self.t = header_t
         return self
 
-    def to_parallel(self) -> "_ModelBudgetState":
-        self.mode = "parallel"
-        return self
 
-    def to_sequential(self) -> "_ModelBudgetState":
-        self.mode = "sequential"
-        return self
+def _seconds_until_refilled(budget: float | None, per_minute: int | None, required: int) -> float:
+    if budget is None or budget >= required:
+        return 0
+    elif per_minute is None or per_minute <= 0 or per_minute < required:
+        return 60  # the budget will never be enough, so only check once in a while
+    else:
+        return (required - budget) * 60 / per_minute
 
 
 class _ProgressBar(tqdm.tqdm):
     running: int
     failed: int
+    retries: int
     cached: int
     cost: float
-    bottleneck: Literal["T"] | Literal["L"] | Literal["P"] | Literal["Z"] | Literal["S"]
+    refreshed_at: float  # time of the last redraw due to a changed postfix
+    bottleneck: Literal["T"] | Literal["L"] | Literal["P"] | Literal["Z"] | Literal["S"] | Literal["B"] \
+            | Literal["C"]
 
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self.running = 0
         self.failed = 0
+        self.retries = 0
         self.cached = 0
         self.cost = 0
         self.bottleneck = "P"
+        self.refreshed_at = 0.0
         self.update_postfix()
 
     def __enter__(self):
@@ -751,5 +876,10 @@ class _ProgressBar(tqdm.tqdm):
 
     def update_postfix(self) -> None:
         self.set_postfix_str(
-            f"{self.bottleneck}{self.running:03d}, failed={self.failed}, cached={self.cached}, cost=${self.cost:.2f}"
+            f"{self.bottleneck}{self.running:03d}, failed={self.failed}, retries={self.retries}, cached={self.cached}, "
+            f"cost=${self.cost:.2f}",
+            refresh=False
         )
+        if not self.disable and time.time() - self.refreshed_at >= self.mininterval:  # redraw at most this often
+            self.refreshed_at = time.time()
+            self.refresh()
@@ -0,0 +1,108 @@
+########################################################################################################################
+# Prompt prefix helpers version: 2026-10-18
+#
+# use the following methods:
+# group_by_shared_prefix(...) ==> order items so that items with the same prefix run together, and find the prefixes
+# prefix_elements(...)        ==> split an API request into the elements (model, system prompt, messages) of its prefix
+#
+# Many tasks create requests that share a long identical prefix, for example the instructions with the list of all
+# column types of column type annotation. The providers cache such prefixes and discount the cached input tokens (OpenAI
+# automatically, Anthropic at explicit `cache_control` breakpoints), but only if the requests with the same prefix are
+# executed close to each other. Sorting the requests by the hashes of their prefix elements places requests with common
+# prefixes next to each other, and the longest prefix that a request shares with any other request is the longer of the
+# prefixes it shares with its two neighbors in this order. Requests with the same shared prefix form a group, the
+# groups are executed one after the other (largest first) and the requests of a group by decreasing size.
+########################################################################################################################
+import collections
+import hashlib
+import json
+import logging
+from typing import Callable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+########################################################################################################################
+# API
+########################################################################################################################
+
+
+def group_by_shared_prefix(
+        items: list[T],
+        *,
+        elements: Callable[[T], list],
+        size: Callable[[T], int]
+) -> tuple[list[T], list[int]]:
+    """Order the items so that items with the same prefix are executed together, and find their shared prefixes.
+
+    Args:
+        items: The items, e.g., the pairs of an API helper.
+        elements: Function that returns the prefix elements of an item (see `prefix_elements`).
+        size: Function that returns the size of an item, e.g., its maximum number of tokens.
+
+    Returns:
+        The ordered items and, for each of them, the number of leading elements it shares with another item.
+    """
+    keys = [tuple(_element_hash(element) for element in elements(item)) for item in items]
+    order = sorted(range(len(items)), key=lambda idx: keys[idx])
+    shared = [0] * len(items)
+    for left, right in zip(order, order[1:]):
+        common = _common_prefix_length(keys[left], keys[right])
+        shared[left] = max(shared[left], common)
+        shared[right] = max(shared[right], common)
+
+    # items that share no prefix form groups of their own
+    groups = collections.defaultdict(list)
+    for idx in order:
+        groups[keys[idx][:shared[idx]] if shared[idx] > 0 else ("", idx)].append(idx)
+    sizes = [size(item) for item in items]
+    ordered = []
+    for group in sorted(groups.values(), key=lambda group: sum(sizes[idx] for idx in group), reverse=True):
+        ordered += sorted(group, key=lambda idx: sizes[idx], reverse=True)
+
+    num_shared = sum(1 for idx in ordered if shared[idx] > 1)  # more than the model
+    if num_shared > 0:
+        logger.debug(f"{num_shared} of {len(items)} requests share a prefix with other requests")
+    return [items[idx] for idx in ordered], [shared[idx] for idx in ordered]
+
+
+def prefix_elements(request: dict) -> list:
+    """Split an API request into the elements of its prefix, i.e., the model, tools, system prompt, and messages.
+
+    The first element is always the model, since the providers cache prefixes per model.
+
+    Args:
+        request: The API request.
+
+    Returns:
+        The list of prefix elements.
+    """
+    elements = [{"model": request.get("model")}]
+    for field in ("tools", "system"):  # Anthropic processes the tools and system prompt before the messages
+        if field in request.keys():
+            elements.append({field: request[field]})
+    if "messages" in request.keys():
+        elements += request["messages"]
+    elif "prompt" in request.keys():
+        elements.append(request["prompt"])
+    return elements
+
+
+########################################################################################################################
+# implementation
+########################################################################################################################
+
+
+def _element_hash(element: dict | str) -> str:
+    return hashlib.sha256(bytes(json.dumps(element, sort_keys=True, ensure_ascii=False), "utf-8")).hexdigest()
+
+
+def _common_prefix_length(left: tuple, right: tuple) -> int:
+    length = 0
+    for left_element, right_element in zip(left, right):
+        if left_element != right_element:
+            break
+        length += 1
+    return length
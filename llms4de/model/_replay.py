@@ -0,0 +1,246 @@
+########################################################################################################################
+# Replay API helpers version: 2026-10-18
+#
+# use the following methods:
+# replay_execute(...)      ==> execute API requests against the recorded responses in the caches
+#
+# The API helpers record the wall-clock latency of each executed request in their caches. replay_execute(...) serves
+# the responses from the caches of the OpenAI, Anthropic, and Ollama helpers (depending on the model of each request),
+# but lets each request take as long as it took when it was recorded. Since the requests are scheduled by the same
+# executor and budget states as the OpenAI requests, a replay simulates the wall time of a run under the concurrency
+# limit REPLAY_MAX_RUNNING and the rate limits REPLAY_RPM and REPLAY_TPM without sending any requests, for example to
+# compare scheduling strategies offline:
+# _replay.REPLAY_TPM = 2_000_000
+# responses = execute_requests(requests, "replay")
+#
+# The replay cannot know how the provider would have answered a request that is not in the caches, so all requests must
+# have been executed before. Pairs that were cached before their latency was recorded take no time. The adaptive
+# concurrency limit of the Ollama helper is not simulated.
+########################################################################################################################
+import dataclasses
+import functools
+import logging
+import threading
+import time
+from typing import Callable, Literal
+
+from llms4de.model import _anthropic, _ollama, _openai
+from llms4de.model._cache import open_cache, canonical_hash
+from llms4de.model._executor import execute_pairs, fold_duplicates, fan_out, fan_out_callback, release_method_caches
+from llms4de.model._telemetry import Telemetry
+from llms4de.model.generic import prepare_for_anthropic, prepare_for_ollama
+
+logger = logging.getLogger(__name__)
+
+REPLAY_MAX_RUNNING = 200  # max. num. of parallel requests, like the OpenAI and Anthropic helpers
+REPLAY_RPM: int | None = None  # simulated requests per minute, None for no limit
+REPLAY_TPM: int | None = None  # simulated tokens per minute, None for no limit
+
+
+########################################################################################################################
+# API
+########################################################################################################################
+
+
+def replay_execute(
+        requests: list[dict],
+        *,
+        silent: bool = False,
+        callback: Callable[[int, dict], None] | None = None,
+        stop: threading.Event | None = None
+) -> list[dict]:
+    """Execute a list of requests against the recorded responses and latencies in the caches.
+
+    Args:
+        requests: A list of API requests in the format of `execute_requests`.
+        silent: Whether to display log messages and progress bars.
+        callback: Optional function that receives the index and response of each request as soon as it is available.
+        stop: Optional event after which no more requests are started, e.g., once the responses are no longer needed.
+
+    Returns:
+        A list of API responses.
+    """
+    # create pairs, identical requests share one pair
+    pairs, positions = fold_duplicates(
+        [_Pair(_Request(*_prepare(request))) for request in requests],
+        key=lambda pair: (pair.request.provider, pair.request.hash())
+    )
+    notify = fan_out_callback(callback, positions)
+    position_by_pair = {id(pair): position for position, pair in enumerate(pairs)}
+
+    # load the recorded pairs
+    for provider, cache_path in _cache_paths().items():
+        provider_pairs = [pair for pair in pairs if pair.request.provider == provider]
+        if len(provider_pairs) > 0:
+            cached_pairs = open_cache(cache_path).load_many([pair.request.hash() for pair in provider_pairs])
+            for pair in provider_pairs:
+                pair.request.cached_pair = cached_pairs.get(pair.request.hash())
+    num_missing = sum(1 for pair in pairs if pair.request.cached_pair is None)
+    if num_missing > 0:
+        raise AssertionError(f"{num_missing} of {len(pairs)} requests have no recorded response to replay!")
+    num_without_latency = sum(1 for pair in pairs if "latency" not in pair.request.cached_pair.keys())
+    if num_without_latency > 0:
+        logger.warning(f"{num_without_latency} of {len(pairs)} recorded responses have no latency and take no time")
+
+    def on_done(pair: _Pair) -> None:
+        notify(position_by_pair[id(pair)], pair.response.response)
+
+    before = time.perf_counter()
+    with _openai._ProgressBar(total=len(pairs), desc="replay requests", disable=silent) as progress_bar, \
+            Telemetry("replay") as telemetry:
+        telemetry.on_cache(len(pairs), 0)  # the replay simulates a run without a cache
+        execute_pairs(
+            pairs,
+            context={"num_running": 0},  # every replay starts without any knowledge of the rate limits
+            semaphore=threading.Semaphore(),
+            progress_bar=progress_bar,
+            response_cls=_Response,
+            max_running=REPLAY_MAX_RUNNING,
+            new_budget_state=_new_budget_state,
+            track_cost=True,
+            on_done=on_done,
+            telemetry=telemetry,
+            stop=stop
+        )
+    if not silent:
+        recorded_seconds = sum(pair.request.cached_pair.get("latency", 0) for pair in pairs)
+        logger.info(
+            f"replayed {len(pairs)} requests in {time.perf_counter() - before:.1f} seconds "
+            f"({recorded_seconds:.1f} seconds of recorded latency)"
+        )
+
+    responses = fan_out([pair.response.response for pair in pairs], positions)
+    release_method_caches(_Request, _Response)  # the pairs are no longer needed
+    return responses
+
+
+########################################################################################################################
+# implementation
+########################################################################################################################
+
+
+def _prepare(request: dict) -> tuple[dict, Literal["openai", "anthropic", "ollama"]]:
+    model = request.get("model")
+    if model in _openai.MODEL_PARAMETERS.keys():
+        return request, "openai"
+    elif model in _anthropic.MODEL_PARAMETERS.keys():
+        return prepare_for_anthropic(request), "anthropic"
+    else:
+        return prepare_for_ollama(request), "ollama"
+
+
+def _cache_paths() -> dict:
+    return {"openai": _openai.CACHE_PATH, "anthropic": _anthropic.CACHE_PATH, "ollama": _ollama.OLLAMA_CACHE_PATH}
+
+
+def _new_budget_state() -> _openai._ModelBudgetState:
+    state = _openai._ModelBudgetState.new()
+    state.rpm, state.r = REPLAY_RPM, REPLAY_RPM
+    state.tpm, state.t = REPLAY_TPM, REPLAY_TPM
+    return state
+
+
+def _max_output_tokens(request: dict) -> int | None:
+    for field in ("max_completion_tokens", "max_tokens"):
+        if request.get(field) is not None:
+            return request[field]
+    num_predict = request.get("options", {}).get("num_predict")
+    if num_predict is not None and num_predict >= 0:
+        return num_predict
+    return None
+
+
+class _Request:
+    request: dict
+    provider: Literal["openai", "anthropic", "ollama"]
+    cached_pair: dict | None
+    reserved_usage: int  # number of tokens reserved in the budget while the request is running
+
+    def __init__(self, request: dict, provider: Literal["openai", "anthropic", "ollama"]) -> None:
+        self.request = request
+        self.provider = provider
+        self.cached_pair = None
+        self.reserved_usage = 0
+
+    @functools.cached_property
+    def model(self) -> str:
+        return self.request["model"]
+
+    @functools.cache
+    def hash(self) -> str:
+        return canonical_hash(self.request)
+
+    @functools.cache
+    def max_input_usage(self) -> int:
+        return _Response(self.cached_pair["response"]).input_usage()
+
+    @functools.cache
+    def max_output_usage(self) -> int:  # the helpers reserve the maximum number of output tokens, too
+        max_output_tokens = _max_output_tokens(self.request)
+        if max_output_tokens is None:
+            return _Response(self.cached_pair["response"]).output_usage()
+        return max_output_tokens
+
+    def execute(self) -> "_HTTPResponse":
+        time.sleep(self.cached_pair.get("latency", 0))
+        return _HTTPResponse(self.cached_pair["response"])
+
+
+class _Response:
+    response: dict
+
+    def __init__(self, response: dict) -> None:
+        self.response = response
+
+    @functools.cache
+    def was_successful(self) -> bool:  # only successful responses are cached
+        return True
+
+    @functools.cache
+    def input_usage(self) -> int:
+        if "choices" in self.response.keys():
+            return _openai._Response(self.response).input_usage()
+        elif self.response.get("type") == "message":
+            return _anthropic._Response(self.response).input_usage()
+        else:
+            return _ollama._Response(self.response).input_usage()
+
+    @functools.cache
+    def output_usage(self) -> int:
+        if "choices" in self.response.keys():
+            return _openai._Response(self.response).output_usage()
+        elif self.response.get("type") == "message":
+            return _anthropic._Response(self.response).output_usage()
+        else:
+            return _ollama._Response(self.response).output_usage()
+
+    @functools.cache
+    def total_usage(self) -> int:
+        return self.input_usage() + self.output_usage()
+
+    @functools.cache
+    def total_cost(self) -> float:  # what the run would have cost, the replay itself is free
+        if "choices" in self.response.keys():
+            return _openai._Response(self.response).total_cost()
+        elif self.response.get("type") == "message":
+            return _anthropic._Response(self.response).total_cost()
+        else:
+            return 0
+
+
+@dataclasses.dataclass
+class _HTTPResponse:
+    body: dict
+    status_code: int = 200
+    headers: dict = dataclasses.field(default_factory=dict)
+
+    def json(self) -> dict:
+        return self.body
+
+
+@dataclasses.dataclass
+class _Pair:
+    request: _Request
+    response: _Response | None = None
+    status: Literal["open"] | Literal["running"] | Literal["done"] = "open"
+    latency: float | None = None  # seconds from the start of the last attempt until the response
@@ -0,0 +1,195 @@
+########################################################################################################################
+# Retry helpers version: 2026-10-18
+#
+# use the following methods:
+# is_retryable_status(...) ==> whether a request that failed with the given status code should be retried
+# is_retryable_error(...)  ==> whether a request that raised the given exception should be retried
+# retry_delay(...)         ==> how long to wait before retrying a request
+# ConcurrencyLimit         ==> number of parallel requests that ramps up on success and backs off on rate limits
+#
+# Rate limit errors (429) of APIs with a rate limit budget are expected during normal operation and pause all requests
+# of the model, so they are retried until a request has been attempted MAX_RATE_LIMIT_ATTEMPTS times, which only stops
+# requests that never get through (e.g., with an exhausted quota). Transient server errors and connection errors are
+# retried until a request has been attempted MAX_ATTEMPTS times. The delay honors the `retry-after` header
+# and the rate limit reset headers of the OpenAI and Anthropic APIs and otherwise grows exponentially with jitter.
+#
+# Instead of toggling between sequential and fully parallel execution, the concurrency of a model starts at one and
+# doubles with every round trip (slow start). After a rate limit error, it halves and afterward grows by one per round
+# trip, like the congestion window of TCP.
+########################################################################################################################
+import dataclasses
+import datetime
+import email.utils
+import logging
+import math
+import random
+import re
+import time
+from typing import Any
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5  # attempts per request for transient server and connection errors
+MAX_RATE_LIMIT_ATTEMPTS = 20  # attempts per request for rate limit errors of APIs with a rate limit budget
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504, 529}  # 529 is Anthropic's "overloaded" error
+BACKOFF_BASE = 1.0  # delay before the first retry in seconds
+BACKOFF_MAX = 60.0  # maximum delay without headers in seconds
+JITTER = 0.1  # relative jitter added to delays from headers
+
+_RESET_HEADERS = [  # pairs of remaining and reset headers
+    ("x-ratelimit-remaining-requests", "x-ratelimit-reset-requests"),
+    ("x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens"),
+    ("anthropic-ratelimit-requests-remaining", "anthropic-ratelimit-requests-reset"),
+    ("anthropic-ratelimit-tokens-remaining", "anthropic-ratelimit-tokens-reset"),
+    ("anthropic-ratelimit-input-tokens-remaining", "anthropic-ratelimit-input-tokens-reset"),
+    ("anthropic-ratelimit-output-tokens-remaining", "anthropic-ratelimit-output-tokens-reset")
+]
+
+
+########################################################################################################################
+# API
+########################################################################################################################
+
+
+def is_retryable_status(status_code: int) -> bool:
+    """Determine whether a request that failed with the given status code should be retried.
+
+    Args:
+        status_code: The HTTP status code.
+
+    Returns:
+        Whether the error is transient.
+    """
+    return status_code in RETRY_STATUS_CODES
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Determine whether a request that raised the given exception should be retried.
+
+    Args:
+        error: The exception raised while sending the request.
+
+    Returns:
+        Whether the error is transient.
+    """
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+def retry_delay(attempt: int, headers: dict[str, Any]) -> float:
+    """Compute how long to wait before retrying a request.
+
+    Args:
+        attempt: The number of failed attempts so far, starting at 1.
+        headers: The headers of the failed HTTP response, or an empty dictionary.
+
+    Returns:
+        The delay in seconds.
+    """
+    delay = _delay_from_headers(headers)
+    if delay is not None:
+        return delay * (1 + random.uniform(0, JITTER))
+
+    # capped exponential backoff with "equal jitter" to spread out the retries of many requests
+    cap = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1))
+    return cap / 2 + random.uniform(0, cap / 2)
+
+
+@dataclasses.dataclass
+class ConcurrencyLimit:
+    """Number of parallel requests that ramps up on success and backs off on rate limit errors."""
+    limit: float = 1.0
+    threshold: float = math.inf  # slow start until the limit reaches this threshold
+    last_decrease: float = 0.0
+
+    def allows(self, num_running: int) -> bool:
+        """Determine whether another request may start.
+
+        Args:
+            num_running: The number of running requests.
+
+        Returns:
+            Whether the number of running requests is below the limit.
+        """
+        return num_running < int(self.limit)
+
+    def on_success(self, max_limit: float) -> None:
+        """Increase the limit after a successful request.
+
+        Args:
+            max_limit: The maximum limit.
+        """
+        if self.limit < self.threshold:
+            self.limit += 1  # doubles the limit with every round trip
+        else:
+            self.limit += 1 / self.limit  # increases the limit by one with every round trip
+        self.limit = min(self.limit, max_limit)
+
+    def on_rate_limit(self, started_at: float) -> None:
+        """Halve the limit after a rate limit error.
+
+        Args:
+            started_at: When the failed request was started, only one of the requests running at the time of the last
+                decrease may decrease the limit again.
+        """
+        if started_at < self.last_decrease:
+            return
+        self.limit = max(1.0, self.limit / 2)
+        self.threshold = self.limit
+        self.last_decrease = time.time()
+        logger.debug(f"rate limit error -> decrease concurrency to {int(self.limit)}")
+
+
+########################################################################################################################
+# implementation
+########################################################################################################################
+
+
+def _delay_from_headers(headers: dict[str, Any]) -> float | None:
+    if "retry-after-ms" in headers.keys():
+        try:
+            return max(0.0, float(headers["retry-after-ms"]) / 1000)
+        except ValueError:
+            pass
+    if "retry-after" in headers.keys():
+        delay = _parse_seconds_or_date(headers["retry-after"])
+        if delay is not None:
+            return delay
+
+    # the reset headers of the exhausted limits determine when the next request can succeed
+    delays = []
+    for remaining_header, reset_header in _RESET_HEADERS:
+        if reset_header in headers.keys() and remaining_header in headers.keys():
+            try:
+                is_exhausted = float(headers[remaining_header]) <= 0
+            except ValueError:
+                is_exhausted = False
+            if is_exhausted:
+                delay = _parse_duration_or_timestamp(headers[reset_header])
+                if delay is not None:
+                    delays.append(delay)
+    return max(delays) if len(delays) > 0 else None
+
+
+def _parse_seconds_or_date(value: str) -> float | None:
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_duration_or_timestamp(value: str) -> float | None:
+    # OpenAI sends durations like "6m0s" or "20ms", Anthropic sends RFC 3339 timestamps
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if len(parts) > 0 and "".join(number + unit for number, unit in parts) == value:
+        factors = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+        return sum(float(number) * factors[unit] for number, unit in parts)
+    try:
+        return max(0.0, datetime.datetime.fromisoformat(value).timestamp() - time.time())
+    except ValueError:
+        return _parse_seconds_or_date(value)
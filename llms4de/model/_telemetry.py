@@ -0,0 +1,405 @@
+########################################################################################################################
+# Telemetry helpers version: 2026-10-18
+#
+# use the following methods:
+# Telemetry(...)           ==> telemetry of one run of an API helper, optionally written to TELEMETRY_PATH as JSON
+# prometheus_text()        ==> render the telemetry of all runs of this process in the Prometheus text format
+# serve_prometheus(...)    ==> serve prometheus_text() on http://<host>:<port>/metrics in a background thread
+#
+# The API helpers record each run in a Telemetry object, which the executor updates while it schedules the requests:
+# - the time spent in each bottleneck state per model (see below)
+# - the latency histogram of the successful requests per model (LATENCY_BUCKETS)
+# - the input and output tokens per model and thus the tokens per second
+# - the remaining rate limit budgets and the concurrency limit per model over time
+# - the number of requests and the number of cached requests (cache hit ratio)
+# - the number of retries per model and reason (status code or exception)
+# - the cost over time
+# The budgets and the cost are sampled at most every TELEMETRY_SAMPLE_INTERVAL seconds. Writing one JSON file per run is
+# opt-in, since a run happens for every call of an API helper (e.g., for every window of `execute_requests_iter`):
+# _telemetry.TELEMETRY_PATH = get_data_path() / "telemetry"
+# Runs that are entirely served from the cache are not written.
+#
+# The bottleneck states correspond to the letters of the progress bar:
+# starting (P)          ==> the executor is starting requests, nothing limits the run
+# max_running (T)       ==> the maximum number of parallel requests (threads) is running
+# concurrency (S)       ==> the concurrency limit (slow start or back off after rate limit errors) is reached
+# requests_per_minute (L), tokens_per_minute (L) ==> the rate limit budget is exhausted
+# rate_limit_pause (L)  ==> the model is paused after a rate limit error
+# stragglers (Z)        ==> all requests have started, the run waits for the last responses
+# cost_limit (C)        ==> the cost governor waits for reservations or the next day (see _governor.py)
+# A run that spends its time in `max_running`, `concurrency`, or `stragglers` waits for the provider, a run that spends
+# it in the rate limit states waits for its budget.
+#
+# To scrape the telemetry with Prometheus while the runs are in progress, start the endpoint once per process:
+# serve_prometheus(port=9464)
+########################################################################################################################
+import collections
+import http.server
+import itertools
+import json
+import logging
+import math
+import os
+import pathlib
+import threading
+import time
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_PATH: pathlib.Path | None = None  # directory for one JSON file per run, None to not write the runs
+TELEMETRY_SAMPLE_INTERVAL = 1.0  # seconds between the samples of the budget states and the cost
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, math.inf]  # upper bounds in seconds
+
+
+########################################################################################################################
+# API
+########################################################################################################################
+
+
+class Telemetry:
+    """Telemetry of one run of an API helper."""
+    api_name: str
+
+    def __init__(self, api_name: str) -> None:
+        """Start the telemetry of a run.
+
+        Args:
+            api_name: The name of the API, which is part of the file name.
+        """
+        self.api_name = api_name
+        self.started_at = time.time()
+        self.ended_at = None
+        self.num_requests = 0
+        self.num_cached = 0
+        self.cost = 0.0
+        self.bottleneck_seconds = collections.defaultdict(collections.Counter)  # model ==> bottleneck ==> seconds
+        self.latency_buckets = collections.defaultdict(lambda: [0] * len(LATENCY_BUCKETS))  # model ==> counts
+        self.latency_sum = collections.Counter()  # model ==> seconds
+        self.num_responses = collections.Counter()  # model ==> number of successful responses
+        self.num_failed = collections.Counter()  # model ==> number of failed requests
+        self.input_tokens = collections.Counter()
+        self.output_tokens = collections.Counter()
+        self.retries = collections.defaultdict(collections.Counter)  # model ==> reason ==> number of retries
+        self.budgets = collections.defaultdict(list)  # model ==> samples of the budget state
+        self.costs = []  # samples of the cost
+        self._bottleneck = None  # current model, bottleneck, and since when
+        self._last_sample_at = {}  # model or "cost" ==> time of the last sample
+        with _lock:
+            _active.add(self)
+
+    def __enter__(self) -> "Telemetry":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.end()
+
+    def on_cache(self, num_requests: int, num_cached: int) -> None:
+        """Record how many requests were served from the cache.
+
+        Args:
+            num_requests: The number of unique requests of the run.
+            num_cached: The number of requests that were served from the cache.
+        """
+        with _lock:
+            for telemetry in (self, _process_telemetry):
+                telemetry.num_requests += num_requests
+                telemetry.num_cached += num_cached
+
+    def on_bottleneck(self, model: str | None, bottleneck: str) -> None:
+        """Record that the run is now limited by the given bottleneck.
+
+        Args:
+            model: The model of the next request, None if unknown.
+            bottleneck: The bottleneck state, e.g., "tokens_per_minute".
+        """
+        now = time.time()
+        with _lock:
+            if self._bottleneck is not None:
+                if self._bottleneck[:2] == (model, bottleneck):
+                    return
+                self._close_bottleneck(now)
+            self._bottleneck = (model, bottleneck, now)
+
+    def on_response(self, model: str, latency: float | None, response: Any) -> None:
+        """Record the final response of a request.
+
+        Args:
+            model: The model of the request.
+            latency: The latency of the successful request, None if it failed.
+            response: The response object, whose `input_usage()` and `output_usage()` are counted if it provides them.
+        """
+        input_tokens = response.input_usage() if hasattr(response, "input_usage") else 0
+        output_tokens = response.output_usage() if hasattr(response, "output_usage") else 0
+        with _lock:
+            for telemetry in (self, _process_telemetry):
+                if latency is None:
+                    telemetry.num_failed[model] += 1
+                else:
+                    telemetry.num_responses[model] += 1
+                    telemetry.latency_sum[model] += latency
+                    bucket = next(idx for idx, bound in enumerate(LATENCY_BUCKETS) if latency <= bound)
+                    telemetry.latency_buckets[model][bucket] += 1
+                telemetry.input_tokens[model] += input_tokens
+                telemetry.output_tokens[model] += output_tokens
+
+    def on_retry(self, model: str, reason: str) -> None:
+        """Record the retry of a request.
+
+        Args:
+            model: The model of the request.
+            reason: Why the request is retried, e.g., "status 429".
+        """
+        with _lock:
+            for telemetry in (self, _process_telemetry):
+                telemetry.retries[model][reason] += 1
+
+    def on_cost(self, cost: float) -> None:
+        """Record the cost of a response.
+
+        Args:
+            cost: The cost in USD.
+        """
+        now = time.time()
+        with _lock:
+            for telemetry in (self, _process_telemetry):
+                telemetry.cost += cost
+            if now - self._last_sample_at.get("cost", -math.inf) >= TELEMETRY_SAMPLE_INTERVAL:
+                self._last_sample_at["cost"] = now
+                self.costs.append({"seconds": now - self.started_at, "cost": self.cost})
+
+    def on_budget(self, model: str, state: Any) -> None:
+        """Sample the budget state of a model.
+
+        Args:
+            model: The model.
+            state: The budget state of the API helper, whose numerical fields are sampled.
+        """
+        now = time.time()
+        if now - self._last_sample_at.get(model, -math.inf) < TELEMETRY_SAMPLE_INTERVAL:
+            return
+        sample = {"seconds": now - self.started_at, **_budget_fields(state)}
+        with _lock:
+            self._last_sample_at[model] = now
+            self.budgets[model].append(sample)
+            _process_telemetry.budgets[model] = [sample]  # Prometheus only shows the current values
+
+    def end(self) -> dict:
+        """End the run, write the telemetry to TELEMETRY_PATH if it is set, and return it.
+
+        Returns:
+            The telemetry as a JSON-serializable dictionary.
+        """
+        now = time.time()
+        with _lock:
+            if self._bottleneck is not None:
+                self._close_bottleneck(now)
+                self._bottleneck = None
+            _active.discard(self)
+            if self.ended_at is not None:
+                return self.to_json()
+            self.ended_at = now
+            if len(self.costs) == 0 or self.costs[-1]["cost"] != self.cost:
+                self.costs.append({"seconds": now - self.started_at, "cost": self.cost})
+            record = self.to_json()
+
+        if TELEMETRY_PATH is not None and self.num_requests > self.num_cached:  # skip runs that only hit the cache
+            TELEMETRY_PATH.mkdir(parents=True, exist_ok=True)
+            timestamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started_at))
+            path = TELEMETRY_PATH / f"{self.api_name}-{timestamp}-{os.getpid()}-{next(_run_ids)}.json"
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(record, file, indent=2)
+            logger.debug(f"wrote telemetry to {path}")
+        return record
+
+    def to_json(self) -> dict:
+        """Convert the telemetry to a JSON-serializable dictionary.
+
+        Returns:
+            The telemetry.
+        """
+        seconds = max((self.ended_at or time.time()) - self.started_at, 1e-9)
+        models = sorted(set(self.bottleneck_seconds.keys()) | set(self.num_responses.keys())
+                        | set(self.num_failed.keys()) | set(self.retries.keys()) | set(self.budgets.keys()), key=str)
+        return {
+            "api_name": self.api_name,
+            "started_at": self.started_at,
+            "seconds": seconds,
+            "num_requests": self.num_requests,
+            "num_cached": self.num_cached,
+            "cache_hit_ratio": self.num_cached / self.num_requests if self.num_requests > 0 else None,
+            "cost": self.cost,
+            "costs": self.costs,
+            "models": {
+                str(model): {
+                    "bottleneck_seconds": dict(self.bottleneck_seconds[model]),
+                    "num_responses": self.num_responses[model],
+                    "num_failed": self.num_failed[model],
+                    "num_retries": dict(self.retries[model]),
+                    "latency_buckets": dict(zip(map(_format_bound, LATENCY_BUCKETS), self.latency_buckets[model])),
+                    "latency_sum": self.latency_sum[model],
+                    "input_tokens": self.input_tokens[model],
+                    "output_tokens": self.output_tokens[model],
+                    "input_tokens_per_second": self.input_tokens[model] / seconds,
+                    "output_tokens_per_second": self.output_tokens[model] / seconds,
+                    "budgets": self.budgets[model]
+                } for model in models
+            }
+        }
+
+    def _close_bottleneck(self, now: float) -> None:
+        """Account for the time spent in the current bottleneck state, requires the lock."""
+        model, bottleneck, since = self._bottleneck
+        for telemetry in (self, _process_telemetry):
+            telemetry.bottleneck_seconds[model][bottleneck] += now - since
+
+
+def prometheus_text() -> str:
+    """Render the telemetry of all runs of this process in the Prometheus text format.
+
+    Returns:
+        The metrics, all counters accumulate over the runs of this process.
+    """
+    now = time.time()
+    with _lock:
+        telemetry = _process_telemetry
+        bottleneck_seconds = collections.defaultdict(collections.Counter)
+        for model, seconds in telemetry.bottleneck_seconds.items():
+            bottleneck_seconds[model].update(seconds)
+        for active in _active:  # include the time in the current bottleneck states
+            if active._bottleneck is not None:
+                model, bottleneck, since = active._bottleneck
+                bottleneck_seconds[model][bottleneck] += now - since
+
+        lines = [
+            "# HELP llms4de_requests_total Unique requests of the API helpers.",
+            "# TYPE llms4de_requests_total counter",
+            f"llms4de_requests_total {telemetry.num_requests}",
+            "# HELP llms4de_cached_requests_total Requests served from the caches.",
+            "# TYPE llms4de_cached_requests_total counter",
+            f"llms4de_cached_requests_total {telemetry.num_cached}",
+            "# HELP llms4de_cost_usd_total Cost of the responses in USD.",
+            "# TYPE llms4de_cost_usd_total counter",
+            f"llms4de_cost_usd_total {telemetry.cost}",
+            "# HELP llms4de_bottleneck_seconds_total Time spent in each bottleneck state.",
+            "# TYPE llms4de_bottleneck_seconds_total counter"
+        ]
+        for model, seconds in bottleneck_seconds.items():
+            for bottleneck, value in seconds.items():
+                lines.append(f"llms4de_bottleneck_seconds_total{_labels(model=model, bottleneck=bottleneck)} {value}")
+
+        lines += [
+            "# HELP llms4de_request_latency_seconds Latency of the successful requests.",
+            "# TYPE llms4de_request_latency_seconds histogram"
+        ]
+        for model, counts in telemetry.latency_buckets.items():
+            for bound, count in zip(LATENCY_BUCKETS, itertools.accumulate(counts)):
+                labels = _labels(model=model, le=_format_bound(bound))
+                lines.append(f"llms4de_request_latency_seconds_bucket{labels} {count}")
+            lines.append(f"llms4de_request_latency_seconds_sum{_labels(model=model)} {telemetry.latency_sum[model]}")
+            lines.append(f"llms4de_request_latency_seconds_count{_labels(model=model)} {sum(counts)}")
+
+        lines += [
+            "# HELP llms4de_failed_requests_total Requests that failed after all retries.",
+            "# TYPE llms4de_failed_requests_total counter"
+        ]
+        for model, count in telemetry.num_failed.items():
+            lines.append(f"llms4de_failed_requests_total{_labels(model=model)} {count}")
+
+        lines += [
+            "# HELP llms4de_tokens_total Input and output tokens of the responses.",
+            "# TYPE llms4de_tokens_total counter"
+        ]
+        for direction, tokens in (("input", telemetry.input_tokens), ("output", telemetry.output_tokens)):
+            for model, count in tokens.items():
+                lines.append(f"llms4de_tokens_total{_labels(model=model, direction=direction)} {count}")
+
+        lines += [
+            "# HELP llms4de_retries_total Retries of requests.",
+            "# TYPE llms4de_retries_total counter"
+        ]
+        for model, reasons in telemetry.retries.items():
+            for reason, count in reasons.items():
+                lines.append(f"llms4de_retries_total{_labels(model=model, reason=reason)} {count}")
+
+        lines += [
+            "# HELP llms4de_budget Current rate limit budget state (e.g., remaining requests `r` and tokens `t`).",
+            "# TYPE llms4de_budget gauge"
+        ]
+        for model, samples in telemetry.budgets.items():
+            for field, value in samples[-1].items():
+                if field != "seconds" and value is not None:
+                    lines.append(f"llms4de_budget{_labels(model=model, field=field)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def serve_prometheus(*, host: str = "127.0.0.1", port: int = 9464) -> http.server.ThreadingHTTPServer:
+    """Serve prometheus_text() on http://<host>:<port>/metrics in a background thread.
+
+    Args:
+        host: The address to listen on.
+        port: The port to listen on, 0 to choose a free port.
+
+    Returns:
+        The server, call `shutdown()` to stop it.
+    """
+    server = _HTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"serve telemetry on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+########################################################################################################################
+# implementation
+########################################################################################################################
+
+_lock = threading.Lock()
+_active = set()  # runs that have not ended yet
+_run_ids = itertools.count()
+
+
+def _budget_fields(state: Any) -> dict:
+    fields = {
+        field: value for field, value in vars(state).items()
+        if field not in ("last_update", "retry_at") and (value is None or isinstance(value, (int, float)))
+    }
+    if hasattr(state, "concurrency"):
+        fields["concurrency"] = state.concurrency.limit
+    return fields
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if math.isinf(bound) else str(bound)
+
+
+def _labels(**labels: Any) -> str:
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _HTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self) -> None:
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        data = bytes(prometheus_text(), "utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format % args)
+
+
+_process_telemetry = Telemetry("process")  # accumulates all runs for Prometheus
+_active.discard(_process_telemetry)
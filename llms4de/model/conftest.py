@@ -0,0 +1,81 @@
+import logging
+
+import pytest
+
+from llms4de.model import _anthropic, _batch, _governor, _ollama, _openai, _telemetry
+from llms4de.model._http import close_connections
+from llms4de.model._mock_server import MockServer
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+
+    tiktoken.encoding_for_model("gpt-4o-mini-2024-07-18")
+    tiktoken_available = True
+except Exception:
+    tiktoken_available = False
+
+
+class FakeResponse:
+
+    def __init__(self, response: dict) -> None:
+        self.response = response
+
+    def total_cost(self) -> float:
+        return self.response.get("cost", 0)
+
+    def was_successful(self) -> bool:
+        return "usage" in self.response.keys()
+
+    def input_usage(self) -> int:
+        return self.total_usage() - self.output_usage()
+
+    def output_usage(self) -> int:
+        return self.response.get("output_usage", self.total_usage() // 2)
+
+    def total_usage(self) -> int:
+        return self.response.get("usage", 0)
+
+
+def mock_requests(model: str) -> list[dict]:
+    return [
+        {
+            "model": model,
+            "max_tokens": 10,
+            "temperature": 0,
+            "messages": [{"role": "user", "content": f"Name all prime numbers below {idx}!"}],
+            "seed": 321164097
+        } for idx in range(10)
+    ]
+
+
+@pytest.fixture(autouse=True)
+def _redirect_telemetry(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(_telemetry, "TELEMETRY_PATH", tmp_path / "telemetry")
+
+
+@pytest.fixture
+def mock_server(tmp_path, monkeypatch) -> MockServer:
+    monkeypatch.setattr(_openai, "CACHE_PATH", tmp_path / "openai_cache")
+    monkeypatch.setattr(_anthropic, "CACHE_PATH", tmp_path / "anthropic_cache")
+    monkeypatch.setattr(_ollama, "OLLAMA_CACHE_PATH", tmp_path / "ollama_cache")
+    monkeypatch.setattr(_openai, "RATE_LIMITS_PATH", tmp_path / "openai_rate_limits")
+    monkeypatch.setattr(_anthropic, "RATE_LIMITS_PATH", tmp_path / "anthropic_rate_limits")
+    monkeypatch.setattr(_openai, "BATCHES_PATH", tmp_path / "openai_batches")
+    monkeypatch.setattr(_anthropic, "BATCHES_PATH", tmp_path / "anthropic_batches")
+    monkeypatch.setattr(_batch, "BATCH_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(_governor, "COST_LEDGER_PATH", tmp_path / "cost_ledger.json")
+    monkeypatch.setattr(_openai, "_local_context", {})
+    monkeypatch.setattr(_anthropic, "_local_context", {})
+    monkeypatch.setattr(_ollama, "_local_context", {})
+    monkeypatch.setattr(_ollama, "_host_pool", None)
+    monkeypatch.setenv("OPENAI_API_KEY", "mock")
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "mock")
+    close_connections()
+    with MockServer() as server:
+        monkeypatch.setattr(_openai, "BASE_URL", f"{server.url}/v1")
+        monkeypatch.setattr(_anthropic, "BASE_URL", f"{server.url}/v1")
+        monkeypatch.setattr(_ollama, "OLLAMA_URL", server.url)
+        yield server
+    close_connections()
@@ -1,11 +1,13 @@
 import copy
 import logging
 import os
+import queue
+import threading
 import time
-from typing import Literal
-
-import requests
+from typing import Callable, Iterable, Iterator, Literal
 
+from llms4de.model._http import http_post
+from llms4de.model._governor import CostGovernor
 from llms4de.model._openai import openai_model
 
 logger = logging.getLogger(__name__)
@@ -14,6 +16,16 @@ FORCE: float | None = 0.01
 
 HF_TOKENIZER_CACHE: dict = {}
 
+# Ollama allocates the KV cache for `num_ctx` tokens, so with buckets, the context is sized per request as the prompt
+# tokens plus `num_predict`, rounded up to one of few sizes so that Ollama can reuse loaded contexts. Since `num_ctx` is
+# part of the request, the buckets change the cache keys, so they are off by default (None always uses the largest
+# context) to keep the responses cached by earlier runs, e.g., for reproduce.sh. To enable them:
+# generic.OLLAMA_NUM_CTX_BUCKETS = generic.OLLAMA_ADAPTIVE_NUM_CTX_BUCKETS
+OLLAMA_ADAPTIVE_NUM_CTX_BUCKETS = [2_048, 4_096, 8_192, 16_384, 32_768, 65_536, 128_000]
+OLLAMA_NUM_CTX_BUCKETS: list[int] | None = None
+OLLAMA_MAX_NUM_CTX = 128_000
+OLLAMA_TOKENS_PER_MESSAGE = 8  # tokens of the chat template per message (header and end-of-turn tokens)
+
 
 def prepare_for_anthropic(request: dict) -> dict:
     """Prepare Anthropic API request.
@@ -87,7 +99,7 @@ def prepare_for_ollama(request: dict) -> dict:
 
     if "options" not in request.keys():
         request["options"] = {}
-    request["options"]["num_ctx"] = 128_000
+    request["options"]["num_ctx"] = _ollama_num_ctx(request)
 
     return request
 
@@ -124,8 +136,8 @@ def num_tokens(
 
             while True:
                 before = time.time()
-                http_response = requests.post(
-                    url="https://api.anthropic.com/v1/messages/count_tokens",
+                http_response = http_post(
+                    url=f"{_anthropic.BASE_URL}/messages/count_tokens",
                     json={
                         "model": model,
                         "messages": [{"role": "user", "content": text}]
@@ -203,38 +215,170 @@ def execute_requests(
         requests: list[dict],
         api_name: str,
         *,
-        force: float | None | Literal["default"] = "default"
+        force: float | None | Literal["default"] = "default",
+        callback: Callable[[int, dict], None] | None = None,
+        mode: Literal["online"] | Literal["batch"] = "online",
+        hedge_percentile: float | None = None,
+        governor: CostGovernor | None = None,
+        stop: threading.Event | None = None
 ) -> list[dict]:
     """Execute the list of requests against the specified API.
 
     Args:
         requests: The list of API requests.
         api_name: The name of the API.
+        callback: Optional function that receives the index and response of each request as soon as it is available.
+        mode: Whether to execute the requests one by one ("online") or through the batch API of OpenAI or Anthropic
+            ("batch"), which is cheaper but may take up to 24 hours.
+        hedge_percentile: Optional latency percentile (e.g., 0.95) after which to send a duplicate of a request with
+            `temperature` 0 to OpenAI or Anthropic, None to disable hedging.
+        governor: Optional cost governor that limits the actual cost of OpenAI or Anthropic requests instead of asking
+            for confirmation.
+        stop: Optional event after which no more requests are started (except for batches and AI Core), the running
+            requests finish and then an AssertionError is raised.
 
     Returns:
         The list of API responses.
     """
     if force == "default":
         force = FORCE
+    if mode not in ("online", "batch"):
+        raise AssertionError(f"unknown mode `{mode}`")
+    if mode == "batch" and api_name not in ("openai", "anthropic"):
+        raise AssertionError(f"api_name `{api_name}` does not support batch mode")
+    if hedge_percentile is not None and api_name not in ("openai", "anthropic"):
+        raise AssertionError(f"api_name `{api_name}` does not support hedged requests")
+    if governor is not None and api_name == "aicore":
+        raise AssertionError(f"api_name `{api_name}` does not support a cost governor")
     match api_name:
         case "openai":
             from llms4de.model import _openai
-            return _openai.openai_execute(requests, force=force)
+            return _openai.openai_execute(
+                requests,
+                force=force,
+                callback=callback,
+                mode=mode,
+                hedge_percentile=hedge_percentile,
+                governor=governor,
+                stop=stop
+            )
         case "anthropic":
             from llms4de.model import _anthropic
             requests = [prepare_for_anthropic(request) for request in requests]
-            return _anthropic.anthropic_execute(requests, force=force)
+            return _anthropic.anthropic_execute(
+                requests,
+                force=force,
+                callback=callback,
+                mode=mode,
+                hedge_percentile=hedge_percentile,
+                governor=governor,
+                stop=stop
+            )
         case "ollama":
             from llms4de.model import _ollama
             requests = [prepare_for_ollama(request) for request in requests]
-            return _ollama.ollama_execute(requests)
+            return _ollama.ollama_execute(requests, callback=callback, stop=stop)  # free, so no governor is necessary
         case "aicore":
             from llms4de.model import _aicore
-            return _aicore.aicore_execute(requests, force=force)
+            responses = _aicore.aicore_execute(requests, force=force)
+            if callback is not None:  # the AI Core helper returns all responses at once
+                for idx, response in enumerate(responses):
+                    callback(idx, response)
+            return responses
+        case "replay":  # serve the recorded responses with their recorded latencies, see _replay.py
+            from llms4de.model import _replay
+            return _replay.replay_execute(requests, callback=callback, stop=stop)
         case _:
             raise AssertionError(f"unknown api_name `{api_name}`")
 
 
+def execute_requests_iter(
+        requests: Iterable[dict],
+        api_name: str,
+        *,
+        force: float | None | Literal["default"] = "default",
+        window_size: int | None = None,
+        mode: Literal["online"] | Literal["batch"] = "online",
+        hedge_percentile: float | None = None,
+        governor: CostGovernor | None = None
+) -> Iterator[tuple[int, dict]]:
+    """Execute the requests against the specified API and yield the responses as soon as they are available.
+
+    Cached responses are yielded first, the other responses in the order in which their requests finish. With a
+    `window_size`, the requests are consumed and executed in windows, so that only the requests and responses of one
+    window are kept in memory. The next window starts once all responses of the current window have been consumed. The
+    rate limit state of the APIs persists across windows, but each window is executed by a separate call of
+    `execute_requests`: duplicate requests are only folded and shared prefixes only grouped within a window, and
+    without a `governor`, each window whose maximum cost exceeds `force` asks for confirmation once the previous
+    window has finished, so unattended runs should use a governor or a `force` that covers one window. If the consumer
+    stops iterating (e.g., with `break` or an exception), no more requests are started and no more windows executed.
+
+    Args:
+        requests: The API requests, which may be a lazy iterable if `window_size` is given.
+        api_name: The name of the API.
+        window_size: Optional number of requests to execute at once, None to execute all requests at once.
+        mode: Whether to execute the requests one by one ("online") or through the batch API ("batch").
+        hedge_percentile: Optional latency percentile after which to send a duplicate of a deterministic request.
+        governor: Optional cost governor, whose run limit applies to all windows together.
+
+    Yields:
+        The index of each request and its API response.
+    """
+    results = queue.Queue()
+    done = object()
+    window_done = object()
+    consumed = threading.Event()  # all responses of the current window have been consumed
+    stop = threading.Event()  # the consumer no longer iterates
+
+    def execute() -> None:
+        try:
+            offset = 0
+            for window in _windows(requests, window_size):
+                def put(idx: int, response: dict) -> None:
+                    results.put((offset + idx, response))
+
+                execute_requests(
+                    window,
+                    api_name,
+                    force=force,
+                    callback=put,
+                    mode=mode,
+                    hedge_percentile=hedge_percentile,
+                    governor=governor,
+                    stop=stop
+                )
+                offset += len(window)
+                consumed.clear()
+                if stop.is_set():
+                    return
+                results.put(window_done)
+                consumed.wait()  # wait until the responses have been consumed to bound the memory consumption
+                if stop.is_set():
+                    return
+            results.put(done)
+        except BaseException as e:
+            results.put(e)
+
+    # a daemon thread does not block the exit of the process, e.g., on Ctrl-C
+    thread = threading.Thread(target=execute, name="execute_requests_iter", daemon=True)
+    thread.start()
+    try:
+        while True:
+            result = results.get()
+            if result is done:
+                break
+            elif result is window_done:
+                consumed.set()
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                yield result
+    finally:  # also if the consumer stops iterating early, e.g., with `break`
+        stop.set()
+        consumed.set()
+    thread.join()
+
+
 def extract_text_from_response(response: dict) -> str | None:
     """Extract the text from an API response.
 
@@ -307,3 +451,36 @@ def compute_cost_for_response(response: dict) -> float:
     else:
         logger.warning(f"unknown response, count as cost=0 `{response}`")
         return 0
+
+
+def _ollama_num_ctx(request: dict) -> int:
+    num_predict = request["options"].get("num_predict")
+    if OLLAMA_NUM_CTX_BUCKETS is None or num_predict is None or num_predict < 0:
+        return OLLAMA_MAX_NUM_CTX  # without `num_predict`, the generation may fill the whole context
+
+    # each token covers at least one byte, so the UTF-8 length bounds the number of tokens on every machine, while a
+    # tokenizer would depend on the environment (e.g., `HF_TOKEN`) and thereby change the cache keys between machines
+    num_prompt_tokens = 0
+    for message in request.get("messages", []):
+        if isinstance(message.get("content"), str):
+            num_prompt_tokens += len(bytes(message["content"], "utf-8"))
+    num_prompt_tokens += OLLAMA_TOKENS_PER_MESSAGE * (len(request.get("messages", [])) + 1)
+
+    for num_ctx in OLLAMA_NUM_CTX_BUCKETS:
+        if num_prompt_tokens + num_predict <= num_ctx:
+            return num_ctx
+    return OLLAMA_MAX_NUM_CTX
+
+
+def _windows(requests: Iterable[dict], window_size: int | None) -> Iterator[list[dict]]:
+    if window_size is None:
+        yield list(requests)
+        return
+    window = []
+    for request in requests:
+        window.append(request)
+        if len(window) == window_size:
+            yield window
+            window = []
+    if len(window) > 0:
+        yield window
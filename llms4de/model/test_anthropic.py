@@ -0,0 +1,80 @@
+import json
+import logging
+
+import pytest
+
+from llms4de.model import _anthropic, _governor
+from llms4de.model._budget import SharedContext
+from llms4de.model._governor import CostGovernor
+from llms4de.model._mock_server import MockServer, MOCK_RESPONSE_TEXT
+from llms4de.model.conftest import mock_requests
+from llms4de.model.generic import execute_requests, extract_text_from_response
+
+logger = logging.getLogger(__name__)
+
+
+def test_anthropic_execute_with_shared_context(mock_server: MockServer, tmp_path) -> None:
+    context = SharedContext(tmp_path / "anthropic.context")
+    requests = mock_requests("claude-3-5-haiku-20241022")
+    responses = _anthropic.anthropic_execute(requests, force=1.0, global_context=context, global_semaphore=context.lock)
+    assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 10
+
+    with context.lock:
+        assert context["num_running"] == 0
+        assert context["claude-3-5-haiku-20241022"].num_running == 0
+
+    with pytest.raises(AssertionError):
+        _anthropic.anthropic_execute(requests, force=1.0, global_context=context)
+
+
+def test_anthropic_execute_with_governor(mock_server: MockServer, monkeypatch) -> None:
+    def no_input() -> None:
+        raise AssertionError("a run with a cost governor must not ask for confirmation")
+
+    monkeypatch.setattr("builtins.input", no_input)
+    governor = CostGovernor(max_cost_per_run=1.0, max_cost_per_day=1.0)
+    responses = _anthropic.anthropic_execute(mock_requests("claude-3-5-haiku-20241022"), governor=governor)
+    assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 10
+    assert 0 < governor.run_cost < 1.0 and governor.run_reserved == 0
+
+    with open(_governor.COST_LEDGER_PATH, "r", encoding="utf-8") as file:
+        ledger = json.load(file)
+    assert sum(ledger["costs"].values()) == pytest.approx(governor.run_cost)
+    assert sum(ledger["reserved"].values()) == 0
+
+    # the run limit leaves no room for the requests ==> stop before sending any of them
+    num_requests = mock_server.num_requests
+    requests = [{**request, "temperature": 1} for request in mock_requests("claude-3-5-haiku-20241022")]
+    with pytest.raises(AssertionError, match="max_cost_per_run"):
+        _anthropic.anthropic_execute(requests, governor=CostGovernor(max_cost_per_run=0.0))
+    assert mock_server.num_requests - num_requests == 10  # only token counting
+
+
+def test_anthropic_execute_starts_with_learned_concurrency(mock_server: MockServer, monkeypatch) -> None:
+    model = "claude-3-5-haiku-20241022"
+    _anthropic.anthropic_execute(mock_requests(model), force=1.0)
+    limit = _anthropic._local_context[model].concurrency.limit
+    assert limit > 1
+
+    # the next run (e.g., another process) restores the learned state instead of starting sequentially
+    monkeypatch.setattr(_anthropic, "_local_context", {"num_running": 0})
+    _anthropic.anthropic_execute([{**request, "seed": 0} for request in mock_requests(model)], force=1.0)
+    assert _anthropic._local_context[model].concurrency.limit > limit
+
+
+def test_anthropic_caches_shared_prefixes(mock_server: MockServer, caplog) -> None:
+    instructions = "Predict the column types. " * 1_000  # long enough to be cached
+    requests = [
+        {**request, "messages": [{"role": "user", "content": instructions}] + request["messages"]}
+        for request in mock_requests("claude-3-5-haiku-20241022")
+    ]
+    with caplog.at_level(logging.INFO):
+        responses = execute_requests(requests, "anthropic", force=1.0)
+    cache_reads = [response["usage"]["cache_read_input_tokens"] for response in responses]
+    assert sum(1 for num_tokens in cache_reads if num_tokens > 0) >= 8  # all requests after the first ones
+    assert any("input tokens:" in record.message and "uncached" in record.message for record in caplog.records)
+
+    # the breakpoints do not change the cache keys
+    num_requests = mock_server.num_requests
+    execute_requests(requests, "anthropic", force=1.0)
+    assert mock_server.num_requests == num_requests
@@ -0,0 +1,98 @@
+import logging
+
+import pytest
+
+from llms4de.model import _anthropic, _openai
+from llms4de.model._governor import CostGovernor
+from llms4de.model._mock_server import MockServer, MOCK_RESPONSE_TEXT
+from llms4de.model.conftest import mock_requests, tiktoken_available
+from llms4de.model.generic import execute_requests, extract_text_from_response, prepare_for_anthropic
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.mark.parametrize("model,api_name", [
+    pytest.param(
+        "gpt-4o-mini-2024-07-18", "openai",
+        marks=pytest.mark.xfail(not tiktoken_available, reason="cannot execute without tiktoken encodings")
+    ),
+    ("claude-3-5-haiku-20241022", "anthropic")
+])
+def test_execute_requests_in_batch_mode(model: str, api_name: str, mock_server: MockServer, monkeypatch) -> None:
+    monkeypatch.setattr(_openai, "BATCH_MAX_REQUESTS", 4)
+    monkeypatch.setattr(_anthropic, "BATCH_MAX_REQUESTS", 4)
+    mock_server.batch_latency = 0.05
+    responses = execute_requests(mock_requests(model), api_name, force=1.0, mode="batch")
+    assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 10
+    assert mock_server.num_batches == 3
+
+    # the responses are cached, so the online execution does not send any requests
+    num_requests = mock_server.num_requests
+    responses = execute_requests(mock_requests(model), api_name, force=1.0)
+    assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 10
+    assert mock_server.num_requests == num_requests
+
+
+def test_batch_mode_continues_submitted_batches(mock_server: MockServer) -> None:
+    requests = [prepare_for_anthropic(request) for request in mock_requests("claude-3-5-haiku-20241022")]
+
+    def interrupt(idx: int, response: dict) -> None:
+        raise KeyboardInterrupt()  # e.g., Ctrl-C while unpacking the results
+
+    with pytest.raises(KeyboardInterrupt):
+        _anthropic.anthropic_execute(requests, force=1.0, mode="batch", callback=interrupt)
+    assert mock_server.num_batches == 1
+
+    # the next run picks up the submitted batch instead of submitting it again
+    responses = _anthropic.anthropic_execute(requests, force=1.0, mode="batch")
+    assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 10
+    assert mock_server.num_batches == 1
+    assert list(_anthropic.BATCHES_PATH.glob("*.json")) == []
+
+
+def test_batch_mode_continues_submitted_batches_of_changed_requests(mock_server: MockServer, monkeypatch) -> None:
+    monkeypatch.setattr(_anthropic, "BATCH_MAX_REQUESTS", 4)
+    requests = [prepare_for_anthropic(request) for request in mock_requests("claude-3-5-haiku-20241022")]
+
+    def interrupt(idx: int, response: dict) -> None:
+        raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        _anthropic.anthropic_execute(requests, force=1.0, mode="batch", callback=interrupt)
+    assert mock_server.num_batches == 3
+
+    # some requests are cached online in the meantime, so the remaining requests would be chunked differently
+    _anthropic.anthropic_execute(requests[:3], force=1.0)
+    responses = _anthropic.anthropic_execute(requests, force=1.0, mode="batch")
+    assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 10
+    assert mock_server.num_batches == 3  # every pending request was found in a registered batch
+    assert list(_anthropic.BATCHES_PATH.glob("*.json")) == []
+
+
+def test_batch_mode_executes_requests_without_result_online(mock_server: MockServer, monkeypatch) -> None:
+    batch_results = _anthropic._batch_results
+
+    def drop_first_result(batch_id: str):
+        return list(batch_results(batch_id))[1:]  # e.g., expired
+
+    monkeypatch.setattr(_anthropic, "_batch_results", drop_first_result)
+    responses = execute_requests(mock_requests("claude-3-5-haiku-20241022"), "anthropic", force=1.0, mode="batch")
+    assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 10
+    assert mock_server.num_batches == 1
+
+
+def test_batch_mode_with_governor(mock_server: MockServer) -> None:
+    requests = mock_requests("claude-3-5-haiku-20241022")
+    with pytest.raises(AssertionError, match="max_cost_per_run"):
+        _anthropic.anthropic_execute(requests, mode="batch", governor=CostGovernor(max_cost_per_run=0.0))
+    assert mock_server.num_batches == 0
+
+    governor = CostGovernor(max_cost_per_run=1.0)
+    responses = _anthropic.anthropic_execute(requests, mode="batch", governor=governor)
+    assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 10
+    assert 0 < governor.run_cost < 1.0 and governor.run_reserved == 0
+
+
+def test_batch_mode_is_not_supported_by_ollama() -> None:
+    with pytest.raises(AssertionError):
+        execute_requests(mock_requests("llama3.1:8b-instruct-fp16"), "ollama", mode="batch")
@@ -0,0 +1,197 @@
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from llms4de.model import _anthropic, _budget, _openai
+from llms4de.model._budget import OutputLengthEstimate, SharedContext, shared_context_path, restore_budget_states, \
+        persist_budget_states
+from llms4de.model._retry import ConcurrencyLimit
+
+logger = logging.getLogger(__name__)
+
+
+def test_output_length_estimate(monkeypatch) -> None:
+    monkeypatch.setattr(_budget, "OUTPUT_ESTIMATE_MIN_SAMPLES", 5)
+    estimate = OutputLengthEstimate()
+    for _ in range(4):
+        estimate.observe(100)
+    assert estimate.predict(16_384) == 16_384  # too few samples
+    estimate.observe(100)
+    assert estimate.predict(16_384) == 100
+    assert estimate.predict(50) == 50  # never more than the maximum
+
+    for num_output_tokens in [80, 120] * 10:
+        estimate.observe(num_output_tokens)
+    assert 100 < estimate.predict(16_384) < 200  # mean plus safety margin
+
+
+def _openai_request(max_tokens: int | None) -> _openai._Request:
+    request = _openai._Request({"model": "gpt-4o-mini-2024-07-18", "messages": [], "max_tokens": max_tokens})
+    request.num_input_tokens = 1_000
+    return request
+
+
+def _openai_response(completion_tokens: int) -> _openai._Response:
+    return _openai._Response({
+        "model": "gpt-4o-mini-2024-07-18",
+        "choices": [],
+        "usage": {"prompt_tokens": 1_000, "completion_tokens": completion_tokens,
+                  "total_tokens": 1_000 + completion_tokens}
+    })
+
+
+def test_openai_budget_reserves_predicted_output_length(monkeypatch) -> None:
+    monkeypatch.setattr(_budget, "OUTPUT_ESTIMATE_MIN_SAMPLES", 3)
+    state = _openai._ModelBudgetState.new()
+    state.tpm = state.t = 100_000
+
+    # without responses, the maximum output length is reserved
+    request = _openai_request(None)
+    state.decrease_by_request(request)
+    assert request.reserved_usage == 1_000 + 16_384
+    state.increase_by_response(request, _openai_response(10))
+    assert state.t == 100_000 - 1_010
+
+    for _ in range(2):
+        request = _openai_request(None)
+        state.decrease_by_request(request)
+        state.increase_by_response(request, _openai_response(10))
+
+    # afterward, the predicted output length is reserved and over-runs are charged to the budget
+    request = _openai_request(None)
+    assert state.is_enough_for_request(request)
+    state.t = 5_000
+    state.decrease_by_request(request)
+    assert request.reserved_usage == 1_010
+    state.increase_by_response(request, _openai_response(3_000))
+    assert state.t == 5_000 - 4_000
+
+
+def test_anthropic_budget_reserves_predicted_output_length(monkeypatch) -> None:
+    monkeypatch.setattr(_budget, "OUTPUT_ESTIMATE_MIN_SAMPLES", 1)
+    state = _anthropic._ModelBudgetState.new()
+    state.otpm = state.ot = 10_000
+    state.output_estimate.observe(20)
+
+    request = _anthropic._Request({"model": "claude-3-5-haiku-20241022", "messages": [], "max_tokens": 8_192})
+    request.num_input_tokens = 100
+    assert state.is_enough_for_request(request)
+    state.decrease_by_request(request)
+    assert state.ot == 10_000 - 20
+    response = _anthropic._Response({
+        "type": "message",
+        "usage": {"input_tokens": 100, "output_tokens": 30, "cache_creation_input_tokens": 0,
+                  "cache_read_input_tokens": 0}
+    })
+    state.increase_by_response(request, response)
+    assert state.ot == 10_000 - 30
+
+
+def _increment_shared_counter(context: SharedContext, num_increments: int) -> None:
+    for _ in range(num_increments):
+        with context.lock:
+            context["counter"] = context["counter"] + 1
+
+
+def test_shared_context(tmp_path) -> None:
+    context = SharedContext(tmp_path / "openai.context")
+    with context.lock:
+        assert "counter" not in context
+        context["counter"] = 0
+    with pytest.raises(AssertionError):
+        context["counter"]  # only while holding the lock
+
+    processes = [
+        multiprocessing.get_context("spawn").Process(target=_increment_shared_counter, args=(context, 200))
+        for _ in range(4)
+    ]
+    threads = [threading.Thread(target=_increment_shared_counter, args=(context, 200)) for _ in range(2)]
+    for worker in processes + threads:
+        worker.start()
+    for worker in processes + threads:
+        worker.join()
+    assert all(process.exitcode == 0 for process in processes)
+
+    with context.lock:
+        assert context["counter"] == 6 * 200
+        assert list(context.keys()) == ["counter"]
+
+    # another process that attaches while the context is in use shares it
+    other = SharedContext(tmp_path / "openai.context")
+    with other.lock:
+        assert other["counter"] == 6 * 200
+
+
+def test_shared_context_stores_budget_states_as_json(tmp_path) -> None:
+    context = SharedContext(tmp_path / "openai.context")
+    state = _openai._ModelBudgetState.new()
+    state.concurrency.limit = 4.5
+    state.output_estimate.observe(100)
+    with context.lock:
+        context["num_running"] = 2
+        context["gpt-4o-mini"] = state
+
+    context._version = None  # reload the context from the file, like another process
+    with context.lock:
+        assert context["num_running"] == 2
+        assert context["gpt-4o-mini"] == state
+        assert isinstance(context["gpt-4o-mini"].concurrency, ConcurrencyLimit)
+    assert b"__dataclass__" in context.path.read_bytes()  # stored as JSON
+
+
+def test_shared_context_does_not_instantiate_foreign_classes(tmp_path) -> None:
+    context = SharedContext(tmp_path / "openai.context")
+    with context.lock:
+        context["counter"] = 1
+    payload = json.dumps({"counter": {"__dataclass__": "subprocess:Popen", "fields": {"args": ["false"]}}}).encode()
+    os.pwrite(context._fd, _budget._HEADER.pack(1_000, len(payload)) + payload, 0)
+    with context.lock:
+        assert "counter" not in context  # the forged context is discarded
+
+
+def test_shared_context_refuses_files_of_other_users(tmp_path, monkeypatch) -> None:
+    SharedContext(tmp_path / "openai.context")
+    uid = os.getuid()
+    monkeypatch.setattr(_budget.os, "getuid", lambda: uid + 1)
+    with pytest.raises(AssertionError, match="another user"):
+        SharedContext(tmp_path / "openai.context")
+
+
+def test_shared_context_path() -> None:
+    assert shared_context_path("openai", "key-a") == shared_context_path("openai", "key-a")
+    assert shared_context_path("openai", "key-a") != shared_context_path("openai", "key-b")
+    assert "key-a" not in str(shared_context_path("openai", "key-a"))
+
+
+def test_persist_and_restore_budget_states(tmp_path) -> None:
+    semaphore = threading.Semaphore()
+    kwargs = {"path": tmp_path, "state_cls": _openai._ModelBudgetState}
+    state = _openai._ModelBudgetState.new()
+    state.rpm, state.tpm, state.r, state.t = 500, 200_000, 0, 1_000
+    state.concurrency.limit = 42.5
+    state.num_running = 3
+    state.output_estimate.observe(100)
+    state.last_update = time.time() - 30
+    persist_budget_states({"gpt-4o-mini": state}, semaphore, {"gpt-4o-mini", "gpt-4o"}, path=tmp_path, api_key="a")
+
+    context = {}
+    restore_budget_states(context, semaphore, {"gpt-4o-mini", "gpt-4o"}, api_key="a", **kwargs)
+    assert list(context.keys()) == ["gpt-4o-mini"]
+    restored = context["gpt-4o-mini"]
+    assert restored.concurrency.limit == 42.5 and restored.output_estimate.mean == 100 and restored.num_running == 0
+    restored.consider_time()
+    assert restored.r == pytest.approx(250, abs=5) and restored.t == pytest.approx(101_000, abs=2_000)  # aged
+
+    # states of other API keys and old states are not restored
+    context = {}
+    restore_budget_states(context, semaphore, {"gpt-4o-mini"}, api_key="b", **kwargs)
+    assert context == {}
+    state.last_update = time.time() - _budget.BUDGET_STATE_MAX_AGE - 1
+    persist_budget_states({"gpt-4o-mini": state}, semaphore, {"gpt-4o-mini"}, path=tmp_path, api_key="a")
+    restore_budget_states(context, semaphore, {"gpt-4o-mini"}, api_key="a", **kwargs)
+    assert context == {}
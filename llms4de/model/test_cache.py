@@ -0,0 +1,169 @@
+import json
+import logging
+
+import pytest
+
+from llms4de.model import _cache
+from llms4de.model._cache import open_cache, migrate_directory_cache, canonical_hash, rekey_cache
+
+logger = logging.getLogger(__name__)
+
+
+def _write_directory_cache(directory, num_pairs: int) -> None:
+    directory.mkdir()
+    for idx in range(num_pairs):
+        with open(directory / f"hash{idx}.json", "w", encoding="utf-8") as file:
+            json.dump({"request": {"idx": idx}, "response": {"text": f"response {idx}"}}, file)
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "directory"])
+def test_open_cache(backend: str, tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(_cache, "CACHE_BACKEND", backend)
+    cache = open_cache(tmp_path / "test_cache")
+    assert cache.load_many(["a", "b"]) == {}
+
+    cache.store("a", {"idx": 0}, {"text": "response 0"})
+    assert cache.load_many(["a", "b", "a"]) == {"a": {"request": {"idx": 0}, "response": {"text": "response 0"}}}
+    assert cache.hashes() == ["a"]
+
+    cache.store("a", {"idx": 0}, {"text": "new response 0"})
+    assert cache.load_many(["a"])["a"]["response"] == {"text": "new response 0"}
+
+    # the cache is persistent
+    cache.close()
+    _cache._caches.clear()
+    assert open_cache(tmp_path / "test_cache").load_many(["a"])["a"]["request"] == {"idx": 0}
+
+
+def test_open_cache_unknown_backend(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(_cache, "CACHE_BACKEND", "asdf")
+    with pytest.raises(AssertionError):
+        open_cache(tmp_path / "test_cache")
+
+
+def test_load_many_large(tmp_path) -> None:
+    cache = open_cache(tmp_path / "test_cache")
+    cache.store_many([(f"hash{idx}", {"idx": idx}, {}) for idx in range(2_000)])
+    cached_pairs = cache.load_many([f"hash{idx}" for idx in range(0, 4_000, 2)])
+    assert len(cached_pairs) == 1_000
+    assert cached_pairs["hash1998"]["request"] == {"idx": 1998}
+
+
+def test_migrate_directory_cache(tmp_path) -> None:
+    _write_directory_cache(tmp_path / "test_cache", 10)
+    (tmp_path / "test_cache" / "broken.json").write_text("{")
+
+    assert migrate_directory_cache(tmp_path / "test_cache", tmp_path / "test_cache.sqlite", batch_size=3) == 10
+    assert migrate_directory_cache(tmp_path / "test_cache", tmp_path / "test_cache.sqlite") == 10  # repeatable
+    cache = open_cache(tmp_path / "test_cache")
+    assert len(cache.hashes()) == 10
+    hash = canonical_hash({"idx": 3})
+    assert cache.load_many([hash])[hash]["response"] == {"text": "response 3"}
+
+
+def test_open_cache_migrates_directory(tmp_path) -> None:
+    _write_directory_cache(tmp_path / "test_cache", 5)
+    assert not (tmp_path / "test_cache.sqlite").is_file()
+    cache = open_cache(tmp_path / "test_cache")
+    assert (tmp_path / "test_cache.sqlite").is_file()
+    assert sorted(cache.hashes()) == sorted(canonical_hash({"idx": idx}) for idx in range(5))
+
+
+def test_canonical_hash() -> None:
+    request = {"model": "gpt-4o-mini-2024-07-18", "temperature": 0, "messages": [{"role": "user", "content": "Hi!"}]}
+    reordered = {"messages": [{"content": "Hi!", "role": "user"}], "temperature": 0.0, "model": "gpt-4o-mini-2024-07-18"}
+    assert canonical_hash(request) == canonical_hash(reordered)
+    assert canonical_hash(request) == canonical_hash(request | {"user": "someone", "metadata": {"run": 1}})
+    assert canonical_hash(request) != canonical_hash(request | {"temperature": 0.5})
+    assert canonical_hash(request) != canonical_hash(request | {"seed": 1})
+    assert canonical_hash({"stop": True}) != canonical_hash({"stop": 1})
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "directory"])
+def test_rekey_cache(backend: str, tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(_cache, "CACHE_BACKEND", backend)
+    cache = open_cache(tmp_path / "test_cache")
+    cache.store_many([
+        ("old0", {"a": 1, "b": 2.0}, {"text": "response 0"}),
+        ("old1", {"b": 2, "a": 1}, {"text": "response 0"}),
+        ("old2", {"a": 1, "b": 2, "user": "someone"}, {"text": "response 2"}),
+        ("old3", {"a": 2}, {"text": "response 3"})
+    ])
+
+    report = rekey_cache(tmp_path / "test_cache")
+    assert report == {"num_pairs": 4, "num_rekeyed": 4, "num_collapsed": 2, "num_conflicting": 1, "num_pairs_after": 2}
+    cache = open_cache(tmp_path / "test_cache")
+    assert sorted(cache.hashes()) == sorted([canonical_hash({"a": 1, "b": 2}), canonical_hash({"a": 2})])
+
+    report = rekey_cache(tmp_path / "test_cache")  # repeatable
+    assert report["num_rekeyed"] == 0 and report["num_pairs_after"] == 2
+
+
+def test_rekey_sqlite_cache_keeps_concurrent_writes(tmp_path) -> None:
+    cache = open_cache(tmp_path / "test_cache")
+    cache.store("old", {"b": 1, "a": 1}, {"text": "response"})
+    other = _cache._SQLiteCache(tmp_path / "test_cache.sqlite")  # e.g., the connection of another process
+
+    rekey_cache(tmp_path / "test_cache")
+    other.store(canonical_hash({"a": 2}), {"a": 2}, {"text": "written after re-keying"})
+    other.close()
+
+    cache = open_cache(tmp_path / "test_cache")
+    assert sorted(cache.hashes()) == sorted([canonical_hash({"a": 1, "b": 1}), canonical_hash({"a": 2})])
+
+
+def test_open_cache_rekeys_old_sqlite_cache(tmp_path) -> None:
+    cache = open_cache(tmp_path / "test_cache")
+    cache.store("old", {"b": 1, "a": 1}, {"text": "response"})
+    cache.set_hash_version(0)
+    cache.close()
+    _cache._caches.clear()
+
+    cache = open_cache(tmp_path / "test_cache")
+    assert cache.hashes() == [canonical_hash({"a": 1, "b": 1})]
+    assert cache.hash_version() == _cache.HASH_VERSION
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "directory"])
+def test_load_many_in_parallel(backend: str, tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(_cache, "CACHE_BACKEND", backend)
+    monkeypatch.setattr(_cache, "LOAD_THREADS", 4)
+    monkeypatch.setattr(_cache, "LOAD_CHUNK_SIZE", 3)
+    cache = open_cache(tmp_path / "test_cache")
+    cache.store_many([(f"hash{idx}", {"idx": idx}, {}) for idx in range(20)])
+    cached_pairs = cache.load_many([f"hash{idx}" for idx in range(0, 40, 2)])
+    assert sorted(cached_pairs.keys()) == sorted(f"hash{idx}" for idx in range(0, 20, 2))
+    assert cached_pairs["hash18"]["request"] == {"idx": 18}
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "directory"])
+def test_presence_index_sees_pairs_of_other_processes(backend: str, tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(_cache, "CACHE_BACKEND", backend)
+    cache = open_cache(tmp_path / "test_cache")
+    cache.store("a", {"idx": 0}, {})
+    assert cache.present(["a", "b"]) == ["a"]
+
+    # another process stores a pair using its own connection
+    other_cache = _cache._SQLiteCache(cache.path) if backend == "sqlite" else _cache._DirectoryCache(cache.path)
+    other_cache.store("b", {"idx": 1}, {})
+    other_cache.close()
+
+    assert sorted(cache.present(["a", "b", "c"])) == ["a", "b"]
+    assert cache.load_many(["b"])["b"]["request"] == {"idx": 1}
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "directory"])
+def test_cache_records_latencies(backend: str, tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(_cache, "CACHE_BACKEND", backend)
+    cache = open_cache(tmp_path / "test_cache")
+    cache.store("a", {"idx": 0}, {"text": "response 0"}, 1.5)
+    cache.store_many([("b", {"idx": 1}, {"text": "response 1"}), ("c", {"idx": 2}, {})], [0.25, None])
+    cached_pairs = cache.load_many(["a", "b", "c"])
+    assert cached_pairs["a"]["latency"] == 1.5 and cached_pairs["b"]["latency"] == 0.25
+    assert "latency" not in cached_pairs["c"].keys()
+    assert cache.latencies() == {"a": 1.5, "b": 0.25}
+
+    # re-keying keeps the latencies
+    rekey_cache(tmp_path / "test_cache")
+    latencies = open_cache(tmp_path / "test_cache").latencies()
+    assert latencies == {canonical_hash({"idx": 0}): 1.5, canonical_hash({"idx": 1}): 0.25}
@@ -0,0 +1,390 @@
+import dataclasses
+import io
+import logging
+import threading
+import time
+
+import pytest
+import requests
+
+from llms4de.model import _executor, _retry, _telemetry
+from llms4de.model._executor import execute_pairs, map_concurrently, fold_duplicates, fan_out, fan_out_callback
+from llms4de.model._governor import CostGovernor
+from llms4de.model._mock_server import MockServer, MOCK_RESPONSE_TEXT
+from llms4de.model._openai import _ModelBudgetState, _Pair, _ProgressBar
+from llms4de.model._telemetry import Telemetry
+from llms4de.model.conftest import FakeResponse, mock_requests
+from llms4de.model.generic import execute_requests, extract_text_from_response
+
+logger = logging.getLogger(__name__)
+
+
+class _FakeHTTPResponse:
+
+    def __init__(self, status_code: int, body: dict, headers: dict | None = None) -> None:
+        self.status_code = status_code
+        self.body = body
+        self.headers = {} if headers is None else headers
+
+    def json(self) -> dict:
+        return self.body
+
+
+@dataclasses.dataclass
+class _FakeRequest:
+    idx: int
+    model: str = "model"
+    latency: float = 0.01
+    status_codes: list[int] = dataclasses.field(default_factory=list)
+    running: list[int] = dataclasses.field(default_factory=list)
+    lock: threading.Lock = dataclasses.field(default_factory=threading.Lock)
+    reserved_usage: int = 0
+    deterministic: bool = True
+
+    def max_input_usage(self) -> int:
+        return 5
+
+    def max_output_usage(self) -> int:
+        return 5
+
+    def max_total_usage(self) -> int:
+        return 10
+
+    def max_cost(self) -> float:
+        return 1.0
+
+    def is_deterministic(self) -> bool:
+        return self.deterministic
+
+    def execute(self) -> _FakeHTTPResponse:
+        with self.lock:
+            self.running.append(self.idx)
+        time.sleep(self.latency)
+        status_code = self.status_codes.pop(0) if len(self.status_codes) > 0 else 200
+        return _FakeHTTPResponse(status_code, {"idx": self.idx, "cost": 0.5, "usage": 10})
+
+
+def _execute(pairs: list[_Pair], **kwargs) -> tuple[dict, _ProgressBar]:
+    context = {"num_running": 0}
+    with _ProgressBar(total=len(pairs), disable=True) as progress_bar:
+        execute_pairs(
+            pairs,
+            context=context,
+            semaphore=threading.Semaphore(),
+            progress_bar=progress_bar,
+            response_cls=FakeResponse,
+            **kwargs
+        )
+    return context, progress_bar
+
+
+def test_execute_pairs() -> None:
+    pairs = [_Pair(_FakeRequest(idx)) for idx in range(50)]
+    context, progress_bar = _execute(pairs, max_running=8, track_cost=True)
+    assert all(pair.status == "done" for pair in pairs)
+    assert [pair.response.response["idx"] for pair in pairs] == list(range(50))
+    assert context["num_running"] == 0
+    assert progress_bar.cost == 25
+    assert progress_bar.failed == 0
+    assert all(0.01 <= pair.latency < 1 for pair in pairs)
+
+
+def test_execute_pairs_redraws_progress_bar_at_most_every_mininterval() -> None:
+    file = io.StringIO()
+    pairs = [_Pair(_FakeRequest(idx, latency=0.0)) for idx in range(50)]
+    with _ProgressBar(total=len(pairs), file=file, mininterval=10) as progress_bar:
+        execute_pairs(
+            pairs,
+            context={"num_running": 0},
+            semaphore=threading.Semaphore(),
+            progress_bar=progress_bar,
+            response_cls=FakeResponse,
+            max_running=8
+        )
+    assert all(pair.status == "done" for pair in pairs)
+    assert file.getvalue().count("\r") <= 3  # not once per started and finished request
+
+
+def test_execute_pairs_max_running() -> None:
+    max_seen = 0
+    num_running = 0
+    lock = threading.Lock()
+
+    class _CountingRequest(_FakeRequest):
+        def execute(self) -> _FakeHTTPResponse:
+            nonlocal max_seen, num_running
+            with lock:
+                num_running += 1
+                max_seen = max(max_seen, num_running)
+            response = super().execute()
+            with lock:
+                num_running -= 1
+            return response
+
+    pairs = [_Pair(_CountingRequest(idx, latency=0.02)) for idx in range(40)]
+    _execute(pairs, max_running=4)
+    assert all(pair.status == "done" for pair in pairs)
+    assert max_seen == 4
+
+
+def test_execute_pairs_failed() -> None:
+    pairs = [_Pair(_FakeRequest(0, status_codes=[400])), _Pair(_FakeRequest(1))]
+    context, progress_bar = _execute(pairs, max_running=8)
+    assert all(pair.status == "done" for pair in pairs)
+    assert progress_bar.failed == 1
+    assert progress_bar.retries == 0
+
+
+def test_execute_pairs_on_done() -> None:
+    pairs = [_Pair(_FakeRequest(idx, latency=0.01 * (10 - idx))) for idx in range(10)]
+    pairs.append(_Pair(_FakeRequest(10, status_codes=[400])))
+    done_pairs = []
+    _execute(pairs, max_running=16, on_done=lambda pair: done_pairs.append(pair))
+    assert sorted(id(pair) for pair in done_pairs) == sorted(id(pair) for pair in pairs)
+    assert done_pairs[-1] is pairs[0]  # the slowest request finishes last
+
+
+def test_execute_pairs_retries_transient_errors(monkeypatch) -> None:
+    monkeypatch.setattr(_retry, "BACKOFF_BASE", 0.01)
+    pairs = [
+        _Pair(_FakeRequest(0, status_codes=[500, 503])),
+        _Pair(_FakeRequest(1, status_codes=[502] * _retry.MAX_ATTEMPTS)),
+        _Pair(_FakeRequest(2))
+    ]
+    context, progress_bar = _execute(pairs, max_running=8)
+    assert all(pair.status == "done" for pair in pairs)
+    assert pairs[0].response.response["idx"] == 0
+    assert progress_bar.failed == 1  # gave up after MAX_ATTEMPTS attempts
+    assert progress_bar.retries == 2 + _retry.MAX_ATTEMPTS - 1
+    assert context["num_running"] == 0
+
+
+def test_execute_pairs_retries_connection_errors(monkeypatch) -> None:
+    monkeypatch.setattr(_retry, "BACKOFF_BASE", 0.01)
+
+    class _FlakyRequest(_FakeRequest):
+        def execute(self) -> _FakeHTTPResponse:
+            if self.idx > 0:
+                self.idx -= 1
+                raise requests.ConnectionError("connection reset")
+            return super().execute()
+
+    pairs = [_Pair(_FlakyRequest(2))]
+    context, progress_bar = _execute(pairs, max_running=8)
+    assert pairs[0].status == "done" and progress_bar.retries == 2 and progress_bar.failed == 0
+
+
+def test_execute_pairs_rate_limit(monkeypatch) -> None:
+    monkeypatch.setattr(_retry, "BACKOFF_BASE", 0.01)
+    pairs = [_Pair(_FakeRequest(0)), _Pair(_FakeRequest(1, status_codes=[429])), _Pair(_FakeRequest(2))]
+    context, progress_bar = _execute(pairs, max_running=8, new_budget_state=_ModelBudgetState.new)
+    assert all(pair.status == "done" for pair in pairs)
+    assert [pair.response.response["idx"] for pair in pairs] == [0, 1, 2]
+    assert progress_bar.failed == 0
+    assert progress_bar.retries == 1
+    assert context["model"].num_running == 0
+
+
+def test_execute_pairs_rate_limit_gives_up(monkeypatch) -> None:
+    monkeypatch.setattr(_retry, "BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(_executor, "MAX_RATE_LIMIT_ATTEMPTS", 3)
+    pairs = [_Pair(_FakeRequest(0, status_codes=[429] * 10)), _Pair(_FakeRequest(1))]
+    context, progress_bar = _execute(pairs, max_running=8, new_budget_state=_ModelBudgetState.new)
+    assert all(pair.status == "done" for pair in pairs)
+    assert progress_bar.failed == 1 and progress_bar.retries == 2  # e.g., the quota is exhausted
+    assert pairs[1].response.response["idx"] == 1
+
+
+def test_execute_pairs_rate_limit_honors_retry_after() -> None:
+    class _RateLimitedRequest(_FakeRequest):
+        def execute(self) -> _FakeHTTPResponse:
+            if len(self.status_codes) > 0:
+                self.status_codes.pop(0)
+                return _FakeHTTPResponse(429, {}, {"retry-after": "0.5"})
+            return super().execute()
+
+    pairs = [_Pair(_RateLimitedRequest(0, status_codes=[429]))]
+    before = time.time()
+    _execute(pairs, max_running=8, new_budget_state=_ModelBudgetState.new)
+    assert 0.5 <= time.time() - before < 1.5
+
+
+def test_execute_pairs_ramps_up_concurrency() -> None:
+    max_seen = []
+    lock = threading.Lock()
+    num_running = 0
+
+    class _CountingRequest(_FakeRequest):
+        def execute(self) -> _FakeHTTPResponse:
+            nonlocal num_running
+            with lock:
+                num_running += 1
+                max_seen.append(num_running)
+            response = super().execute()
+            with lock:
+                num_running -= 1
+            return response
+
+    pairs = [_Pair(_CountingRequest(idx, latency=0.02)) for idx in range(60)]
+    context, _ = _execute(pairs, max_running=16, new_budget_state=_ModelBudgetState.new)
+    assert max_seen[0] == 1  # starts with a single request
+    assert max(max_seen) == 16  # but ramps up to the thread limit
+    assert context["model"].concurrency.limit == 16
+
+
+def test_execute_pairs_budget() -> None:
+    # 60 requests per minute ==> the second request must wait for about one second
+    def new_budget_state() -> _ModelBudgetState:
+        budget_state = _ModelBudgetState.new()
+        budget_state.concurrency.limit = 8
+        budget_state.rpm = 60
+        budget_state.r = 1
+        return budget_state
+
+    pairs = [_Pair(_FakeRequest(idx)) for idx in range(2)]
+    before = time.time()
+    _execute(pairs, max_running=8, new_budget_state=new_budget_state)
+    assert 0.9 < time.time() - before < 2
+    assert all(pair.status == "done" for pair in pairs)
+
+
+def test_execute_pairs_telemetry(monkeypatch) -> None:
+    monkeypatch.setattr(_retry, "BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(_telemetry, "TELEMETRY_SAMPLE_INTERVAL", 0)
+
+    # 120 requests per minute ==> the second and third request must wait for about half a second each
+    def new_budget_state() -> _ModelBudgetState:
+        budget_state = _ModelBudgetState.new()
+        budget_state.concurrency.limit = 8
+        budget_state.rpm = 120
+        budget_state.r = 1
+        return budget_state
+
+    pairs = [_Pair(_FakeRequest(0)), _Pair(_FakeRequest(1, status_codes=[503])), _Pair(_FakeRequest(2))]
+    with Telemetry("test") as telemetry:
+        _execute(pairs, max_running=8, new_budget_state=new_budget_state, track_cost=True, telemetry=telemetry)
+    record = telemetry.end()["models"]["model"]
+    assert 0.5 < record["bottleneck_seconds"]["requests_per_minute"] < 2
+    assert record["num_retries"] == {"status 503": 1}
+    assert record["num_responses"] == 3 and sum(record["latency_buckets"].values()) == 3
+    assert record["output_tokens"] == 15
+    assert record["budgets"][0]["rpm"] == 120 and record["budgets"][0]["concurrency"] == 8
+    assert telemetry.to_json()["cost"] == 1.5
+
+
+def test_execute_pairs_error() -> None:
+    class _BrokenRequest(_FakeRequest):
+        def execute(self) -> _FakeHTTPResponse:
+            raise ConnectionError("broken")
+
+    # one broken request fails on its own without aborting the others
+    pairs = [_Pair(_BrokenRequest(0))] + [_Pair(_FakeRequest(idx)) for idx in range(1, 10)]
+    done_pairs = []
+    context, progress_bar = _execute(pairs, max_running=8, on_done=lambda pair: done_pairs.append(pair))
+    assert all(pair.status == "done" for pair in pairs) and len(done_pairs) == 10
+    assert pairs[0].response.response["error"] == {"type": "ConnectionError", "message": "broken"}
+    assert not pairs[0].response.was_successful()
+    assert [pair.response.response["idx"] for pair in pairs[1:]] == list(range(1, 10))
+    assert progress_bar.failed == 1
+    assert context["num_running"] == 0
+
+
+def test_execute_pairs_governor() -> None:
+    # each request may cost up to $1 and costs $0.5 ==> at most 4 requests fit into $2.5
+    governor = CostGovernor(max_cost_per_run=2.5)
+    pairs = [_Pair(_FakeRequest(idx)) for idx in range(10)]
+    with pytest.raises(AssertionError, match="max_cost_per_run"):
+        _execute(pairs, max_running=8, track_cost=True, governor=governor)
+    assert sum(1 for pair in pairs if pair.status == "done") == 4  # the running requests finished cleanly
+    assert governor.run_cost == 2.0 and governor.run_reserved == 0
+    assert all(pair.status == "open" for pair in pairs if pair.status != "done")
+
+
+class _SlowOnceRequest(_FakeRequest):
+    def execute(self) -> _FakeHTTPResponse:
+        with self.lock:
+            is_first = len(self.running) == 0
+        response = super().execute()
+        if is_first:
+            time.sleep(1.0)  # e.g., an overloaded replica
+        return response
+
+
+@pytest.mark.parametrize("deterministic", [True, False])
+def test_execute_pairs_hedges_slow_requests(deterministic: bool) -> None:
+    pairs = [_Pair(_FakeRequest(idx)) for idx in range(30)]
+    pairs.append(_Pair(_SlowOnceRequest(30, deterministic=deterministic)))
+    context, progress_bar = _execute(pairs, max_running=1, hedge_percentile=0.9, track_cost=True)
+    assert all(pair.status == "done" for pair in pairs)
+    assert context["num_running"] == 0
+    if deterministic:
+        assert pairs[-1].request.running == [30, 30]  # sent a duplicate that answered first
+        assert pairs[-1].latency < 0.5
+    else:
+        assert pairs[-1].request.running == [30]  # a duplicate might yield a different response
+        assert pairs[-1].latency >= 1.0
+
+
+def test_execute_pairs_hedges_within_budget() -> None:
+    # the budget allows only one request per pair ==> no duplicates
+    def new_budget_state() -> _ModelBudgetState:
+        budget_state = _ModelBudgetState.new()
+        budget_state.concurrency.limit = 8
+        budget_state.rpm = 31
+        budget_state.r = 31
+        return budget_state
+
+    pairs = [_Pair(_FakeRequest(idx)) for idx in range(30)]
+    pairs.append(_Pair(_SlowOnceRequest(30)))
+    context, _ = _execute(pairs, max_running=8, hedge_percentile=0.9, new_budget_state=new_budget_state)
+    assert pairs[-1].request.running == [30]
+    assert context["num_running"] == 0 and context["model"].num_running == 0
+
+
+def test_map_concurrently() -> None:
+    done = []
+    results = map_concurrently(lambda x: x * 2, range(10), max_running=3, callback=lambda x, y: done.append((x, y)))
+    assert results == [x * 2 for x in range(10)]
+    assert sorted(done) == [(x, x * 2) for x in range(10)]
+    assert map_concurrently(lambda x: x, [], max_running=3) == []
+
+
+def test_fold_duplicates_and_fan_out() -> None:
+    items = [{"idx": 0}, {"idx": 1}, {"idx": 0}, {"idx": 2}, {"idx": 1}, {"idx": 0}]
+    unique_items, positions = fold_duplicates(items, key=lambda item: item["idx"])
+    assert unique_items == [{"idx": 0}, {"idx": 1}, {"idx": 2}]
+    assert positions == [0, 1, 0, 2, 1, 0]
+
+    results = fan_out([{"result": item["idx"]} for item in unique_items], positions)
+    assert results == [{"result": item["idx"]} for item in items]
+    assert results[0] is not results[2] and results[0] is not results[5]  # duplicates receive copies
+
+    assert fold_duplicates([], key=lambda item: item) == ([], [])
+    assert fan_out([], []) == []
+
+
+def test_fan_out_callback() -> None:
+    positions = [0, 1, 0, 2]
+    results = []
+    notify = fan_out_callback(lambda idx, result: results.append((idx, result)), positions)
+    result = {"result": 0}
+    notify(0, result)
+    notify(2, {"result": 2})
+    assert results == [(0, {"result": 0}), (2, {"result": 0}), (3, {"result": 2})]
+    assert results[0][1] is result and results[1][1] is not result  # duplicates receive copies
+
+    fan_out_callback(None, positions)(0, result)  # ignores the results
+
+
+@pytest.mark.parametrize("model,api_name", [
+    ("claude-3-5-haiku-20241022", "anthropic"),
+    ("llama3.1:8b-instruct-fp16", "ollama")
+])
+def test_execute_requests_folds_duplicates(model: str, api_name: str, mock_server: MockServer) -> None:
+    requests = mock_requests(model)
+    reordered = [dict(reversed(request.items())) for request in requests]
+    responses = execute_requests(requests + reordered + requests[:3], api_name, force=1.0)
+    assert len(responses) == 23
+    assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 23
+    assert responses[0] == responses[10] and responses[0] is not responses[10]
+    assert mock_server.num_requests == (20 if api_name == "anthropic" else 11)  # token counting or preloading
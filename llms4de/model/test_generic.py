@@ -1,11 +1,16 @@
 import logging
 import os
 import pathlib
+import threading
+import time
 
 import pytest
 import requests
 
-from llms4de.model.generic import num_tokens, execute_requests, extract_text_from_response, \
+from llms4de.model import _anthropic, generic
+from llms4de.model._mock_server import MockServer, MOCK_RESPONSE_TEXT
+from llms4de.model.conftest import mock_requests, tiktoken_available
+from llms4de.model.generic import num_tokens, execute_requests, execute_requests_iter, extract_text_from_response, \
     extract_finish_reason_from_response, max_tokens_for_ground_truth, prepare_for_anthropic, prepare_for_ollama
 
 logger = logging.getLogger(__name__)
@@ -57,6 +62,29 @@ def test_prepare_for_ollama() -> None:
     assert prepare_for_ollama(request) == out
 
 
+def test_prepare_for_ollama_num_ctx(monkeypatch) -> None:
+    def request(num_words: int, max_tokens: int | None) -> dict:
+        return {
+            "model": "llama3.1:8b-instruct-fp16",
+            "messages": [{"role": "user", "content": " ".join(["word"] * num_words)}],
+            "max_tokens": max_tokens
+        }
+
+    # without buckets, the requests keep the cache keys of earlier runs
+    assert prepare_for_ollama(request(10, 1))["options"]["num_ctx"] == 128_000
+
+    monkeypatch.setattr(generic, "OLLAMA_NUM_CTX_BUCKETS", generic.OLLAMA_ADAPTIVE_NUM_CTX_BUCKETS)
+    assert prepare_for_ollama(request(10, 1))["options"]["num_ctx"] == 2_048
+    assert prepare_for_ollama(request(1_000, 100))["options"]["num_ctx"] == 8_192  # 5k bytes
+
+    # the context size does not depend on the environment
+    monkeypatch.setenv("HF_TOKEN", "token")
+    assert prepare_for_ollama(request(1_000, 100))["options"]["num_ctx"] == 8_192
+    assert prepare_for_ollama(request(10, 10_000))["options"]["num_ctx"] == 16_384
+    assert prepare_for_ollama(request(100_000, 100))["options"]["num_ctx"] == 128_000
+    assert prepare_for_ollama(request(10, None))["options"]["num_ctx"] == 128_000
+
+
 models_api_names = [
     pytest.param(
         "gpt-4o-mini-2024-07-18", "openai",
@@ -394,3 +422,80 @@ def test_extract_finish_reason_from_response() -> None:
 
     # failed response
     assert extract_finish_reason_from_response({}) is None
+
+
+@pytest.mark.parametrize("model,api_name", [
+    pytest.param(
+        "gpt-4o-mini-2024-07-18", "openai",
+        marks=pytest.mark.xfail(not tiktoken_available, reason="cannot execute without tiktoken encodings")
+    ),
+    ("claude-3-5-haiku-20241022", "anthropic"),
+    ("llama3.1:8b-instruct-fp16", "ollama")
+])
+def test_execute_requests_against_mock_server(model: str, api_name: str, mock_server: MockServer) -> None:
+    responses = execute_requests(mock_requests(model), api_name, force=1.0)
+    assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 10
+    num_requests = mock_server.num_requests
+
+    # the second execution is served from the cache
+    responses = execute_requests(mock_requests(model), api_name, force=1.0)
+    assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 10
+    assert mock_server.num_requests == num_requests
+
+
+@pytest.mark.parametrize("model,api_name", [
+    ("claude-3-5-haiku-20241022", "anthropic"),
+    ("llama3.1:8b-instruct-fp16", "ollama")
+])
+def test_execute_requests_iter(model: str, api_name: str, mock_server: MockServer) -> None:
+    requests = mock_requests(model)
+    execute_requests(requests[:4], api_name, force=1.0)
+
+    results = list(execute_requests_iter(requests + requests[:2], api_name, force=1.0))
+    assert sorted(idx for idx, _ in results) == list(range(12))
+    assert all(extract_text_from_response(response) == MOCK_RESPONSE_TEXT for _, response in results)
+    assert {idx for idx, _ in results[:6]} == {0, 1, 2, 3, 10, 11}  # cached responses first
+
+    with pytest.raises(AssertionError):
+        list(execute_requests_iter(requests, "unknown"))
+
+
+def test_execute_requests_iter_in_windows(mock_server: MockServer) -> None:
+    requests = [{**request, "seed": idx} for idx, request in enumerate(mock_requests("claude-3-5-haiku-20241022") * 3)]
+    num_loaded = 0
+
+    def load_lazily():
+        nonlocal num_loaded
+        for request in requests:
+            num_loaded += 1
+            yield request
+
+    results = []
+    for idx, response in execute_requests_iter(load_lazily(), "anthropic", force=1.0, window_size=8):
+        assert num_loaded <= (idx // 8 + 1) * 8  # the next window is loaded once the previous window is consumed
+        results.append((idx, response))
+    assert sorted(idx for idx, _ in results) == list(range(30))
+    assert all(extract_text_from_response(response) == MOCK_RESPONSE_TEXT for _, response in results)
+
+    # the rate limit state persists across windows and the method caches are released
+    assert "claude-3-5-haiku-20241022" in _anthropic._local_context.keys()
+    assert _anthropic._Request.hash.cache_info().currsize == 0
+
+
+def test_execute_requests_iter_stops_when_abandoned(mock_server: MockServer) -> None:
+    mock_server.latency = 0.05
+    requests = [{**request, "seed": idx} for idx, request in enumerate(mock_requests("claude-3-5-haiku-20241022") * 3)]
+    for _ in execute_requests_iter(requests, "anthropic", force=1.0, window_size=8):
+        break  # e.g., the consumer has found what it was looking for
+
+    def is_running() -> bool:
+        return any(thread.name == "execute_requests_iter" for thread in threading.enumerate())
+
+    deadline = time.time() + 5
+    while is_running() and time.time() < deadline:
+        time.sleep(0.05)
+    assert not is_running()  # the background thread does not wait for the consumer forever
+    num_requests = mock_server.num_requests
+    assert num_requests < 2 * 8  # not even the token counts and messages of the first window are all sent
+    time.sleep(0.2)
+    assert mock_server.num_requests == num_requests  # and no further windows are executed
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from llms4de.model import _governor
+from llms4de.model._governor import CostGovernor
+
+
+def test_cost_governor_run_limit() -> None:
+    governor = CostGovernor(max_cost_per_run=3.0)
+    assert governor.try_reserve(2.0) == 0
+    assert governor.try_reserve(2.0) == _governor.COST_POLL_INTERVAL  # wait for the running request
+    governor.release(2.0)
+    governor.charge(1.5)
+    assert governor.try_reserve(1.5) == 0
+    governor.release(1.5)
+    governor.charge(1.5)
+    with pytest.raises(AssertionError, match="max_cost_per_run"):
+        governor.try_reserve(0.5)
+
+
+def test_cost_governor_day_limit_is_shared(tmp_path) -> None:
+    ledger_path = tmp_path / "cost_ledger.json"
+    first = CostGovernor(max_cost_per_day=3.0, ledger_path=ledger_path)
+    second = CostGovernor(max_cost_per_day=3.0, ledger_path=ledger_path)
+    assert first.try_reserve(2.0) == 0
+    assert second.try_reserve(2.0) == _governor.COST_POLL_INTERVAL  # the reservation of the first run is in the way
+    first.release(2.0)
+    first.charge(2.5)
+    first.sync()  # e.g., at the end of the run
+    with pytest.raises(AssertionError, match="max_cost_per_day"):
+        second.try_reserve(1.0)
+    assert CostGovernor(max_cost_per_day=3.0, ledger_path=ledger_path).try_reserve(0.5) == 0
+
+
+def test_cost_governor_wait_for_next_day(tmp_path) -> None:
+    governor = CostGovernor(max_cost_per_day=1.0, wait_for_next_day=True, ledger_path=tmp_path / "cost_ledger.json")
+    governor.charge(1.0)
+    assert 0 < governor.try_reserve(0.5) <= 24 * 60 * 60
+
+
+def test_cost_governor_discards_reservations_of_dead_processes(tmp_path, monkeypatch) -> None:
+    ledger_path = tmp_path / "cost_ledger.json"
+    governor = CostGovernor(max_cost_per_day=3.0, ledger_path=ledger_path)
+    assert governor.try_reserve(2.0) == 0
+    monkeypatch.setattr(_governor, "_is_alive", lambda pid: False)  # e.g., the process crashed
+    assert CostGovernor(max_cost_per_day=3.0, ledger_path=ledger_path).try_reserve(2.0) == 0
+
+
+def test_cost_governor_batches_ledger_updates(tmp_path, monkeypatch) -> None:
+    ledger_path = tmp_path / "cost_ledger.json"
+    governor = CostGovernor(max_cost_per_day=100.0, ledger_path=ledger_path)
+    num_syncs = 0
+    ledger = CostGovernor._ledger
+
+    def counting_ledger(self):
+        nonlocal num_syncs
+        num_syncs += 1
+        return ledger(self)
+
+    monkeypatch.setattr(CostGovernor, "_ledger", counting_ledger)
+    for _ in range(10):
+        assert governor.try_reserve(1.0) == 0
+        governor.charge(0.5)
+        governor.release(1.0)
+    assert num_syncs == 1  # the requests are served from the lease in memory
+
+    governor.sync()
+    with open(ledger_path, "r", encoding="utf-8") as file:
+        record = json.load(file)
+    assert record["costs"] == {_governor._today(): 5.0}
+    assert list(record["reserved"].values()) == [0.0]  # the unused headroom is returned
@@ -0,0 +1,83 @@
+import logging
+import threading
+import time
+
+import pytest
+import requests
+
+from llms4de.model import _http, _retry
+from llms4de.model._http import http_post, http_get, close_connections
+from llms4de.model._mock_server import MockServer
+
+logger = logging.getLogger(__name__)
+
+
+def test_http_post_reuses_connections(mock_server: MockServer) -> None:
+    for _ in range(20):
+        http_response = http_post(f"{mock_server.url}/api/chat", json={"model": "llama3.1:8b-instruct-fp16"})
+        assert http_response.status_code == 200
+    assert mock_server.num_requests == 20
+    assert mock_server.num_connections == 1
+
+    assert http_get(f"{mock_server.url}/api/chat").status_code == 501  # mock server does not implement GET
+
+    close_connections()
+    http_post(f"{mock_server.url}/api/chat", json={})
+    assert mock_server.num_connections == 2
+
+
+def test_http_post_max_connections_per_host(mock_server: MockServer, monkeypatch) -> None:
+    monkeypatch.setattr(_http, "MAX_CONNECTIONS_PER_HOST", 4)
+    close_connections()
+    mock_server.latency = 0.02
+
+    def post() -> None:
+        for _ in range(5):
+            http_post(f"{mock_server.url}/api/chat", json={})
+
+    threads = [threading.Thread(target=post) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert mock_server.num_requests == 80
+    assert mock_server.num_connections <= 4
+
+
+def test_http_post_times_out_hung_requests(mock_server: MockServer, monkeypatch) -> None:
+    monkeypatch.setattr(_http, "READ_TIMEOUT", 0.2)
+    mock_server.slow_rate = 1.0
+    mock_server.slow_latency = 2.0
+    before = time.time()
+    with pytest.raises(requests.Timeout):
+        http_post(f"{mock_server.url}/api/chat", json={"model": "llama3.1:8b-instruct-fp16"})
+    assert time.time() - before < 1.0
+    assert _retry.is_retryable_error(requests.Timeout())
+
+    mock_server.slow_rate = 0.0
+    assert http_post(f"{mock_server.url}/api/chat", json={"model": "llama3.1:8b-instruct-fp16"}).status_code == 200
+
+
+def test_http_post_reads_proxies_from_environment_once_per_host(mock_server: MockServer, monkeypatch) -> None:
+    urls = []
+    get_environ_proxies = requests.sessions.get_environ_proxies
+
+    def recording_get_environ_proxies(url: str, **kwargs) -> dict:
+        urls.append(url)
+        return get_environ_proxies(url, **kwargs)
+
+    monkeypatch.setattr(requests.sessions, "get_environ_proxies", recording_get_environ_proxies)
+    close_connections()
+    for _ in range(5):
+        http_post(f"{mock_server.url}/api/chat", json={})
+    assert urls == [f"{mock_server.url}/api/chat"]
+
+    # explicit proxies are still merged with the environment
+    http_post(f"{mock_server.url}/api/chat", json={}, proxies={"no_proxy": "127.0.0.1,localhost"})
+    assert len(urls) == 2
+
+
+def test_bare_requests_open_new_connections(mock_server: MockServer) -> None:
+    for _ in range(5):
+        requests.post(f"{mock_server.url}/api/chat", json={})
+    assert mock_server.num_connections == 5
@@ -0,0 +1,67 @@
+import logging
+
+from llms4de.model import _journal
+from llms4de.model._journal import RunJournal
+
+logger = logging.getLogger(__name__)
+
+
+def test_run_journal(tmp_path) -> None:
+    path = tmp_path / "journal.jsonl"
+    with RunJournal(path, resume=False) as journal:
+        journal.record_submitted([("0.json", "a"), ("1.json", "b"), ("2.json", "c")])
+        journal.record_completed("0.json", "a")
+        journal.record_completed("1.json", "b")
+
+    with RunJournal(path, resume=True) as journal:
+        assert journal.is_completed("0.json", "a") and journal.is_completed("1.json", "b")
+        assert not journal.is_completed("0.json", "changed")  # the request has changed since
+        assert not journal.is_completed("2.json", "c")
+        assert journal.in_flight() == {"2.json"}
+        journal.record_submitted([("2.json", "c")])
+        journal.record_completed("2.json", "c")
+
+    with RunJournal(path, resume=True) as journal:
+        assert journal.is_completed("2.json", "c") and journal.in_flight() == set()
+
+    # a run without `resume` truncates the journal
+    with RunJournal(path, resume=False) as journal:
+        assert journal.completed == {} and journal.in_flight() == set()
+    assert path.read_text(encoding="utf-8") == '{"event": "start", "resume": false}\n'
+    with RunJournal(path, resume=True) as journal:
+        assert journal.completed == {}
+
+
+def test_run_journal_ignores_torn_records(tmp_path) -> None:
+    path = tmp_path / "journal.jsonl"
+    with RunJournal(path, resume=False) as journal:
+        journal.record_submitted([("0.json", "a"), ("1.json", "b")])
+        journal.record_completed("0.json", "a")
+    with open(path, "a", encoding="utf-8") as file:
+        file.write('{"event": "complete", "name": "1.js')  # crash while writing
+
+    with RunJournal(path, resume=True) as journal:
+        assert journal.is_completed("0.json", "a")
+        assert journal.in_flight() == {"1.json"}
+        journal.record_completed("1.json", "b")
+    with RunJournal(path, resume=True) as journal:
+        assert journal.is_completed("1.json", "b")
+
+
+def test_run_journal_syncs_in_batches(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(_journal, "JOURNAL_FSYNC_RECORDS", 10)
+    monkeypatch.setattr(_journal, "JOURNAL_FSYNC_INTERVAL", 3600)
+    num_syncs = 0
+    fsync = _journal.os.fsync
+
+    def counting_fsync(fd: int) -> None:
+        nonlocal num_syncs
+        num_syncs += 1
+        fsync(fd)
+
+    monkeypatch.setattr(_journal.os, "fsync", counting_fsync)
+    with RunJournal(tmp_path / "journal.jsonl", resume=False) as journal:
+        num_syncs = 0
+        for idx in range(100):
+            journal.record_completed(f"{idx}.json", "a")
+        assert num_syncs == 10
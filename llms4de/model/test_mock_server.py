@@ -0,0 +1,53 @@
+import logging
+import time
+
+import pytest
+
+from llms4de.model import _retry
+from llms4de.model._http import http_post
+from llms4de.model._mock_server import MockServer, MockServerProcess
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.mark.parametrize("path,remaining_header", [
+    ("/v1/chat/completions", "x-ratelimit-remaining-requests"),
+    ("/v1/messages", "anthropic-ratelimit-requests-remaining")
+])
+def test_mock_server_enforces_rate_limits(mock_server: MockServer, path: str, remaining_header: str) -> None:
+    mock_server.rpm = 5
+    mock_server.tpm = 1_000
+    request = {"model": "model", "messages": [{"role": "user", "content": "Name all prime numbers below 10!"}]}
+    for idx in range(5):
+        http_response = http_post(f"{mock_server.url}{path}", json=request)
+        assert http_response.status_code == 200
+        assert int(http_response.headers[remaining_header]) == 4 - idx
+        assert sum(1 for key in http_response.headers.keys() if "remaining" in key) == 2  # requests and tokens
+
+    http_response = http_post(f"{mock_server.url}{path}", json=request)
+    assert http_response.status_code == 429
+    assert 55 <= _retry.retry_delay(1, http_response.headers) <= 70  # until the budget is fully replenished
+    assert mock_server.num_rate_limit_errors == 1
+
+    # the budget is per model
+    assert http_post(f"{mock_server.url}{path}", json={**request, "model": "other"}).status_code == 200
+
+
+def test_mock_server_usage_and_latency_distribution(mock_server: MockServer) -> None:
+    mock_server.num_output_tokens = 100
+    mock_server.latency = 0.01
+    mock_server.latency_sigma = 1.0
+    request = {"model": "model", "messages": [{"role": "user", "content": "Hi!"}]}
+    latencies = []
+    for _ in range(20):
+        before = time.perf_counter()
+        response = http_post(f"{mock_server.url}/v1/messages", json=request).json()
+        latencies.append(time.perf_counter() - before)
+        assert response["usage"]["output_tokens"] == 100
+    assert max(latencies) > 2 * min(latencies)
+
+
+def test_mock_server_process() -> None:
+    with MockServerProcess(latency=0.01) as server:
+        assert http_post(f"{server.url}/api/chat", json={"model": "llama3.1:8b-instruct-fp16"}).status_code == 200
+    assert server.counters["num_requests"] == 1
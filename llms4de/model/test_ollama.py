@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+
+import pytest
+
+from llms4de.model import _ollama, generic
+from llms4de.model._mock_server import MockServer, MOCK_RESPONSE_TEXT
+from llms4de.model.conftest import mock_requests
+from llms4de.model.generic import execute_requests, extract_text_from_response
+
+logger = logging.getLogger(__name__)
+
+
+def test_ollama_concurrency_settles_at_num_parallel(mock_server: MockServer) -> None:
+    mock_server.latency = 0.05
+    mock_server.num_parallel = 4
+    mock_server._slots = threading.Semaphore(4)
+
+    requests = [{**request, "seed": idx} for idx, request in enumerate(mock_requests("llama3.1:8b-instruct-fp16") * 20)]
+    responses = execute_requests(requests, "ollama", force=1.0)
+    assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 200
+
+    concurrency = _ollama.ollama_concurrency()
+    assert 3 <= concurrency["limit"] <= 6
+    assert concurrency["throughput"] > 0
+    assert mock_server.max_num_running == 4
+
+
+def test_ollama_concurrency_limit_backs_off_when_queued() -> None:
+    def response(processing_seconds: float) -> _ollama._Response:
+        return _ollama._Response({"eval_duration": int(processing_seconds * 1e9)})
+
+    limit = _ollama._AdaptiveConcurrencyLimit()
+    now = time.time()
+    for _ in range(7):
+        limit.on_complete(now - 0.1, response(0.1), int(limit.limit), 200)  # no queueing -> slow start
+    assert int(limit.limit) == 8
+
+    limit.on_complete(now - 0.2, response(0.1), 8, 200)  # waited as long as it took to process -> decrease once
+    limit.on_complete(now - 0.2, response(0.1), 8, 200)
+    assert int(limit.limit) == 7 and limit.threshold == limit.limit
+
+    limit.on_complete(now - 0.1, response(0.1), 2, 200)  # limit not reached -> no increase
+    assert int(limit.limit) == 7
+
+    for _ in range(10):
+        limit.on_complete(now, None, 8, 404)  # e.g., an unknown model -> no decrease
+    assert int(limit.limit) == 7
+    limit.on_complete(time.time(), None, 8, 503)  # the server is overloaded -> decrease
+    assert int(limit.limit) == 6
+
+
+def test_ollama_balances_requests_across_hosts(mock_server: MockServer, monkeypatch) -> None:
+    with MockServer(latency=0.02) as server_1, MockServer(latency=0.02) as server_2:
+        servers = [mock_server, server_1, server_2]
+        monkeypatch.setattr(_ollama, "OLLAMA_URLS", [server.url for server in servers])
+        mock_server.latency = 0.02
+
+        requests = mock_requests("llama3.1:8b-instruct-fp16") * 6
+        requests = [{**request, "seed": idx} for idx, request in enumerate(requests)]
+        responses = execute_requests(requests, "ollama", force=1.0)
+        assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 60
+        assert sum(server.num_requests for server in servers) == 63  # including one preload request per server
+        assert all(host["healthy"] and host["num_outstanding"] == 0 for host in _ollama.ollama_hosts())
+
+    # the servers share the cache
+    monkeypatch.setattr(_ollama, "OLLAMA_URLS", [mock_server.url])
+    execute_requests(requests, "ollama", force=1.0)
+    assert sum(server.num_requests for server in servers) == 63
+
+
+def test_ollama_routes_requests_to_least_busy_host() -> None:
+    pool = _ollama._HostPool(["http://host-1", "http://host-2", "http://host-3"])
+    hosts = [pool.acquire(set()) for _ in range(3)]
+    assert [host.url for host in hosts] == ["http://host-1", "http://host-2", "http://host-3"]
+
+    pool.release(hosts[1], failed=False)
+    assert pool.acquire(set()) is hosts[1]  # the only host with fewer outstanding requests
+    assert pool.acquire(set()) is hosts[0]  # ties go to the first host
+    assert pool.acquire({"http://host-1", "http://host-2"}) is hosts[2]
+    assert [host["num_outstanding"] for host in pool.describe()] == [2, 1, 2]
+
+
+def test_ollama_fails_over_to_healthy_hosts(mock_server: MockServer, monkeypatch) -> None:
+    unavailable_server = MockServer().start()
+    port = unavailable_server._server.server_address[1]
+    unavailable_server.stop()
+    monkeypatch.setattr(_ollama, "OLLAMA_URLS", [unavailable_server.url, mock_server.url])
+    monkeypatch.setattr(_ollama, "HEALTH_CHECK_INTERVAL", 0)
+
+    requests = mock_requests("llama3.1:8b-instruct-fp16")
+    responses = execute_requests(requests, "ollama", force=1.0)
+    assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 10
+    assert mock_server.num_requests == 11
+    hosts = _ollama.ollama_hosts()
+    assert not hosts[0]["healthy"] and hosts[0]["num_failures"] > 0
+    assert hosts[1]["healthy"]
+
+    # the server is used again once it passes the health check
+    with MockServer(port=port) as restarted_server:
+        assert all(host["healthy"] for host in _ollama.ollama_hosts())
+        requests = [{**request, "seed": idx} for idx, request in enumerate(mock_requests("llama3.1:8b-instruct-fp16"))]
+        execute_requests(requests, "ollama", force=1.0)
+        assert restarted_server.num_requests > 1
+
+
+def test_ollama_executes_one_model_after_the_other(mock_server: MockServer) -> None:
+    mock_server.latency = 0.01
+    mock_server.model_load_latency = 0.1
+
+    requests = []
+    for request in mock_requests("llama3.1:8b-instruct-fp16"):
+        requests += [request, {**request, "model": "llama3.1:70b-instruct-fp16"}]
+    responses = execute_requests(requests, "ollama", force=1.0)
+    assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 20
+    assert mock_server.num_model_loads == 2
+    assert mock_server.num_requests == 22  # including one preload request per model
+
+    durations = _ollama.ollama_model_durations()
+    assert set(durations.keys()) == {"llama3.1:8b-instruct-fp16", "llama3.1:70b-instruct-fp16"}
+    for model_durations in durations.values():
+        assert model_durations["num_requests"] == 11
+        assert model_durations["load_seconds"] == pytest.approx(0.1, abs=0.05)
+        assert model_durations["eval_seconds"] > 0
+
+
+def test_ollama_preloads_next_model_while_requests_finish(mock_server: MockServer, monkeypatch) -> None:
+    mock_server.latency = 0.1
+    mock_server.latency_sigma = 1.0  # so that some requests are still running when the first ones finish
+    preload_model = _ollama._preload_model
+    num_running = []
+
+    def recording_preload_model(model: str, num_ctx: int) -> list:
+        num_running.append(mock_server.num_running)
+        return preload_model(model, num_ctx)
+
+    monkeypatch.setattr(_ollama, "_preload_model", recording_preload_model)
+    requests = []
+    for request in mock_requests("llama3.1:8b-instruct-fp16"):
+        requests += [request, {**request, "model": "llama3.1:70b-instruct-fp16"}]
+    execute_requests(requests, "ollama", force=1.0)
+    assert len(num_running) == 2
+    assert num_running[1] > 0  # the second model is preloaded before the requests of the first model have finished
+
+
+def test_ollama_preloads_each_context_size(mock_server: MockServer, monkeypatch) -> None:
+    monkeypatch.setattr(generic, "OLLAMA_NUM_CTX_BUCKETS", generic.OLLAMA_ADAPTIVE_NUM_CTX_BUCKETS)
+    mock_server.latency = 0.01
+    mock_server.model_load_latency = 0.1
+
+    requests = []
+    for request in mock_requests("llama3.1:8b-instruct-fp16"):
+        requests += [request, {**request, "max_tokens": 5_000}]  # num_ctx 2048 and 8192
+    responses = execute_requests(requests, "ollama", force=1.0)
+    assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 20
+    assert mock_server.num_model_loads == 2  # one load per context size, not per switch
+    assert mock_server.num_requests == 22  # including one preload request per context size
+    assert _ollama.ollama_model_durations()["llama3.1:8b-instruct-fp16"]["num_requests"] == 22
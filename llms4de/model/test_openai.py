@@ -0,0 +1,38 @@
+import logging
+
+import pytest
+import tiktoken
+
+from llms4de.model import _openai
+from llms4de.model._cache import open_cache, canonical_hash
+from llms4de.model._mock_server import MockServer, MOCK_RESPONSE_TEXT
+from llms4de.model.conftest import mock_requests, tiktoken_available
+from llms4de.model.generic import execute_requests, extract_text_from_response
+
+logger = logging.getLogger(__name__)
+
+
+def test_openai_cached_requests_are_not_tokenized(mock_server: MockServer, monkeypatch) -> None:
+    requests = mock_requests("gpt-4o-mini-2024-07-18")
+    open_cache(_openai.CACHE_PATH).store_many([
+        (canonical_hash(request), request, {"choices": [{"message": {"content": MOCK_RESPONSE_TEXT}}]})
+        for request in requests
+    ])
+
+    def get_encoding(model: str) -> None:
+        raise AssertionError("cached requests must not be tokenized")
+
+    monkeypatch.setattr(_openai, "_get_encoding_cached", get_encoding)
+    responses = execute_requests(requests, "openai", force=1.0)
+    assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 10
+    assert mock_server.num_requests == 0
+
+
+@pytest.mark.xfail(not tiktoken_available, reason="cannot count tokens without tiktoken encodings")
+def test_openai_count_input_tokens() -> None:
+    requests = [_openai._Request(request) for request in mock_requests("gpt-4o-mini-2024-07-18")]
+    _openai._count_input_tokens(requests)
+    encoding = tiktoken.encoding_for_model("gpt-4o-mini-2024-07-18")
+    for request in requests:
+        content = request.request["messages"][0]["content"]
+        assert request.num_input_tokens == len(encoding.encode(content)) + 5
@@ -0,0 +1,87 @@
+import logging
+
+import pytest
+
+from llms4de.model import _anthropic
+from llms4de.model._prefix import group_by_shared_prefix, prefix_elements
+
+logger = logging.getLogger(__name__)
+
+
+def _request(instructions: str, table: str, model: str = "claude-3-5-haiku-20241022") -> dict:
+    return {
+        "model": model,
+        "messages": [
+            {"role": "user", "content": instructions},
+            {"role": "user", "content": table}
+        ]
+    }
+
+
+def test_group_by_shared_prefix() -> None:
+    requests = [
+        _request("annotate columns", "table a"),
+        _request("match entities", "pair a"),
+        _request("annotate columns", "table b"),
+        _request("annotate columns", "table c"),
+        _request("match entities", "pair b"),
+        _request("other task", "x"),
+        _request("annotate columns", "table a", model="claude-3-5-sonnet-20241022")
+    ]
+    sizes = [1, 10, 2, 3, 10, 1, 1]
+    ordered, num_shared = group_by_shared_prefix(
+        list(range(len(requests))),
+        elements=lambda idx: prefix_elements(requests[idx]),
+        size=lambda idx: sizes[idx]
+    )
+
+    # the requests of each group run together, the largest group first, the largest request of a group first
+    assert ordered[:2] == [1, 4] and ordered[2:5] == [3, 2, 0]
+    assert num_shared[:5] == [2, 2, 2, 2, 2]  # model and instructions
+
+    # the other requests share only the model or nothing
+    assert dict(zip(ordered[5:], num_shared[5:])) == {5: 1, 6: 0}
+
+
+def test_prefix_elements() -> None:
+    request = {"model": "m", "system": "be brief", "messages": [{"role": "user", "content": "hi"}]}
+    assert prefix_elements(request) == [{"model": "m"}, {"system": "be brief"}, {"role": "user", "content": "hi"}]
+
+
+def test_anthropic_cache_breakpoint_at_shared_prefix() -> None:
+    request = _anthropic._Request({"system": "be brief", **_request("annotate " * 3_000, "table a")})
+    request.num_input_tokens = 3_010
+    assert request.payload() is request.request  # no shared prefix
+
+    request.num_shared_elements = 3  # model, system prompt, and instructions
+    payload = request.payload()
+    assert payload["system"] == "be brief"
+    assert payload["messages"][0]["content"] == [
+        {"type": "text", "text": "annotate " * 3_000, "cache_control": {"type": "ephemeral"}}
+    ]
+    assert payload["messages"][1] == {"role": "user", "content": "table a"}
+    assert request.request["messages"][0]["content"] == "annotate " * 3_000  # the cached request is unchanged
+
+    # prefixes that are too short to be cached do not get a breakpoint
+    request = _anthropic._Request(_request("annotate columns", "table a"))
+    request.num_input_tokens = 10
+    request.num_shared_elements = 2
+    assert request.payload() is request.request
+
+
+def test_anthropic_max_cost_includes_cache_writes() -> None:
+    request = _anthropic._Request({"max_tokens": 100, **_request("annotate " * 3_000, "table a")})
+    request.num_input_tokens = 3_010
+    max_cost = request.max_cost()
+    assert request.max_cost(10) < max_cost  # with the expected instead of the maximum output length
+
+    request = _anthropic._Request({"max_tokens": 100, **_request("annotate " * 3_000, "table a")})
+    request.num_input_tokens = 3_010
+    request.num_shared_elements = 2  # model and instructions
+    model_params = _anthropic.MODEL_PARAMETERS["claude-3-5-haiku-20241022"]
+    premium = model_params["cost_per_1k_cache_creation_input_tokens"] - model_params["cost_per_1k_input_tokens"]
+    assert request.max_cost() == pytest.approx(max_cost + request.shared_prefix_tokens() * premium / 1000)
+
+    # the budget states call `max_cost(...)` for every attempt, which must not build the payload again
+    request.payload = None
+    assert request.max_cost(10) < request.max_cost()
@@ -0,0 +1,32 @@
+import logging
+import time
+
+import pytest
+
+from llms4de.model import _anthropic, _replay
+from llms4de.model._cache import open_cache
+from llms4de.model._mock_server import MockServer
+from llms4de.model.conftest import mock_requests
+from llms4de.model.generic import execute_requests
+
+logger = logging.getLogger(__name__)
+
+
+def test_replay_recorded_responses_and_latencies(mock_server: MockServer, monkeypatch) -> None:
+    mock_server.latency = 0.2
+    requests = mock_requests("claude-3-5-haiku-20241022") + mock_requests("llama3.1:8b-instruct-fp16")
+    responses = execute_requests(requests[:10], "anthropic", force=1.0)
+    responses += execute_requests(requests[10:], "ollama", force=1.0)
+    latencies = open_cache(_anthropic.CACHE_PATH).latencies()
+    assert len(latencies) == 10 and all(0.2 <= latency < 1.0 for latency in latencies.values())
+    num_requests = mock_server.num_requests
+
+    # the replay takes as long as the recorded requests, but does not send any requests
+    monkeypatch.setattr(_replay, "REPLAY_MAX_RUNNING", 20)
+    before = time.perf_counter()
+    assert execute_requests(requests + requests[:2], "replay") == responses + responses[:2]
+    assert 0.2 <= time.perf_counter() - before < 5.0
+    assert mock_server.num_requests == num_requests
+
+    with pytest.raises(AssertionError):
+        execute_requests([{**requests[0], "temperature": 1}], "replay")  # not recorded
@@ -0,0 +1,104 @@
+import datetime
+import email.utils
+import logging
+import time
+
+import pytest
+import requests
+
+from llms4de.model import _retry
+from llms4de.model._mock_server import MockServer, MOCK_RESPONSE_TEXT
+from llms4de.model._retry import ConcurrencyLimit, is_retryable_error, is_retryable_status, retry_delay
+from llms4de.model.conftest import mock_requests
+from llms4de.model.generic import execute_requests, extract_text_from_response
+
+logger = logging.getLogger(__name__)
+
+
+def test_is_retryable() -> None:
+    assert all(is_retryable_status(status_code) for status_code in [429, 500, 502, 503, 504, 529])
+    assert not any(is_retryable_status(status_code) for status_code in [200, 400, 401, 404])
+    assert is_retryable_error(requests.ConnectionError())
+    assert is_retryable_error(requests.ReadTimeout())
+    assert not is_retryable_error(ValueError())
+
+
+def test_retry_delay_from_retry_after() -> None:
+    assert 2 <= retry_delay(1, {"retry-after": "2"}) <= 2 * (1 + _retry.JITTER)
+    assert 0.5 <= retry_delay(1, {"retry-after-ms": "500", "retry-after": "2"}) <= 0.5 * (1 + _retry.JITTER)
+    http_date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 28 <= retry_delay(1, {"retry-after": http_date}) <= 30 * (1 + _retry.JITTER) + 1
+
+
+def test_retry_delay_from_reset_headers() -> None:
+    headers = {
+        "x-ratelimit-remaining-requests": "10",
+        "x-ratelimit-reset-requests": "1m30s",
+        "x-ratelimit-remaining-tokens": "0",
+        "x-ratelimit-reset-tokens": "6.5s"
+    }
+    assert 6.5 <= retry_delay(1, headers) <= 6.5 * (1 + _retry.JITTER)
+
+    reset = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=20)
+    headers = {
+        "anthropic-ratelimit-output-tokens-remaining": "0",
+        "anthropic-ratelimit-output-tokens-reset": reset.isoformat().replace("+00:00", "Z")
+    }
+    assert 18 <= retry_delay(1, headers) <= 20 * (1 + _retry.JITTER)
+
+    assert _retry._parse_duration_or_timestamp("20ms") == pytest.approx(0.02)
+    assert _retry._parse_duration_or_timestamp("1h2m3s") == 3723
+
+
+def test_retry_delay_exponential_backoff(monkeypatch) -> None:
+    monkeypatch.setattr(_retry, "BACKOFF_BASE", 1.0)
+    monkeypatch.setattr(_retry, "BACKOFF_MAX", 10.0)
+    for attempt, cap in [(1, 1), (2, 2), (3, 4), (4, 8), (5, 10), (20, 10)]:
+        delays = [retry_delay(attempt, {}) for _ in range(100)]
+        assert all(cap / 2 <= delay <= cap for delay in delays)
+        assert len(set(delays)) > 1  # jitter
+
+
+def test_concurrency_limit() -> None:
+    concurrency = ConcurrencyLimit()
+    assert concurrency.allows(0) and not concurrency.allows(1)
+
+    for _ in range(15):  # slow start
+        concurrency.on_success(max_limit=100)
+    assert concurrency.limit == 16
+
+    started_at = time.time()
+    concurrency.on_rate_limit(started_at)
+    assert concurrency.limit == 8
+    concurrency.on_rate_limit(started_at - 1)  # was running before the last decrease
+    assert concurrency.limit == 8
+
+    for _ in range(8):  # additive increase
+        concurrency.on_success(max_limit=100)
+    assert 8.9 < concurrency.limit < 9.1
+
+    for _ in range(1_000):
+        concurrency.on_success(max_limit=20)
+    assert concurrency.limit == 20
+
+
+@pytest.mark.parametrize("model,api_name", [
+    ("claude-3-5-haiku-20241022", "anthropic"),
+    ("llama3.1:8b-instruct-fp16", "ollama")
+])
+def test_execute_requests_retries_injected_errors(
+        model: str,
+        api_name: str,
+        mock_server: MockServer,
+        monkeypatch
+) -> None:
+    monkeypatch.setattr(_retry, "BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(_retry, "MAX_ATTEMPTS", 20)
+    mock_server.rate_limit_rate = 0.3
+    mock_server.server_error_rate = 0.1
+    mock_server.retry_after = 0.05
+
+    requests = [{**request, "seed": idx} for idx, request in enumerate(mock_requests(model) * 3)]
+    responses = execute_requests(requests, api_name, force=1.0)
+    assert [extract_text_from_response(response) for response in responses] == [MOCK_RESPONSE_TEXT] * 30
+    assert mock_server.num_rate_limit_errors > 0 and mock_server.num_server_errors > 0
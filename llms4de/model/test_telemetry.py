@@ -0,0 +1,85 @@
+import json
+import logging
+import time
+
+import pytest
+import requests
+
+from llms4de.model import _telemetry
+from llms4de.model._mock_server import MockServer
+from llms4de.model._openai import _ModelBudgetState
+from llms4de.model._telemetry import Telemetry, prometheus_text, serve_prometheus
+from llms4de.model.conftest import FakeResponse, mock_requests
+from llms4de.model.generic import execute_requests
+
+logger = logging.getLogger(__name__)
+
+
+def test_telemetry(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(_telemetry, "TELEMETRY_PATH", tmp_path / "telemetry")
+    monkeypatch.setattr(_telemetry, "TELEMETRY_SAMPLE_INTERVAL", 0)
+    with Telemetry("test") as telemetry:
+        telemetry.on_cache(10, 4)
+        telemetry.on_budget("telemetry-model", _ModelBudgetState(60, 1_000, 59, 990, time.time()))
+        telemetry.on_bottleneck("telemetry-model", "tokens_per_minute")
+        time.sleep(0.05)
+        telemetry.on_bottleneck("telemetry-model", "starting")
+        telemetry.on_response("telemetry-model", 0.3, FakeResponse({"usage": 110, "output_usage": 10}))
+        telemetry.on_response("telemetry-model", None, object())
+        telemetry.on_retry("telemetry-model", "status 429")
+        telemetry.on_cost(0.5)
+
+    paths = list((tmp_path / "telemetry").glob("test-*.json"))
+    assert len(paths) == 1
+    with open(paths[0], "r", encoding="utf-8") as file:
+        record = json.load(file)
+    assert record["cache_hit_ratio"] == 0.4 and record["cost"] == 0.5
+    model_record = record["models"]["telemetry-model"]
+    assert model_record["bottleneck_seconds"]["tokens_per_minute"] >= 0.05
+    assert model_record["latency_buckets"]["0.5"] == 1 and model_record["latency_buckets"]["+Inf"] == 0
+    assert model_record["num_responses"] == 1 and model_record["num_failed"] == 1
+    assert model_record["num_retries"] == {"status 429": 1}
+    assert model_record["input_tokens"] == 100 and model_record["output_tokens"] == 10
+    assert model_record["budgets"][0]["r"] == 59 and model_record["budgets"][0]["concurrency"] == 1
+
+    # the Prometheus counters accumulate the runs of the process
+    text = prometheus_text()
+    assert 'llms4de_retries_total{model="telemetry-model",reason="status 429"} 1' in text
+    assert 'llms4de_request_latency_seconds_bucket{model="telemetry-model",le="0.25"} 0' in text
+    assert 'llms4de_request_latency_seconds_bucket{model="telemetry-model",le="+Inf"} 1' in text
+    assert 'llms4de_tokens_total{model="telemetry-model",direction="input"} 100' in text
+    assert 'llms4de_budget{model="telemetry-model",field="t"} 990' in text
+
+
+def test_serve_prometheus() -> None:
+    with Telemetry("test") as telemetry:
+        telemetry.on_bottleneck("served-model", "max_running")
+        server = serve_prometheus(port=0)
+        try:
+            response = requests.get(f"http://127.0.0.1:{server.server_address[1]}/metrics", timeout=10)
+            assert response.status_code == 200
+            assert 'llms4de_bottleneck_seconds_total{model="served-model",bottleneck="max_running"}' in response.text
+            response = requests.get(f"http://127.0.0.1:{server.server_address[1]}/other", timeout=10)
+            assert response.status_code == 404
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+@pytest.mark.parametrize("model,api_name", [
+    ("claude-3-5-haiku-20241022", "anthropic"),
+    ("llama3.1:8b-instruct-fp16", "ollama")
+])
+def test_execute_requests_writes_telemetry(model: str, api_name: str, mock_server: MockServer) -> None:
+    mock_server.latency = 0.05
+    execute_requests(mock_requests(model), api_name, force=1.0)
+    execute_requests(mock_requests(model)[:5], api_name, force=1.0)
+    records = []
+    for path in sorted(_telemetry.TELEMETRY_PATH.glob(f"{api_name}-*.json")):
+        with open(path, "r", encoding="utf-8") as file:
+            records.append(json.load(file))
+    assert [record["cache_hit_ratio"] for record in records] == [0.0]  # the fully cached run is not written
+    record = records[0]
+    assert record["models"][model]["num_responses"] == 10
+    assert sum(record["models"][model]["bottleneck_seconds"].values()) > 0.05
+    assert record["models"][model]["output_tokens"] > 0
@@ -19,6 +19,9 @@ if [ ! -d "data/aicore_cache" ]; then
     exit 1
 fi
 
+# migrate the cache directories to SQLite caches
+python tasks/migrate_caches.py
+
 # download datasets
 bash tasks/column_type_annotation/download.sh
 bash tasks/compound_task/download.sh
@@ -1,11 +1,18 @@
 import collections
 import logging
+import os
+import pathlib
 
 import hydra
 from omegaconf import DictConfig
 
 from llms4de.data import get_requests_dir, get_responses_dir, load_json, dump_json, dump_cfg
-from llms4de.model.generic import execute_requests, extract_finish_reason_from_response
+from llms4de.model._cache import canonical_hash
+from llms4de.model._governor import CostGovernor
+from llms4de.model._journal import RunJournal
+from llms4de.model import _telemetry
+from llms4de.model._telemetry import serve_prometheus
+from llms4de.model.generic import execute_requests_iter, extract_finish_reason_from_response
 
 logger = logging.getLogger(__name__)
 
@@ -14,28 +21,92 @@ _openai_request_seed: int = 321164097
 
 @hydra.main(version_base=None, config_name="config.yaml")  # specify config path via command line flag -cp
 def main(cfg: DictConfig) -> None:
+    resume = cfg.get("resume", False)
     requests_dir = get_requests_dir(cfg.task_name, cfg.dataset.dataset_name, cfg.exp_name)
-    responses_dir = get_responses_dir(cfg.task_name, cfg.dataset.dataset_name, cfg.exp_name, clear=True)
-
-    requests = []
+    # without `resume`, no responses of earlier runs must survive (and the journal is truncated)
+    responses_dir = get_responses_dir(cfg.task_name, cfg.dataset.dataset_name, cfg.exp_name, clear=not resume)
+    window_size = cfg.get("window_size", None)
+    mode = cfg.get("mode", "online")
+    hedge_percentile = cfg.get("hedge_percentile", None)
+    governor = None
+    if cfg.get("max_cost_per_run", None) is not None or cfg.get("max_cost_per_day", None) is not None:
+        governor = CostGovernor(
+            max_cost_per_run=cfg.get("max_cost_per_run", None),
+            max_cost_per_day=cfg.get("max_cost_per_day", None),
+            wait_for_next_day=cfg.get("wait_for_next_day", False)
+        )
+    if cfg.get("telemetry", False):  # stored with the responses, so files of earlier runs are cleared unless resuming
+        _telemetry.TELEMETRY_PATH = responses_dir / "telemetry"
+    if cfg.get("prometheus_port", None) is not None:
+        serve_prometheus(port=cfg.prometheus_port)
+
+    # keep only the names and hashes of the requests in memory, the requests are loaded again when they are executed
     request_names = []  # we need to remember these since sorting paths is not numerical
-    for request_path in list(sorted(requests_dir.glob("*.json"))):
-        requests.append(load_json(request_path))
+    request_hashes = []
+    for request_path in sorted(requests_dir.glob("*.json")):
         request_names.append(request_path.name)
+        request_hashes.append(canonical_hash(_load_request(request_path)))
 
-    for request in requests:
-        request["seed"] = _openai_request_seed
-
-    responses = execute_requests(requests, cfg.api_name)
+    # when resuming, keep the responses of the previous run, but remove those of requests that no longer exist
+    if resume:
+        request_names_set = set(request_names)
+        for response_path in responses_dir.glob("*.json"):
+            if response_path.name not in request_names_set:
+                response_path.unlink()
 
     num_failed = 0
     finish_reasons = collections.Counter()
-    for response in responses:
-        finish_reason = extract_finish_reason_from_response(response)
-        if finish_reason is not None:
-            finish_reasons[finish_reason] += 1
-        else:
-            num_failed += 1
+    with RunJournal(responses_dir / "journal.jsonl", resume=resume) as journal:
+
+        # when resuming, only re-verify the responses of the completed requests
+        idxs_to_execute = []
+        for idx, (request_name, request_hash) in enumerate(zip(request_names, request_hashes)):
+            response_path = responses_dir / request_name
+            if resume and journal.is_completed(request_name, request_hash) and response_path.is_file():
+                try:
+                    response = load_json(response_path)
+                except ValueError:
+                    logger.warning(f"response `{request_name}` is corrupted and will be executed again")
+                    idxs_to_execute.append(idx)
+                    continue
+                finish_reason = extract_finish_reason_from_response(response)
+                if finish_reason is not None:
+                    finish_reasons[finish_reason] += 1
+                else:
+                    num_failed += 1
+            else:
+                idxs_to_execute.append(idx)
+        if resume:
+            num_in_flight = len(journal.in_flight() & {request_names[idx] for idx in idxs_to_execute})
+            logger.info(
+                f"resume run: {len(request_names) - len(idxs_to_execute)} requests completed, {num_in_flight} in flight, "
+                f"{len(idxs_to_execute)} to execute"
+            )
+
+        journal.record_submitted([(request_names[idx], request_hashes[idx]) for idx in idxs_to_execute])
+
+        # write each response as soon as it is available so that a crash does not lose the finished responses
+        requests = (_load_request(requests_dir / request_names[idx]) for idx in idxs_to_execute)
+        for jdx, response in execute_requests_iter(
+                requests,
+                cfg.api_name,
+                window_size=window_size,
+                mode=mode,
+                hedge_percentile=hedge_percentile,
+                governor=governor
+        ):
+            idx = idxs_to_execute[jdx]
+            finish_reason = extract_finish_reason_from_response(response)
+            if finish_reason is not None:
+                finish_reasons[finish_reason] += 1
+            else:
+                num_failed += 1
+
+            # write to a temporary file first so that parsing the responses never sees incomplete files
+            tmp_path = responses_dir / f"{request_names[idx]}.tmp"
+            dump_json(response, tmp_path)
+            os.replace(tmp_path, responses_dir / request_names[idx])
+            journal.record_completed(request_names[idx], request_hashes[idx])
 
     for key in finish_reasons.keys():
         if key != "stop":
@@ -44,11 +115,14 @@ def main(cfg: DictConfig) -> None:
     if num_failed > 0:
         logger.warning(f"{num_failed} requests failed!")
 
-    for response, request_name in zip(responses, request_names):
-        dump_json(response, responses_dir / request_name)
-
     dump_cfg(cfg, responses_dir / "config.cfg")
 
 
+def _load_request(request_path: pathlib.Path) -> dict:
+    request = load_json(request_path)
+    request["seed"] = _openai_request_seed
+    return request
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,37 @@
+import logging
+
+import attrs
+import hydra
+from hydra.core.config_store import ConfigStore
+
+from llms4de.data import get_data_path
+from llms4de.model._cache import migrate_directory_cache
+
+logger = logging.getLogger(__name__)
+
+
+@attrs.define
+class Config:
+    caches: list[str] = ["openai_cache", "anthropic_cache", "ollama_cache"]
+    overwrite: bool = False  # whether to migrate into an existing SQLite cache
+
+
+ConfigStore.instance().store(name="config", node=Config)
+
+
+@hydra.main(version_base=None, config_name="config")
+def main(cfg: Config) -> None:
+    for cache_name in cfg.caches:
+        directory = get_data_path() / cache_name
+        if not directory.is_dir():
+            logger.info(f"skip `{cache_name}` since there is no cache directory")
+            continue
+        sqlite_path = directory.with_suffix(".sqlite")
+        if sqlite_path.is_file() and not cfg.overwrite:
+            logger.info(f"skip `{cache_name}` since `{sqlite_path.name}` already exists")
+            continue
+        migrate_directory_cache(directory, sqlite_path)
+
+
+if __name__ == "__main__":
+    main()
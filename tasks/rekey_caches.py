@@ -0,0 +1,36 @@
+import logging
+
+import attrs
+import hydra
+from hydra.core.config_store import ConfigStore
+
+from llms4de.data import get_data_path
+from llms4de.model._cache import rekey_cache
+
+logger = logging.getLogger(__name__)
+
+
+@attrs.define
+class Config:
+    caches: list[str] = ["openai_cache", "anthropic_cache", "ollama_cache"]
+
+
+ConfigStore.instance().store(name="config", node=Config)
+
+
+@hydra.main(version_base=None, config_name="config")
+def main(cfg: Config) -> None:
+    for cache_name in cfg.caches:
+        path = get_data_path() / cache_name
+        if not path.is_dir() and not path.with_suffix(".sqlite").is_file():
+            logger.info(f"skip `{cache_name}` since there is no cache")
+            continue
+        report = rekey_cache(path)
+        logger.info(
+            f"`{cache_name}`: {report['num_collapsed']} of {report['num_pairs']} pairs collapsed into duplicates "
+            f"({report['num_conflicting']} of them with a different response), {report['num_pairs_after']} pairs left"
+        )
+
+
+if __name__ == "__main__":
+    main()